@@ -1,14 +1,29 @@
+import sys
+
+if __name__ == '__main__': 
+    # the child process of --process starts from here too in a frozen (PyInstaller) build,
+    # freeze_support() does nothing otherwise and multiprocessing is slow to import
+    if getattr(sys, 'frozen', False):
+        import multiprocessing
+        multiprocessing.freeze_support()
+
+    # other arguments select the headless command line (python CSM.py run program.yaml ...),
+    # it is dispatched before Tk and the UI are imported so it starts without them
+    if sys.argv[1:] and sys.argv[1:] != ['--process']: 
+        import batch
+        sys.exit(batch.main())
+
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-from cpu import CPU, Hex
-import yaml
-import threading
-import time
-import sys
+from cpu import CPU, REGISTERS, FLIP_FLOPS, ACCOUNTING, psr_values
+from worker import Worker
+import loader
 
 class UI:
-    def __init__(self, cpu: CPU):
+    def __init__(self, cpu: CPU, worker = None):
+        # the simulation: a Worker thread on cpu, or remote.RemoteWorker with cpu its view
         self.cpu = cpu
+        self.worker = worker if worker is not None else Worker(cpu)
 
         # Main Window
         self.root = tk.Tk()
@@ -19,14 +34,17 @@ class UI:
         self.stop_requested = False
 
         # self.root.geometry("800x600")
-        self.registers_names = ["AR", "PC", "DR", "AC", "INPR", "IR", "TR", "TM", "PRC", "TAR", "TP", "NS", "OUTR", "SC", "PSR"]
-        self.flip_flops_names = ["I", "E", "R", "C", "SW", "IEN", "FGI", "FGO", "S", "GS", "A0", "A1"]
+        self.registers_names = list(REGISTERS)
+        self.flip_flops_names = list(FLIP_FLOPS)
         self.can_edit = {'AR', 'PC', 'PRC', 'INPR', 'NS', 'TAR', 'IEN', 'SW', 'FGI', 'FGO', 'S', 'GS'}
         self.prev_state = {}
 
         # self.prev_changed_values = self.registers_names + self.flip_flops_names
         self.prev_changed_values = [] 
         self.loading = False
+        self.run_pending = False     # the run button reads Stop
+        self.runs = 0               # runs submitted and not reported back, a stopped run reports late
+        self.was_busy = False
         # self.cpu.set_ui(self)
 
         memory_frame = tk.Frame(self.root)
@@ -44,9 +62,10 @@ class UI:
         smf.pack(side=tk.LEFT, anchor=tk.N)
         # Secondary Memory Table
         self.create_secondary_memory_table(smf)
+        self.create_accounting_table(smf)
         self.create_buttons(smf) 
 
-        def on_closing(): self.root.destroy(); sys.exit()
+        def on_closing(): self.worker.close(); self.root.destroy(); sys.exit()
         # Start the main loop
         self.ui_loop()
         self.update_ui()
@@ -54,66 +73,61 @@ class UI:
         self.root.mainloop()
 
 
-    def step_code(self, buttons = True):
-        def update_buttons(): 
-            self.load_button.config(state='disabled')
-            self.run_button.config(state='disabled')
-            self.step_button.config(state='disabled')
-            while self.cpu.stepping and not self.load_button: pass
-            if self.cpu.GS == 0: 
-                if not self.loading: messagebox.showinfo(message="Execution stopped/not started. Global Start is 0")
-                self.cpu.running = False
-                self.cpu.stepping = False
+    def step_code(self):
+        if self.worker.pending: return
+        self.worker.step()
+        self.load_button.config(state='disabled')
+        self.run_button.config(state='disabled')
+        self.step_button.config(state='disabled')
+        self.ui_loop_now()
 
-            self.load_button.config(state='normal')
-            self.run_button.config(state='normal')
-            self.step_button.config(state='normal')
-
-
-
-        if self.cpu.stepping == False: 
-            try: 
-                self.step_running = threading.Thread(target = self.cpu.run_next,daemon=True).start()
-            except ValueError as v: 
-                messagebox.showerror(message=v)
-            if buttons: threading.Thread(target=update_buttons, daemon=True).start()
-
-        # else: 
-        #     with self.cpu.lock: 
-        #         self.cpu.execute = True
+    def step_done(self): 
+        if self.cpu.GS == 0 and not self.loading: messagebox.showinfo(message="Execution stopped/not started. Global Start is 0")
 
+        self.load_button.config(state='normal')
+        self.run_button.config(state='normal')
+        self.step_button.config(state='normal')
 
     def run_code(self):
-        def run(): 
-            while self.cpu.running:
-                if self.cpu.stepping == False: 
-                    self.step_code(False)
-
-    
-                if self.cpu.GS == 0: 
-                    if not self.loading: messagebox.showinfo(message="Execution stopped/not started. Global Start is 0")
-                    self.load_button.config(state='normal')
-                    self.step_button.config(state='normal')
-                    self.run_button.config(text='Run')
-                    self.cpu.running = False
-                    break
-                time.sleep(0.1)
-        
-    
-        if self.cpu.running == False: 
-            self.cpu.running = True
+        if not self.run_pending: 
+            self.run_pending = True
+            self.runs += 1
+            self.worker.run()
             self.load_button.config(state='disabled')
             self.step_button.config(state='disabled')
             self.run_button.config(text='Stop')
-            threading.Thread(target=self.cpu.run_code, daemon=True).start()
+            self.ui_loop_now()
         else: 
-            self.load_button.config(state='normal')
-            self.step_button.config(state='normal')
-            self.run_button.config(text='Run')
-            self.cpu.running = False
-            if not self.cpu.GS: messagebox.showinfo(message="Execution stopped/not started. Global Start is 0")
-
-
+            # the run reports back once the instruction in progress is done (run_done)
+            self.worker.stop()
+            self.run_done()
+
+    def run_done(self): 
+        if not self.run_pending: return
+        self.run_pending = False
+        self.load_button.config(state='normal')
+        self.step_button.config(state='normal')
+        self.run_button.config(text='Run')
+        if not self.cpu.GS and not self.loading: messagebox.showinfo(message="Execution stopped/not started. Global Start is 0")
+
+    def command_done(self, command, error, value): 
+        # a command of the worker finished, called from ui_loop
+        if error is not None: messagebox.showerror(message=error)
+        if command == 'step': self.step_done()
+        elif command == 'run': 
+            self.runs -= 1
+            if not self.runs: self.run_done()
+        elif command == 'load': 
+            self.loading = False
+            for r in self.cpu.changed_vars: 
+                if r in self.registers: self.prev_state[r] = self.cpu.format_value(r)
+            self.update_ui()
+            self.update_selected_ui()
+        elif command in ('edit', 'step_back'): self.update_selected_ui()
+        elif command == 'restore': self.update_ui()
+        elif command in ('add_breakpoint', 'clear_breakpoints') and error is None: 
+            self.breakpoints_text.set(', '.join(value))
+        if command in ('step', 'run') and value is not None: self.breakpoint_hit(value)
 
     def load_program(self): 
         exp = tk.Tk()
@@ -126,88 +140,55 @@ class UI:
 
         print(f"{file_path} is loaded")
 
-        self.cpu.stepping = False
-        self.cpu.running = False
+        try: 
+            state = loader.load_image(file_path)
+        except ValueError as v:
+            messagebox.showerror(message=v)
+            state = None
+
+        # the worker loads once the run in progress (if any) is stopped
         self.loading = True
-        time.sleep(0.1)
-        self.cpu.__init__(self.cpu.clk)
+        self.worker.stop()
+        self.run_done()
+        self.worker.load(state)
+        self.ui_loop_now()
+    
 
-        self.cpu.changed_vars = []
-        try: 
-            file = open(file_path, 'r') 
-            config = yaml.safe_load(file)
-            if 'REG' in config: 
-                for r, v in config['REG'].items(): 
-                    if getattr(self.cpu, r, None) is None: raise ValueError(f"No such register as {r}")
-
-                    if r == 'PSR': 
-                        v = v.split('-')
-                        if len(v) != 7: raise ValueError("Invalid PSR register format")
-                        val = {'S': int(v[0])%2, 'A1': int(v[1])%2, 'A0': int(v[2])%2, 'E': int(v[3])%2, 
-                            'AC': Hex(str(v[4],3)).val, 'PC0': Hex(str(v[5])).val, 'PC': Hex(str(v[6])).val}
-                        setattr(self.cpu, r, val)
-                        self.prev_state[r] = val
-                    else: 
-                        setattr(self.cpu, r, Hex(str(v),self.cpu.bits[r]).val)
-                        self.prev_state[r] = Hex(str(v),self.cpu.bits[r]).val
-                    self.cpu.changed_vars.append(r)
-
-            if 'FF' in config: 
-                for f, v in config['FF'].items(): 
-                    if getattr(self.cpu, f, None) is None: raise ValueError(f"No such flip flop as {f}")
-                    setattr(self.cpu, f, int(v) % 2)
-                    self.cpu.changed_vars.append(f)
+    def save_state(self): 
+        if self.worker.pending: return
+        file_path = filedialog.asksaveasfilename(title="Save machine state", defaultextension=".csms", filetypes=(("Machine State", "*.csms"),))
+        if not file_path: return
 
-                
-            if 'M' in config: 
-                for l, v in config['M'].items(): 
-                    l = int(str(l), 16)
-                    if l > 255 or l < 0: raise ValueError(f"Address out of bounds")
-                    if isinstance(v, list): 
-                        for i, _v in enumerate(v): 
-                            _v = str(_v)
-                            if len(_v): 
-                                if len(_v.split()) <= 3: self.cpu.main_memory[i+l] = _v.strip()
-                                else: raise ValueError(f"Invalid instruction/operand at location {Hex(str(l)).val}: {_v.strip()}")
-                    else: 
-                        v = str(v)
-                        if len(v): 
-                            if len(v.split()) <= 3: self.cpu.main_memory[l] = v.strip()
-                            else: raise ValueError(f"Invalid instruction/operand at location {Hex(str(l)).val}: {v.strip()}")
-                        
-            if 'M2' in config: 
-                for l, p in config['M2'].items(): 
-                    l == int(l)
-                    if l >= 8 or l < 0: raise ValueError(f"Invalid M2 location {l}")
-
-                    cols = ['S', 'A1', 'A0', 'E', 'AC', 'PC0', 'PC']
-                    if any(c not in p for c in cols): raise ValueError(f"Invalid M2 configuration at location {l}")
-                    p['PC'] = Hex(str(p['PC'])).val
-                    p['PC0'] = Hex(str(p['PC0'])).val
-                    p['AC'] = Hex(str(p['AC']),3).val
-                    self.cpu.secondary_memory[l] = p 
-
-
-            if self.cpu.main_memory[8] == '': raise ValueError('Time value not specified at location 8')
-            self.cpu.TM = Hex(self.cpu.main_memory[8]).val
-            self.cpu.TP = Hex(str(len(config['M2'])),1).val if 'M2' in config else '1'
-            if not ('REG' in config and 'PC' in config['REG']): 
-                if self.cpu.secondary_memory[0]['PC'] != '': 
-                    self.cpu.PC = Hex(str(self.cpu.secondary_memory[0]['PC']), 2).val
-                    self.cpu.changed_vars.append('PC')
-
-            self.cpu.changed_vars.append('TM')
-            self.cpu.changed_vars.append('TP')
-        
-        except ValueError as v: 
-            messagebox.showerror(message=v)
-            self.cpu.__init__(self.cpu.clk)
+        self.worker.submit('save', file_path)
+        self.ui_loop_now()
+
+    def restore_state(self): 
+        if self.worker.pending: return
+        file_path = filedialog.askopenfilename(title="Restore machine state", filetypes=(("Machine State", "*.csms"),))
+        if not file_path: return
+
+        self.worker.submit('restore', file_path)
+        self.ui_loop_now()
+
+    def step_back(self): 
+        if self.worker.pending: return
+        self.worker.submit('step_back')
+        self.ui_loop_now()
+
+    def add_breakpoint(self): 
+        # the worker reports the breakpoints now set (command_done)
+        self.worker.submit('add_breakpoint', self.break_entry.get())
+        self.break_entry.delete(0, tk.END)
+        self.ui_loop_now()
+
+    def clear_breakpoints(self): 
+        self.worker.submit('clear_breakpoints')
+        self.ui_loop_now()
 
-        self.loading = False 
-        self.cpu.memory_ptr = 'PC'
+    def breakpoint_hit(self, hit): 
+        # a run stopped on a breakpoint, the controls are back already (run_done)
         self.update_ui()
-        self.update_selected_ui()
-    
+        messagebox.showinfo(message=f"Stopped: {hit}")
 
     def create_flip_flops_panel(self, frame):
 
@@ -226,14 +207,13 @@ class UI:
 
             if ff in self.can_edit: 
                 def on_change(event, ff_name, var_instance, show_error = False):
-                    if self.cpu.stepping: 
+                    if self.worker.pending: 
                         if show_error: messagebox.showerror("error", "can't change value during instruction execution")
                         var_instance.set(getattr(self.cpu, ff_name))
                         return "break"
                     
-                    setattr(self.cpu, ff_name, int(var_instance.get()) % 2)
-                    self.cpu.changed_vars = [ff_name]
-                    self.update_selected_ui()
+                    self.worker.submit('edit', 'register', ff_name, int(var_instance.get()) % 2)
+                    self.ui_loop_now()
 
                 entry.config(bg='yellow')
                 
@@ -259,12 +239,7 @@ class UI:
         self.registers = {}
         for i, reg in enumerate(self.registers_names):
             width = 12 if reg != 'PSR' else 17 
-            if reg == 'PSR':
-                psr_value = getattr(self.cpu, reg, {})
-                formatted_psr = '-'.join(str(value) for key, value in psr_value.items())
-                var = tk.StringVar(value=str(formatted_psr))
-            else:
-                var = tk.StringVar(value=str(getattr(self.cpu, reg)))
+            var = tk.StringVar(value=self.cpu.format_value(reg))
 
             lbl = tk.Label(registers_frame, text=f"{reg}:")
             lbl.grid(row=i, column=0, pady=1)
@@ -272,26 +247,22 @@ class UI:
             entry.grid(row=i, column=1, pady=1)
 
             self.registers[reg] = [var, entry]
-            self.prev_state[reg] = str(getattr(self.cpu, reg))
-
-            if reg == 'PSR': 
-                self.prev_state[reg] = '-'.join(str(value) for key, value in psr_value.items())
+            self.prev_state[reg] = self.cpu.format_value(reg)
 
             if reg in self.can_edit: 
                 def on_change(event, reg_name, var_instance, show_error = False):
-                    if self.cpu.stepping: 
+                    if self.worker.pending: 
                         if show_error: messagebox.showerror("error", "can't change value during instruction execution")
-                        var_instance.set(getattr(self.cpu, reg_name))
+                        var_instance.set(self.cpu.format_value(reg_name))
                         return "break"
 
                     val = var_instance.get()
                     if val == '' or val is None:
                         if show_error: messagebox.showerror("error", "can't assign an empty value")
-                    else: 
-                        setattr(self.cpu, reg_name, Hex(var_instance.get(), self.cpu.bits[reg_name]).val)
-                    
-                    self.cpu.changed_vars = [reg_name]
-                    self.update_selected_ui()
+                        var_instance.set(self.cpu.format_value(reg_name))
+                        return
+                    self.worker.submit('edit', 'register', reg_name, val)
+                    self.ui_loop_now()
 
 
                 entry.config(bg='yellow')
@@ -325,7 +296,7 @@ class UI:
         for address, value in enumerate(self.cpu.main_memory):
             self.main_memory_table.insert("", "end", values=(f"{address:02x}".upper(), value))
 
-        row_id = self.main_memory_table.get_children()[int(getattr(self.cpu, 'PC'),16)] 
+        row_id = self.main_memory_table.get_children()[self.cpu.PC] 
         self.main_memory_table.selection_set(row_id)  
         self.main_memory_table.focus(row_id)
         self.main_memory_table.see(row_id)
@@ -345,18 +316,42 @@ class UI:
 
         # Populate secondary memory table
         for row in self.cpu.secondary_memory:
-            self.secondary_memory_table.insert("", "end", values=list(row.values()))
+            self.secondary_memory_table.insert("", "end", values=psr_values(row))
         
         # pid = self.cpu.main_memory[int(getattr(self.cpu, 'PRC'))]
         # if pid != '': 
         #     pid = int(pid)
-        pid = int(getattr(self.cpu, 'TAR'))
+        pid = self.cpu.TAR
         row_id = self.secondary_memory_table.get_children()[pid] 
         self.secondary_memory_table.selection_set(row_id)  
         self.secondary_memory_table.focus(row_id)
         self.secondary_memory_table.see(row_id)
         self.secondary_memory_table.bind("<Double-1>", self.on_secondary_memory_edit)
 
+    def create_accounting_table(self, frame):
+        # scheduler accounting per pid (see CPU.accounting)
+        accounting_frame = tk.LabelFrame(frame, text="Processes", padx=10, pady=10)
+        accounting_frame.pack(side=tk.TOP, fill=tk.X)
+
+        columns = ("PID", "Instructions", "Scheduled", "AWT Waits", "I/O Interrupts")
+        self.accounting_table = ttk.Treeview(accounting_frame, columns=columns, show="headings", height=8)
+        for i, col in enumerate(columns):
+            self.accounting_table.heading(f"#{i+1}", text=col)
+            self.accounting_table.column(f"#{i+1}", width=40 if i == 0 else 80, anchor=tk.CENTER)
+        self.accounting_table.pack(fill=tk.BOTH, expand=True)
+
+        self.shown_accounting = [None] * 8
+        for pid in range(8):
+            self.accounting_table.insert("", "end", values=(pid,) + (0,) * len(ACCOUNTING))
+
+    def update_accounting(self): 
+        # rewrite only the rows whose counters moved since the last redraw
+        children = self.accounting_table.get_children()
+        for pid, row in enumerate(self.cpu.accounting): 
+            if row != self.shown_accounting[pid]: 
+                self.shown_accounting[pid] = list(row)
+                self.accounting_table.item(children[pid], values=[pid] + row)
+
     def create_buttons(self,frame): 
         # Create a frame for the buttons
         button_frame = tk.Frame(frame, padx=10, pady=10)
@@ -367,43 +362,150 @@ class UI:
         button_frame.columnconfigure(1, weight=1)
         button_frame.columnconfigure(2, weight=1)
         button_frame.columnconfigure(3, weight=1)
+        button_frame.columnconfigure(4, weight=1)
+        button_frame.columnconfigure(5, weight=1)
 
         # Create the buttons
         self.load_button = tk.Button(button_frame, text="Load", command=self.load_program)
         self.step_button = tk.Button(button_frame, text="Step", command=self.step_code)
         self.run_button = tk.Button(button_frame, text="Run", command=self.run_code)
+        self.save_button = tk.Button(button_frame, text="Save State", command=self.save_state)
+        self.restore_button = tk.Button(button_frame, text="Restore State", command=self.restore_state)
+        self.back_button = tk.Button(button_frame, text="Step Back", command=self.step_back)
+
+        # breakpoints: PC "20", watchpoint "M 0B", condition "TAR == 3" or "20: AC == 0"
+        self.break_entry = tk.Entry(button_frame, justify='center')
+        self.break_entry.bind("<Return>", lambda e: self.add_breakpoint())
+        break_button = tk.Button(button_frame, text="Break", command=self.add_breakpoint)
+        clear_break_button = tk.Button(button_frame, text="Clear Breaks", command=self.clear_breakpoints)
+        self.breakpoints_text = tk.StringVar()
+        breakpoints_label = tk.Label(button_frame, textvariable=self.breakpoints_text, anchor=tk.W)
 
 
+        # clock rate: one of the options or any rate typed in (e.g. "2500hz"), "max" is unthrottled
         selected_option = tk.StringVar()
-        selected_option.set(str(self.cpu.clk)+"hz")
-        options = ["0.2hz", "0.5hz", "1hz", "20hz"]
-        dropdown = tk.OptionMenu(button_frame, selected_option, *options)
-        dropdown.config(bg='white')
+        selected_option.set("max" if self.cpu.turbo else f"{self.cpu.clock.rate:g}hz")
+        options = ["0.1hz", "0.2hz", "0.5hz", "1hz", "20hz", "1000hz", "20000hz", "max"]
+        dropdown = ttk.Combobox(button_frame, textvariable=selected_option, values=options, width=9, justify='center')
+        # achieved vs requested clock rate of the run
+        self.clock_text = tk.StringVar()
+        clock_label = tk.Label(button_frame, textvariable=self.clock_text)
         
+        render_option = tk.StringVar()
+        render_option.set(f"{self.cpu.frame_rate}fps" if self.cpu.frame_rate else "every step")
+        render_dropdown = tk.OptionMenu(button_frame, render_option, "every step", "30fps")
+        render_dropdown.config(bg='white')
+        # a cpu in another process is only ever sampled at frame rate
+        if not self.worker.every_step: render_dropdown.config(state='disabled')
+
+        granularity_option = tk.StringVar()
+        granularity_options = {"micro-op": 0, "instruction": 1, "10 instructions": 10, "100 instructions": 100}
+        granularity_option.set({v: k for k, v in granularity_options.items()}.get(self.cpu.granularity, "micro-op"))
+        granularity_dropdown = tk.OptionMenu(button_frame, granularity_option, *granularity_options)
+        granularity_dropdown.config(bg='white')
+
         # Position the buttons in the grid
         self.load_button.grid(row=0, column=0, padx=5, pady=5, sticky="ew")
         self.step_button.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
         self.run_button.grid(row=0, column=2, padx=5, pady=5, sticky="ew")
+        self.save_button.grid(row=1, column=0, columnspan=2, padx=5, pady=5, sticky="ew")
+        self.restore_button.grid(row=1, column=2, columnspan=2, padx=5, pady=5, sticky="ew")
+        self.back_button.grid(row=1, column=4, padx=5, pady=5, sticky="ew")
         dropdown.grid(row=0, column=3, padx=5, pady=5, sticky="ew")
-
-        def clk_change(*args): self.cpu.clk = float(selected_option.get()[:-2])
-        selected_option.trace_add('write', clk_change)
+        render_dropdown.grid(row=0, column=4, padx=5, pady=5, sticky="ew")
+        clock_label.grid(row=0, column=5, padx=5, pady=5, sticky="ew")
+        granularity_dropdown.grid(row=1, column=5, padx=5, pady=5, sticky="ew")
+        self.break_entry.grid(row=2, column=0, columnspan=2, padx=5, pady=5, sticky="ew")
+        break_button.grid(row=2, column=2, padx=5, pady=5, sticky="ew")
+        clear_break_button.grid(row=2, column=3, padx=5, pady=5, sticky="ew")
+        breakpoints_label.grid(row=2, column=4, columnspan=2, padx=5, pady=5, sticky="ew")
+
+        def clk_change(*args): 
+            option = selected_option.get().strip().lower()
+            # "max" runs the cpu unthrottled (turbo), otherwise option is a clock rate
+            if option == "max": 
+                self.worker.configure(turbo=True)
+                return
+            try: 
+                self.worker.configure(turbo=False, rate=float(option.removesuffix("hz")))
+            except ValueError as v: 
+                messagebox.showerror(message=v)
+                selected_option.set("max" if self.cpu.turbo else f"{self.cpu.clock.rate:g}hz")
+        dropdown.bind("<<ComboboxSelected>>", clk_change)
+        dropdown.bind("<Return>", clk_change)
     
+        def render_change(*args): 
+            # "every step" waits for the UI at each micro-op, a frame rate lets the cpu run freely
+            option = render_option.get()
+            self.worker.configure(frame_rate=0 if option == "every step" else int(option[:-3]))
+        render_option.trace_add('write', render_change)
+
+        def granularity_change(*args): 
+            # how many instructions run between two visible updates, "micro-op" shows every block()
+            self.worker.configure(granularity=granularity_options[granularity_option.get()])
+        granularity_option.trace_add('write', granularity_change)
+
 
     def ui_loop(self): 
-        if cpu.update_ui: 
+        self.ui_loop_id = None
+        for command, error, value in self.worker.finished(): self.command_done(command, error, value)
+        busy = self.worker.pending > 0
+        if self.cpu.frame_rate: 
+            self.draw_frame()
+            if busy: self.cpu.request_frame()
+        elif self.cpu.update_ui: 
             # start = time.perf_counter()
             # self.update_ui(selected=False)
             self.update_selected_ui()
             # print(time.perf_counter() - start)
-            cpu.update_ui = False
+            self.cpu.ui_rendered()
         
-        # if self.cpu.stepping == False and self.cpu.running == False: 
-
-        self.root.after(5, self.ui_loop)
+        if busy and not self.cpu.turbo and self.cpu.clock.achieved is not None: 
+            achieved = self.cpu.clock.achieved
+            text = f"{achieved:.{0 if achieved >= 10 else 2}f}/{self.cpu.clock.rate:g}hz"
+            if text != self.clock_text.get(): self.clock_text.set(text)
+        # frames and turbo runs only sample the machine, draw where it finally stopped
+        if self.was_busy and not busy and (self.cpu.frame_rate or self.cpu.turbo or self.cpu.granularity): self.update_ui()
+        self.was_busy = busy
+
+        # poll at frame rate only while the cpu is busy, an idle machine has nothing to draw
+        interval = 1000 // self.cpu.frame_rate if self.cpu.frame_rate else 5
+        self.ui_loop_id = self.root.after(interval if busy else 200, self.ui_loop)
+
+    def ui_loop_now(self): 
+        # reschedule an idle (slow) ui_loop right away once the cpu starts working
+        if self.ui_loop_id is not None: self.root.after_cancel(self.ui_loop_id)
+        self.ui_loop_id = self.root.after(5, self.ui_loop)
     
 
-    def update_selected_ui(self): 
+    def draw_frame(self): 
+        # render the snapshot published by the cpu, highlighting everything changed since the last frame
+        frame = self.cpu.take_frame()
+        if frame is None: return
+        self.update_accounting()
+
+        self.clear_changed()
+        for r, val in frame['values'].items(): 
+            (var, entry) = self.registers[r] if r in self.registers else self.flip_flops[r]
+            var.set(val)
+            if r in frame['changed']: entry.config(bg='blue', fg='white')
+        self.prev_changed_values = list(frame['changed'])
+
+        children = self.main_memory_table.get_children()
+        for address, value in frame['memory'].items(): 
+            self.main_memory_table.item(children[address], values=(f"{address:02X}", value,))
+        row_id = children[frame['memory_ptr']]
+        self.main_memory_table.selection_set(row_id)  
+        self.main_memory_table.see(row_id)
+
+        children = self.secondary_memory_table.get_children()
+        for pid, values in frame['processes'].items(): 
+            self.secondary_memory_table.item(children[pid], values=values)
+        row_id = children[frame['TAR']]
+        self.secondary_memory_table.selection_set(row_id)  
+        self.secondary_memory_table.see(row_id)
+
+    def clear_changed(self): 
         for r in self.prev_changed_values: 
             entry = None
             if r in self.registers: 
@@ -415,6 +517,9 @@ class UI:
                 if r in self.can_edit: entry.config(bg='yellow', fg='black')
                 else: entry.config(bg='white', fg='black')
 
+    def update_selected_ui(self): 
+        self.clear_changed()
+
         for r in self.cpu.changed_vars: 
             entry = None
             if r in self.registers: 
@@ -429,25 +534,19 @@ class UI:
             if entry is not None : 
                 # breakpoint()
                 entry.config(bg='blue', fg='white')
-                if r == 'PSR': 
-                    cols = ['S', 'A1', 'A0', 'E', 'AC', 'PC0', 'PC']
-                    val = '-'.join([str(self.cpu.PSR[c]) for c in cols])
-                else: val = getattr(self.cpu, r)
-                var.set(val)
+                var.set(self.cpu.format_value(r))
         
         self.prev_changed_values = self.cpu.changed_vars.copy()
 
-        row_id = self.main_memory_table.get_children()[int(getattr(self.cpu, self.cpu.memory_ptr),16)] 
+        row_id = self.main_memory_table.get_children()[getattr(self.cpu, self.cpu.memory_ptr)] 
         self.main_memory_table.selection_set(row_id)  
         self.main_memory_table.focus(row_id)
         self.main_memory_table.see(row_id)
 
-        row_id = self.main_memory_table.get_children()[int(getattr(self.cpu, 'AR'),16)] 
-        address = getattr(self.cpu, 'AR')
-        row_id = self.main_memory_table.get_children()[int(address,16)] 
-        self.main_memory_table.item(row_id, values=(Hex(address).val, self.cpu.main_memory[int(address, 16)],))
+        self.update_dirty_rows()
+        self.update_accounting()
 
-        pid = int(getattr(self.cpu, 'TAR'))
+        pid = self.cpu.TAR
         # if pid != '': 
         #     pid = int(pid)
 
@@ -456,12 +555,16 @@ class UI:
         self.secondary_memory_table.focus(row_id)
         self.secondary_memory_table.see(row_id)
 
-        row = self.cpu.secondary_memory[pid].copy()
-        values = []
-        for col in ["S", "A1", "A0", "E", "AC", "PC0", "PC"]:
-            values.append(str(row[col]))
-        self.secondary_memory_table.item(row_id, values=values)
+    def update_dirty_rows(self): 
+        # only rewrite the memory/process table rows the cpu wrote since the last redraw
+        memory, processes = self.cpu.take_dirty()
+        children = self.main_memory_table.get_children()
+        for address in memory: 
+            self.main_memory_table.item(children[address], values=(f"{address:02X}", self.cpu.main_memory[address],))
 
+        children = self.secondary_memory_table.get_children()
+        for pid in processes: 
+            self.secondary_memory_table.item(children[pid], values=psr_values(self.cpu.secondary_memory[pid]))
 
     def clear_selected(self):
         for  _, entry in self.flip_flops.values():
@@ -472,6 +575,8 @@ class UI:
 
     def update_ui(self, selected = False):
         if self.loading: return
+        # rows of a frame that was published but not drawn yet are no longer dirty in the cpu
+        self.draw_frame()
         # if self.cpu.execute: return
         # if self.cpu.stepping: breakpoint() 
 
@@ -492,11 +597,7 @@ class UI:
         # Update registers
         mem_pointer = 'PC'
         for reg, (var, entry) in self.registers.items():
-            val = getattr(self.cpu, reg)
-            if reg == "PSR":
-                val =  '-'.join(str(value) for key, value in val.items())
-            else: 
-                val = str(val)
+            val = self.cpu.format_value(reg)
             if val != self.prev_state[reg]: 
                 # if reg == 'AR': mem_pointer = 'AR'
                 entry.config(bg='blue', fg='white')
@@ -508,22 +609,16 @@ class UI:
             var.set(val)
 
         # Update main memory
-        row_id = self.main_memory_table.get_children()[int(getattr(self.cpu, 'PC'),16)] 
+        row_id = self.main_memory_table.get_children()[self.cpu.PC] 
         self.main_memory_table.selection_set(row_id)  
         self.main_memory_table.focus(row_id)
         self.main_memory_table.see(row_id)
 
-        if selected: 
-            address = getattr(self.cpu, 'PC')
-            row_id = self.main_memory_table.get_children()[int(address,16)] 
-            self.main_memory_table.item(row_id, values=(address, self.cpu.main_memory[int(address, 16)],))
-
-        else: 
-            for address, (child, value) in enumerate(zip(self.main_memory_table.get_children(), self.cpu.main_memory)):
-                self.main_memory_table.item(child, values=(f"{address:02x}".upper(), value,))
+        self.update_dirty_rows()
+        self.update_accounting()
 
         # Update secondary memory
-        pid = int(getattr(self.cpu, 'TAR'))
+        pid = self.cpu.TAR
         # if pid != '': 
         #     pid = int(pid)
         row_id = self.secondary_memory_table.get_children()[pid] 
@@ -532,14 +627,8 @@ class UI:
         self.secondary_memory_table.focus(row_id)
         self.secondary_memory_table.see(row_id)
 
-        for i, (child, row) in enumerate(zip(self.secondary_memory_table.get_children(), self.cpu.secondary_memory)):
-            values = []
-            for col in ["S", "A1", "A0", "E", "AC", "PC0", "PC"]:
-                values.append(str(row[col]))
-            self.secondary_memory_table.item(child, values=values)
-
     def on_memory_edit(self, event):
-        if self.cpu.running or self.cpu.stepping: return
+        if self.worker.pending: return
 
         item_id = self.main_memory_table.identify_row(event.y)
         column = self.main_memory_table.identify_column(event.x)
@@ -559,7 +648,7 @@ class UI:
             self.main_memory_table.item(item_id, values=(self.main_memory_table.item(item_id, "values")[0], new_value))
             
             address = int(self.main_memory_table.item(item_id, "values")[0], 16)
-            self.cpu.main_memory[address] = new_value
+            self.worker.submit('edit', 'memory', address, new_value)
 
             entry.destroy()
 
@@ -567,7 +656,7 @@ class UI:
         entry.bind("<FocusOut>", lambda e: save_value())
 
     def on_secondary_memory_edit(self, event):
-        if self.cpu.running or self.cpu.stepping: return
+        if self.worker.pending: return
 
         item_id = self.secondary_memory_table.identify_row(event.y)
         column_id = int(self.secondary_memory_table.identify_column(event.x)[1:]) - 1
@@ -588,18 +677,19 @@ class UI:
                 return "break"
             
             if column_id in range(4): 
-                new_value = str(int(new_value) % 2)
+                new_value = int(new_value) % 2
             elif column_id == 4: 
-                new_value = Hex(str(new_value), 3).val
+                new_value = int(str(new_value), 16) & 0xFFF
             else: 
-                new_value = Hex(str(new_value)).val
+                new_value = int(str(new_value), 16) & 0xFF
+
+            address = (int(item_id[1:]) - 1) %8 
+            name = columns[column_id]
+            self.worker.submit('edit', 'process', (address, name), new_value)
 
             values =  list(self.secondary_memory_table.item(item_id, "values"))
-            values[column_id] = new_value
+            values[column_id] = psr_values(dict(self.cpu.secondary_memory[address], **{name: new_value}))[column_id]
             self.secondary_memory_table.item(item_id, values=values)
-            
-            address = (int(item_id[1:]) - 1) %8 
-            self.cpu.secondary_memory[address][columns[column_id]] = new_value
 
             entry.destroy()
 
@@ -609,5 +699,12 @@ class UI:
         entry.bind("<FocusOut>", lambda e: save_value())
 
 
-cpu = CPU()
-ui = UI(cpu)
\ No newline at end of file
+if __name__ == '__main__': 
+    # --process runs the cpu in a child process (remote.py)
+    if sys.argv[1:] == ['--process']: 
+        import remote
+        worker = remote.RemoteWorker()
+        ui = UI(worker.cpu, worker)
+    else: 
+        cpu = CPU()
+        ui = UI(cpu)
\ No newline at end of file
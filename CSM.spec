@@ -10,7 +10,8 @@ a = Analysis(
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    # numpy is optional (variants, see lockstep.py): bundled it would be unpacked on every start of the one-file EXE
+    excludes=['numpy'],
     noarchive=False,
     optimize=0,
 )
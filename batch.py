@@ -0,0 +1,298 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from functools import partial
+
+import loader
+import recorder
+from cpu import CPU, REGISTERS, FLIP_FLOPS, PSR_FIELDS, ACCOUNTING, psr_values
+
+
+DEFAULT_MAX_STEPS = 1000000
+HEADLESS_GRANULARITY = 1 << 30
+# steps between two checks of the time limit
+TIME_CHECK_STEPS = 1024
+
+
+def headless(state):
+    # cpu in the given state (see CPU.save_state): unthrottled, errors are kept in cpu.error
+    # and nothing is watching, so only whole instructions are committed
+    cpu = CPU(turbo=True)
+    cpu.granularity = HEADLESS_GRANULARITY
+    cpu.restore_state(state)
+    return cpu
+
+
+def load(path):
+    return headless(loader.load_image(path))
+
+
+def run(cpu, max_steps = DEFAULT_MAX_STEPS, deadline = None, engine = None):
+    # run_next until Global Start drops, an instruction fails, max_steps is reached
+    # or time.perf_counter() passes deadline. With an engine (compiler.BlockEngine)
+    # whole blocks of instructions run per call. A breakpoint hit ends the run too.
+    # Returns the steps run and whether the deadline ended the run
+    steps = 0
+    cpu.running = True
+    try:
+        if engine is not None:
+            check = TIME_CHECK_STEPS
+            while cpu.running and cpu.GS and cpu.error is None and steps < max_steps:
+                steps += engine.step(max_steps - steps)
+                if deadline is not None and steps >= check:
+                    if time.perf_counter() > deadline: return steps, True
+                    check = steps + TIME_CHECK_STEPS
+        while cpu.running and cpu.GS and cpu.error is None and steps < max_steps:
+            cpu.run_next()
+            steps += 1
+            if deadline is not None and steps % TIME_CHECK_STEPS == 0 and time.perf_counter() > deadline: return steps, True
+    finally:
+        cpu.running = False
+    return steps, False
+
+
+def dump_state(cpu):
+    # final machine state in the program schema (REG/FF/M/M2) with hex text values
+    return {
+        'REG': {r: cpu.format_value(r) for r in REGISTERS},
+        'FF': {f: getattr(cpu, f) for f in FLIP_FLOPS},
+        'M': {f"{address:02X}": word for address, word in enumerate(cpu.main_memory) if word != ''},
+        'M2': {pid: dict(zip(PSR_FIELDS, psr_values(row))) for pid, row in enumerate(cpu.secondary_memory) if row['PC'] is not None},
+    }
+
+
+def accounting(cpu):
+    # scheduler accounting of every process that exists or did something, by pid
+    return {pid: dict(zip(ACCOUNTING, row)) for pid, row in enumerate(cpu.accounting) if any(row) or cpu.secondary_memory[pid]['PC'] is not None}
+
+
+def run_program(path, max_steps = DEFAULT_MAX_STEPS, trace = None, max_seconds = None, compiled = False, breaks = ()):
+    # load and run one program, result holds the final state or the error that stopped it.
+    # trace is an optional file to stream the execution trace to (see recorder.py),
+    # compiled runs it on the block engine (see compiler.py), breaks are breakpoints to
+    # run until (see breakpoints.Breakpoints.add)
+    start = time.perf_counter()
+    deadline = None if max_seconds is None else start + max_seconds
+    result = {'program': path, 'steps': 0, 'halted': False, 'timed_out': False, 'error': None}
+    try:
+        cpu = load(path)
+        if breaks:
+            import breakpoints
+            stops = breakpoints.Breakpoints(cpu)
+            for text in breaks: stops.add(text)
+        engine = None
+        if compiled:
+            import compiler
+            engine = compiler.BlockEngine(cpu)
+        if trace:
+            # the engine falls back to run_next while a trace is recording
+            with recorder.Trace(cpu, trace):
+                result['steps'], result['timed_out'] = run(cpu, max_steps, deadline, engine)
+        else:
+            result['steps'], result['timed_out'] = run(cpu, max_steps, deadline, engine)
+    except Exception as e:
+        # any program that fails to load or run is reported as its error, it never aborts a batch
+        result['error'] = str(e)
+        result['seconds'] = time.perf_counter() - start
+        return result
+    result['halted'] = cpu.GS == 0
+    if cpu.breakpoints is not None:
+        result['breakpoint'] = cpu.breakpoints.hit
+    result['error'] = None if cpu.error is None else str(cpu.error)
+    result['seconds'] = time.perf_counter() - start
+    result['state'] = dump_state(cpu)
+    result['accounting'] = accounting(cpu)
+    return result
+
+
+def find_programs(paths):
+    # YAML programs given directly or found in the given directories, in a stable order
+    programs = []
+    for path in paths:
+        if os.path.isdir(path):
+            programs += sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(('.yaml', '.yml')))
+        else:
+            programs.append(path)
+    return programs
+
+
+def run_many(programs, max_steps = DEFAULT_MAX_STEPS, max_seconds = None, jobs = None, compiled = False):
+    # run every program in its own worker process, the report keeps the order of programs
+    from concurrent.futures import ProcessPoolExecutor
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = list(pool.map(partial(run_program, max_steps=max_steps, max_seconds=max_seconds, compiled=compiled), programs))
+    return {
+        'programs': len(results),
+        'halted': sum(r['halted'] for r in results),
+        'errors': sum(r['error'] is not None for r in results),
+        'timed_out': sum(r['timed_out'] for r in results),
+        'steps': sum(r['steps'] for r in results),
+        'cpu_seconds': sum(r['seconds'] for r in results),
+        'seconds': time.perf_counter() - start,
+        'results': results,
+    }
+
+
+def parse_vary(text):
+    # NAME=VALUES of the variants command: hex values and LO-HI ranges, comma separated
+    name, _, values = text.partition('=')
+    name = name.strip().upper()
+    cpu = CPU()
+    if name not in FLIP_FLOPS and name not in cpu.mask: raise argparse.ArgumentTypeError(f"Cannot vary {name}: not a numeric register or flip-flop")
+    mask = cpu.mask.get(name, 1)
+    out = []
+    try:
+        for item in values.split(','):
+            low, _, high = item.partition('-')
+            out.extend(range(int(low, 16), int(high or low, 16) + 1))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid values for {name}: {values}")
+    return name, sorted({value & mask for value in out})
+
+
+def write_json(data, out):
+    if out:
+        with open(out, 'w') as file:
+            json.dump(data, file, indent=2)
+    else:
+        json.dump(data, sys.stdout, indent=2)
+        print()
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog='CSM', description='Basic Computer Simulation, headless commands')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run a YAML program at full speed and dump the final state')
+    run_parser.add_argument('program', help='YAML program (REG/FF/M/M2)')
+    run_parser.add_argument('--max-steps', type=int, default=DEFAULT_MAX_STEPS, help='instructions to run at most')
+    run_parser.add_argument('--out', help='JSON file for the final state (default: stdout)')
+    run_parser.add_argument('--trace', help='file to record the execution trace to')
+    run_parser.add_argument('--max-seconds', type=float, help='wall time limit')
+    run_parser.add_argument('--compiled', action='store_true', help='run basic blocks compiled to Python functions')
+    run_parser.add_argument('--break', dest='breaks', action='append', default=[], help='run until a breakpoint: address (20), watched word (M 0B) or condition (TAR == 3, 20: AC == 0), repeatable')
+
+    batch_parser = commands.add_parser('batch', help='run many programs in parallel and report every final state')
+    batch_parser.add_argument('programs', nargs='+', help='YAML programs or directories of them')
+    batch_parser.add_argument('--max-steps', type=int, default=DEFAULT_MAX_STEPS, help='instructions to run at most per program')
+    batch_parser.add_argument('--max-seconds', type=float, help='wall time limit per program')
+    batch_parser.add_argument('--jobs', type=int, help='worker processes (default: one per core)')
+    batch_parser.add_argument('--compiled', action='store_true', help='run basic blocks compiled to Python functions')
+    batch_parser.add_argument('--out', help='JSON file for the report (default: stdout)')
+
+    sweep_parser = commands.add_parser('sweep', help='run a program under every combination of scheduling parameters')
+    sweep_parser.add_argument('program', help='YAML program (REG/FF/M/M2)')
+    sweep_parser.add_argument('--quantum', type=int, nargs='+', help='instructions between context switches (word 08)')
+    sweep_parser.add_argument('--order', nargs='+', help='process orders (words 00-07) as comma separated pids, e.g. 0,1 1,0')
+    sweep_parser.add_argument('--all-orders', action='store_true', help='every permutation of the program\'s process order')
+    sweep_parser.add_argument('--sw', type=int, nargs='+', choices=(0, 1), help='initial SW values')
+    sweep_parser.add_argument('--ien', type=int, nargs='+', choices=(0, 1), help='initial IEN values')
+    sweep_parser.add_argument('--max-steps', type=int, default=DEFAULT_MAX_STEPS, help='instructions to run at most per combination')
+    sweep_parser.add_argument('--jobs', type=int, help='worker processes (default: one per core)')
+    sweep_parser.add_argument('--json', action='store_true', help='print the results as JSON instead of a table')
+    sweep_parser.add_argument('--out', help='file for the results (default: stdout)')
+
+    variants_parser = commands.add_parser('variants', help='run every combination of register values in lockstep (needs numpy)')
+    variants_parser.add_argument('program', help='YAML program (REG/FF/M/M2)')
+    variants_parser.add_argument('--vary', type=parse_vary, action='append', required=True, help='NAME=VALUES, hex values or LO-HI ranges, e.g. INPR=0-FF (repeatable)')
+    variants_parser.add_argument('--max-steps', type=int, default=DEFAULT_MAX_STEPS, help='instructions to run at most per variant')
+    variants_parser.add_argument('--json', action='store_true', help='print every variant as JSON instead of a table')
+    variants_parser.add_argument('--out', help='file for the results (default: stdout)')
+
+    fuzz_parser = commands.add_parser('fuzz', help='compare the fast execution paths with the reference on random programs')
+    fuzz_parser.add_argument('--programs', type=int, default=1000, help='random programs to run')
+    fuzz_parser.add_argument('--steps', type=int, default=500, help='instructions to run at most per program')
+    fuzz_parser.add_argument('--paths', nargs='+', choices=('headless', 'compiled', 'lockstep'), help='paths to compare (default: all available)')
+    fuzz_parser.add_argument('--seed', type=int, default=0, help='seed of the first program')
+    fuzz_parser.add_argument('--jobs', type=int, help='worker processes (default: one per core)')
+    fuzz_parser.add_argument('--out', default='fuzz-out', help='directory for the reproducers of divergences')
+    fuzz_parser.add_argument('--replay', help='run one program file (e.g. a reproducer) on the paths instead')
+    fuzz_parser.add_argument('--json', action='store_true', help='print the results as JSON instead of a summary')
+
+    profile_parser = commands.add_parser('profile', help='run a program and report time and micro-ops per opcode')
+    profile_parser.add_argument('program', help='YAML program (REG/FF/M/M2)')
+    profile_parser.add_argument('--max-steps', type=int, default=DEFAULT_MAX_STEPS, help='instructions to run at most')
+    profile_parser.add_argument('--sort', choices=('seconds', 'calls', 'micro_ops', 'name'), default='seconds', help='table order')
+    profile_parser.add_argument('--json', action='store_true', help='print the results as JSON instead of a table')
+    profile_parser.add_argument('--out', help='file for the results (default: stdout)')
+
+    args = parser.parse_args(argv)
+    if args.command == 'profile':
+        import profiler
+        cpu = load(args.program)
+        # every micro-op has to go through block() to be counted
+        cpu.granularity = 0
+        with profiler.Profile(cpu) as profile:
+            steps, _ = run(cpu, args.max_steps)
+        results = profile.results(args.sort)
+        if args.json:
+            write_json({'program': args.program, 'steps': steps, 'error': None if cpu.error is None else str(cpu.error), 'results': results}, args.out)
+        elif args.out:
+            with open(args.out, 'w') as file:
+                file.write(profiler.table(results) + '\n')
+        else:
+            print(profiler.table(results))
+        return 1 if cpu.error else 0
+
+    if args.command == 'fuzz':
+        import fuzz
+        paths = args.paths or fuzz.available_paths()
+        if 'lockstep' in paths and 'lockstep' not in fuzz.available_paths(): parser.error('the lockstep path needs numpy')
+        if args.replay:
+            results = fuzz.replay(args.replay, paths, args.steps)
+            write_json(results, None)
+            return 1 if any(results.values()) else 0
+        results = fuzz.fuzz(args.programs, paths, args.steps, args.seed, args.jobs)
+        for divergence in results['divergences']:
+            divergence['reproducer'] = fuzz.write_reproducer(divergence, args.out)
+        if args.json: write_json(results, None)
+        else: print(fuzz.report(results))
+        return 1 if results['divergences'] else 0
+
+    if args.command == 'variants':
+        try:
+            import lockstep
+        except ImportError as e:
+            parser.error(f"variants needs numpy ({e})")
+        machines, combos = lockstep.variants(loader.load_image(args.program), dict(args.vary))
+        machines.run(args.max_steps)
+        results = lockstep.results(machines, combos)
+        if args.json:
+            write_json(results, args.out)
+        elif args.out:
+            with open(args.out, 'w') as file:
+                file.write(lockstep.table(results) + '\n')
+        else:
+            print(lockstep.table(results))
+        return 1 if any(r['error'] for r in results) else 0
+
+    if args.command == 'sweep':
+        import sweep
+        orders = [[int(pid) for pid in order.split(',')] for order in args.order or []]
+        if args.all_orders: orders += [list(order) for order in itertools.permutations(sweep.base_order(loader.load_image(args.program)))]
+        results = sweep.sweep(args.program, args.quantum, orders, args.sw, args.ien, args.max_steps, args.jobs)
+        if args.json:
+            write_json(results, args.out)
+        elif args.out:
+            with open(args.out, 'w') as file:
+                file.write(sweep.table(results) + '\n')
+        else:
+            print(sweep.table(results))
+        return 1 if any(r['error'] for r in results) else 0
+
+    if args.command == 'batch':
+        report = run_many(find_programs(args.programs), args.max_steps, args.max_seconds, args.jobs, args.compiled)
+        write_json(report, args.out)
+        return 1 if report['errors'] else 0
+
+    result = run_program(args.program, args.max_steps, args.trace, args.max_seconds, args.compiled, args.breaks)
+    write_json(result, args.out)
+    return 1 if result['error'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,303 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import batch
+import compiler
+import loader
+from cpu import CPU
+
+
+# Throughput benchmarks of the simulator core. Every benchmark is timed headless and
+# unthrottled (turbo), best of --repeat runs of at least --min-time seconds each.
+# Results can be saved as a baseline and later runs compared against it:
+#   python bench.py --save baseline.json
+#   python bench.py --compare baseline.json
+HERE = os.path.dirname(os.path.abspath(__file__))
+EXAMPLE = os.path.join(HERE, 'example_program.yaml')
+# first data word of the synthetic workloads, 4 words per process
+DATA = 0xE0
+# headless startup: a fresh interpreter loading the example (image cache warm) without running it
+STARTUP = [os.path.join(HERE, 'CSM.py'), 'run', EXAMPLE, '--max-steps', '0']
+# seconds the headless command line may take over the startup of a bare interpreter
+STARTUP_TARGET = 0.05
+
+
+def handler_config():
+    # a machine every handler can run on: 8 processes, pids in the order table,
+    # word 20 (the operand) a valid pid and number, quantum and interrupt vector at 08/09.
+    # Addresses and values are hex text as in a YAML program
+    return {
+        'REG': {'TP': 2},
+        'FF': {'GS': 1, 'S': 1},
+        'M': {'00': list(range(8)), '08': '4', '09': '30', '20': '1', '21': '5'},
+        'M2': {pid: {'PC': 30, 'PC0': 30, 'AC': 0, 'E': 0, 'A0': 0, 'A1': 0, 'S': 1} for pid in range(8)},
+    }
+
+
+def synthetic_config(processes = 8, quantum = 3, length = 12, seed = 0):
+    # multi-process workload that never halts: every process loops over a random mix of
+    # memory reference and register instructions on its own data words
+    rng = random.Random(seed)
+    memory = {'00': list(range(processes)), '08': f"{quantum:X}", '09': '30'}
+    rows = {}
+    for pid in range(processes):
+        start, data = 0x20 + pid * (length + 2), DATA + pid * 4
+        memory.update({f"{data:02X}": f"{rng.randrange(0x1000):03X}", f"{data + 1:02X}": f"{rng.randrange(0x1000):03X}", f"{data + 2:02X}": '0'})
+        code = []
+        for _ in range(length):
+            op = rng.choice(('LDA', 'CAL', 'STA', 'ISA', 'ADD', 'SUB', 'AND', 'OR', 'CIR', 'CIL', 'CMA', 'CME', 'CLE', 'ICA'))
+            if op in ('LDA', 'CAL'): code.append(f"{op} {data + rng.randrange(2):02X}")
+            elif op == 'STA': code.append(f"STA {data + 3:02X}")
+            elif op == 'ISA': code.append(f"ISA {data + 2:02X}")
+            else: code.append(op)
+        code.append(f"BR {start:02X}")
+        memory[f"{start:02X}"] = code
+        rows[pid] = {'PC': f"{start:02X}", 'PC0': f"{start:02X}", 'AC': 0, 'E': 0, 'A0': 0, 'A1': 0, 'S': 1}
+    return {'REG': {'TP': processes}, 'FF': {'GS': 1, 'S': 1, 'SW': 1}, 'M': memory, 'M2': rows}
+
+
+def machine(config = None, state = None, granularity = 0):
+    # turbo cpu, micro-op granularity unless asked otherwise
+    cpu = CPU(turbo=True)
+    if config is not None: cpu.load_config(config)
+    if state is not None: cpu.restore_state(state)
+    cpu.granularity = granularity
+    cpu.running = True
+    return cpu
+
+
+# benchmarks: setup() -> (cpu, call, instructions per call), cpu is None when no cpu is involved
+
+def fetch_decode_setup():
+    cpu = machine(handler_config())
+    cpu.write_memory(0x30, 'LDA 20')
+    def call():
+        cpu.PC = 0x30
+        cpu.fetch()
+        cpu.decode()
+    return cpu, call, 0
+
+
+def handler_setup(name):
+    def setup():
+        cpu = machine(handler_config())
+        handler = cpu.instruction_map[name]
+        def call():
+            cpu.AR, cpu.PRC, cpu.TP = 0x20, 0, 2
+            handler()
+        return cpu, call, 1
+    return setup
+
+
+def context_switch_setup():
+    cpu = machine(handler_config())
+    cpu.TP = 8
+    return cpu, cpu.contextSwitch, 1
+
+
+def io_interrupt_setup():
+    cpu = machine(handler_config())
+    def call():
+        cpu.PRC = 0
+        cpu.ioInterrupt()
+    return cpu, call, 1
+
+
+def run_setup(config = None, path = None, granularity = 0):
+    # end-to-end run_next, the program is reloaded when it halts so every call does work
+    def setup():
+        cpu = machine(config, loader.load_image(path) if path else None, granularity)
+        state = cpu.save_state()
+        def call():
+            if not cpu.GS or cpu.error is not None:
+                cpu.restore_state(state)
+                cpu.error = None
+            cpu.run_next()
+        return cpu, call, 1
+    return setup
+
+
+def block_setup(config = None, path = None, budget = 256):
+    # the same workloads on the block engine, every call runs up to budget instructions
+    def setup():
+        cpu = machine(config, loader.load_image(path) if path else None, batch.HEADLESS_GRANULARITY)
+        engine = compiler.BlockEngine(cpu)
+        state = cpu.save_state()
+        def call():
+            if not cpu.GS or cpu.error is not None:
+                cpu.restore_state(state)
+                cpu.error = None
+            batch.run(cpu, budget, engine=engine)
+            cpu.running = True
+        return cpu, call, budget
+    return setup
+
+
+def lockstep_setup(config, machines = 1000):
+    # one lockstep step of many copies of a workload that never halts, numpy is optional
+    def setup():
+        import lockstep
+        engine = lockstep.Lockstep.copies(machine(config).save_state(), machines)
+        return None, engine.step, machines
+    return setup
+
+
+def startup_setup(arguments):
+    # a fresh interpreter per call, calls/s is the inverse of the startup time
+    def setup():
+        def call():
+            subprocess.run([sys.executable] + arguments, stdout=subprocess.DEVNULL, check=True)
+        return None, call, 0
+    return setup
+
+
+def benchmarks():
+    suite = {'startup/python': startup_setup(['-c', 'pass']), 'startup/headless': startup_setup(STARTUP)}
+    suite['fetch-decode'] = fetch_decode_setup
+    for name in CPU().instruction_map:
+        suite[f"handler/{name}"] = handler_setup(name)
+    suite['contextSwitch'] = context_switch_setup
+    suite['ioInterrupt'] = io_interrupt_setup
+    for suffix, granularity in (('', 0), ('/instruction', batch.HEADLESS_GRANULARITY)):
+        suite[f"run/example{suffix}"] = run_setup(path=EXAMPLE, granularity=granularity)
+        suite[f"run/synthetic-2{suffix}"] = run_setup(synthetic_config(2, 8), granularity=granularity)
+        suite[f"run/synthetic-8{suffix}"] = run_setup(synthetic_config(8, 3), granularity=granularity)
+        suite[f"run/synthetic-8-q1{suffix}"] = run_setup(synthetic_config(8, 1), granularity=granularity)
+    suite['run/example/block'] = block_setup(path=EXAMPLE)
+    suite['run/synthetic-2/block'] = block_setup(synthetic_config(2, 8))
+    suite['run/synthetic-8/block'] = block_setup(synthetic_config(8, 3))
+    suite['run/synthetic-8-q1/block'] = block_setup(synthetic_config(8, 1))
+    try:
+        import numpy
+    except ImportError:
+        return suite
+    suite['lockstep/synthetic-2x1000'] = lockstep_setup(synthetic_config(2, 8))
+    suite['lockstep/synthetic-8x1000'] = lockstep_setup(synthetic_config(8, 3))
+    return suite
+
+
+def micro_ops_per_call(setup, calls = 2000):
+    # count block() calls on a separate cpu, so the timed runs stay uninstrumented
+    cpu, call, _ = setup()
+    if cpu is None: return 0
+    count = 0
+    block = cpu.block
+    def counting(*args, **kwargs):
+        nonlocal count
+        count += 1
+        return block(*args, **kwargs)
+    cpu.block = counting
+    for _ in range(calls): call()
+    return count / calls
+
+
+def measure(setup, min_time = 0.2, repeat = 5):
+    # calls per second, best of repeat timings of at least min_time each
+    best = 0
+    for _ in range(repeat):
+        cpu, call, _ = setup()
+        n = 64
+        while True:
+            start = time.perf_counter()
+            for _ in range(n): call()
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time: break
+            n = max(n * 2, int(n * min_time / elapsed * 1.1)) if elapsed > 0 else n * 2
+        best = max(best, n / elapsed)
+    return best
+
+
+def run_suite(match = None, min_time = 0.2, repeat = 5):
+    results = {}
+    for name, setup in benchmarks().items():
+        if match and not any(m in name for m in match): continue
+        rate = measure(setup, min_time, repeat)
+        _, _, instructions = setup()
+        results[name] = {
+            'calls_per_s': rate,
+            'instructions_per_s': rate * instructions,
+            'micro_ops_per_s': rate * micro_ops_per_call(setup),
+        }
+    return results
+
+
+def startup_overhead(results):
+    # seconds the headless command line takes over a bare interpreter, None when not measured
+    if 'startup/python' not in results or 'startup/headless' not in results: return None
+    return 1 / results['startup/headless']['calls_per_s'] - 1 / results['startup/python']['calls_per_s']
+
+
+def metadata():
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'system': platform.system(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def report(results, baseline = None, threshold = 10):
+    # text table, with the change against a baseline when one is given
+    lines = [f"{'benchmark':32} {'calls/s':>12} {'instr/s':>12} {'micro-ops/s':>12}" + (f" {'baseline':>12} {'change':>8}" if baseline else '')]
+    regressions = []
+    for name, r in results.items():
+        line = f"{name:32} {r['calls_per_s']:12.0f} {r['instructions_per_s']:12.0f} {r['micro_ops_per_s']:12.0f}"
+        if baseline:
+            old = baseline.get(name)
+            if old is None:
+                line += f" {'-':>12} {'new':>8}"
+            else:
+                change = (r['calls_per_s'] / old['calls_per_s'] - 1) * 100
+                line += f" {old['calls_per_s']:12.0f} {change:+7.1f}%"
+                if change < -threshold:
+                    line += '  SLOWER'
+                    regressions.append(name)
+        lines.append(line)
+    return '\n'.join(lines), regressions
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog='bench', description='Basic Computer Simulation, core throughput benchmarks')
+    parser.add_argument('-k', dest='match', action='append', help='only run benchmarks whose name contains this (repeatable)')
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds per timing run')
+    parser.add_argument('--repeat', type=int, default=5, help='timing runs per benchmark, the best one counts')
+    parser.add_argument('--save', help='write the results as a baseline JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to compare against')
+    parser.add_argument('--threshold', type=float, default=10, help='percent slower than the baseline that counts as a regression')
+    parser.add_argument('--startup-target', type=float, default=STARTUP_TARGET, help='seconds the headless startup may take over a bare interpreter')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON instead of a table')
+
+    args = parser.parse_args(argv)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)['results']
+
+    results = run_suite(args.match, args.min_time, args.repeat)
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump({'meta': metadata(), 'results': results}, file, indent=2)
+
+    table, regressions = report(results, baseline, args.threshold)
+    overhead = startup_overhead(results)
+    slow_start = overhead is not None and overhead > args.startup_target
+    if args.json:
+        json.dump({'meta': metadata(), 'results': results}, sys.stdout, indent=2)
+        print()
+    else:
+        print(table)
+        if overhead is not None: print(f"\nheadless startup: {overhead * 1000:.1f} ms over a bare interpreter (target {args.startup_target * 1000:g} ms)"
+            + ('  SLOWER' if slow_start else ''))
+        if regressions: print(f"\n{len(regressions)} benchmark(s) more than {args.threshold:g}% slower than the baseline")
+    return 1 if regressions or slow_start else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import operator
+import re
+
+from cpu import REGISTERS, FLIP_FLOPS
+
+
+# condition text: NAME OP VALUE, registers in hex, flip-flops 0/1
+CONDITION = re.compile(r'^\s*([A-Za-z]+)\s*(==|!=|<=|>=|<|>)\s*([0-9A-Fa-f]+)\s*$')
+OPERATORS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+
+class Condition:
+    # register condition on the machine state
+    def __init__(self, text):
+        match = CONDITION.match(text)
+        if match is None: raise ValueError(f"Invalid condition (NAME OP VALUE, e.g. TAR == 3): {text}")
+        name, op, value = match.groups()
+        self.name = name.upper()
+        if self.name not in REGISTERS and self.name not in FLIP_FLOPS or self.name in ('IR', 'PSR'):
+            raise ValueError(f"No such register or flip-flop as {name}")
+        self.op = OPERATORS[op]
+        self.value = int(value, 16) if self.name in REGISTERS else int(value)
+        self.text = f"{self.name} {op} {value.upper()}"
+        self.was = False
+
+    def holds(self, cpu):
+        return self.op(getattr(cpu, self.name), self.value)
+
+    def became_true(self, cpu):
+        # edge of the condition, so a run is not stopped on every step it stays true
+        now = self.holds(cpu)
+        rose = now and not self.was
+        self.was = now
+        return rose
+
+
+class Breakpoints:
+    # PC breakpoints, memory watchpoints and register conditions for run-until-hit.
+    # While any is set the cpu holds this (cpu.breakpoints) and calls check() after every
+    # step of a run, with none set cpu.breakpoints is None and runs pay nothing.
+    # Everything is looked up by address: at[PC] holds the breakpoints and conditions of an
+    # address (checked whenever PC gets there), watched[address] the watchpoints. Conditions
+    # without an address are checked on every step and stop the run when they become true
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.pcs = set()
+        self.watches = set()
+        self.conditions = []        # (address or None, Condition)
+        self.hit = None             # what stopped the last run
+        self.written = None         # watchpoint write of the step in progress
+        self.attach()
+
+    def attach(self):
+        # (re)build the index and hook into the cpu, needed after the cpu was reinitialised
+        self.at = [None] * 256
+        self.watched = [False] * 256
+        self.anywhere = [c for address, c in self.conditions if address is None]
+        for address in self.pcs:
+            self.at[address] = [None]
+        for address, condition in self.conditions:
+            if address is not None: self.at[address] = (self.at[address] or []) + [condition]
+        for address in self.watches:
+            self.watched[address] = True
+        self.cpu.breakpoints = self if self.pcs or self.watches or self.conditions else None
+
+    def add(self, text):
+        # PC breakpoint "20", watchpoint "M 0B", condition "TAR == 3" or condition at an address "20: AC == 0"
+        text = text.strip()
+        address = None
+        if ':' in text:
+            address, text = text.split(':', 1)
+            address = self._address(address)
+        if text.upper().startswith('M '):
+            self.watches.add(self._address(text[2:]))
+        elif CONDITION.match(text) or address is not None:
+            condition = Condition(text)
+            # a condition that already holds stops the run once it became false and true again
+            condition.was = condition.holds(self.cpu)
+            self.conditions.append((address, condition))
+        else:
+            self.pcs.add(self._address(text))
+        self.attach()
+
+    def clear(self):
+        self.pcs.clear()
+        self.watches.clear()
+        self.conditions.clear()
+        self.attach()
+
+    def describe(self):
+        return ([f"{address:02X}" for address in sorted(self.pcs)] + [f"M {address:02X}" for address in sorted(self.watches)]
+            + [f"{address:02X}: {c.text}" if address is not None else c.text for address, c in self.conditions])
+
+    @staticmethod
+    def _address(text):
+        try:
+            address = int(text.strip(), 16)
+        except ValueError:
+            raise ValueError(f"Invalid address: {text.strip()}")
+        if not 0 <= address <= 0xFF: raise ValueError(f"Address out of bounds: {text.strip()}")
+        return address
+
+    # hooks called by the cpu
+
+    def memory_written(self, address, value):
+        if self.watched[address] and self.cpu.running: self.written = f"M[{address:02X}] written: {value}"
+
+    def check(self):
+        # after a step of a run: stop the run when something was hit
+        cpu = self.cpu
+        if not cpu.running: return
+        hit, self.written = self.written, None
+        entries = self.at[cpu.PC]
+        if entries is not None:
+            for condition in entries:
+                if condition is None: hit = hit or f"Breakpoint at {cpu.PC:02X}"
+                elif condition.holds(cpu): hit = hit or f"{cpu.PC:02X}: {condition.text}"
+        for condition in self.anywhere:
+            if condition.became_true(cpu): hit = hit or condition.text
+        if hit is not None:
+            self.hit = hit
+            cpu.running = False
@@ -0,0 +1,65 @@
+import threading
+import time
+
+
+MIN_RATE, MAX_RATE = 0.1, 50000
+# further behind than this (seconds) the clock starts over instead of catching up in a burst
+MAX_LAG = 0.25
+# shortest time the achieved rate is measured over, seconds
+WINDOW = 1.0
+
+
+def check_rate(rate):
+    if not MIN_RATE <= rate <= MAX_RATE: raise ValueError(f"Clock rate out of range ({MIN_RATE:g}-{MAX_RATE:g} Hz): {rate:g}")
+
+
+class Clock:
+    # Paces the micro-ops of a throttled run. Ticks are due one period after the previous
+    # deadline rather than after the previous tick returned, so the time the simulation
+    # and the UI spend between ticks, and oversleeping, are taken out of the next wait and
+    # the rate holds on average even where single sleeps are too coarse for the period.
+    # Waits sleep on an event so stop() and set_rate() take effect right away
+    def __init__(self, rate = 1):
+        self.wakeup = threading.Event()
+        self.released = False       # stopped: ticks return at once until start()
+        self.deadline = None
+        self.rate = self.period = None
+        self.set_rate(rate)
+        self.start()
+
+    def set_rate(self, rate):
+        check_rate(rate)
+        self.rate = rate
+        self.period = 1 / rate
+        # a tick already waiting at the old rate is due one new period from now
+        if self.deadline is not None: self.deadline = time.perf_counter() + self.period
+        self.window_start, self.ticks = time.perf_counter(), 0
+        self.wakeup.set()
+
+    def start(self):
+        # called when a run or step starts, the achieved rate is measured from here
+        self.released = False
+        self.deadline = None
+        self.window_start, self.ticks = time.perf_counter(), 0
+        self.achieved = None
+
+    def stop(self):
+        # the run was stopped: let the instruction in progress finish without waiting
+        self.released = True
+        self.wakeup.set()
+
+    def tick(self):
+        now = time.perf_counter()
+        if self.deadline is None or now - self.deadline > MAX_LAG: self.deadline = now
+        self.deadline += self.period
+        while not self.released:
+            remaining = self.deadline - time.perf_counter()
+            if remaining <= 0: break
+            if self.wakeup.wait(remaining): self.wakeup.clear()
+
+        self.ticks += 1
+        elapsed = time.perf_counter() - self.window_start
+        # slow clocks report every tick
+        if elapsed >= WINDOW or self.period >= WINDOW:
+            self.achieved = self.ticks / elapsed
+            self.window_start, self.ticks = time.perf_counter(), 0
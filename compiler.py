@@ -0,0 +1,221 @@
+from cpu import INSTRUCTIONS
+
+
+# Basic block execution engine for headless runs. A block is a straight run of instructions
+# from main memory compiled into one Python function with the register effects of each
+# instruction inlined, instead of fetch/decode/handler/block() per micro-op. After every
+# instruction it applies the end of instruction semantics of block(last=True): the TM
+# countdown (C = SW at 0) and, after EI, R. It leaves the block where run_next would have
+# taken a context switch or an interrupt, so those always go through run_next.
+# Blocks end after a jump or skip (their PC is only known at run time), before an
+# instruction that is not compiled (process table instructions, HLT, undecodable words)
+# and after a write into the block itself.
+MAX_LENGTH = 64
+# mnemonics ending a block, they set PC
+TERMINATORS = {'BR', 'ISA', 'SZA', 'SZE', 'SKI', 'SKO', 'SPA'}
+# register instructions: mnemonic -> statements on the cpu (c)
+REGISTER_OPS = {
+    'CLE': ['c.E = 0'],
+    'CMA': ['c.AC = ~c.AC & 0xFFF'],
+    'CME': ['c.E = ~c.E % 2'],
+    'CIR': ['ac = c.AC', 'c.AC = (ac >> 1 | (c.E << 11)) & 0xFFF', 'c.E = ac & 1'],
+    'CIL': ['ac = c.AC', 'c.AC = ((ac << 1) & 0xFFF) | c.E', 'c.E = (ac >> 11) & 1'],
+    'ICA': ['c.AC = (c.AC + 1) & 0xFFF'],
+    'ESW': ['c.SW = 1'],
+    'DSW': ['c.SW = 0'],
+    'ADD': ['c.A0 = 0', 'c.A1 = 0'],
+    'SUB': ['c.A0 = 1', 'c.A1 = 0'],
+    'AND': ['c.A0 = 0', 'c.A1 = 1'],
+    'OR': ['c.A0 = 1', 'c.A1 = 1'],
+    'INP': ['c.AC = c.INPR', 'c.FGI = 0'],
+    'OUT': ['c.OUTR = c.AC & 0xF', 'c.FGO = 0'],
+    'EI': ['c.IEN = 1'],
+}
+# skip conditions: mnemonic -> expression
+SKIPS = {'SZA': 'c.AC == 0', 'SZE': 'c.E == 0', 'SKI': 'c.FGI == 1', 'SKO': 'c.FGO == 1'}
+COMPILED = set(REGISTER_OPS) | set(SKIPS) | {'CAL', 'LDA', 'STA', 'BR', 'ISA', 'UTM', 'SPA'}
+
+
+class BlockEngine:
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.blocks = {}                            # start address: function, None when not compilable
+        self.covering = [set() for _ in range(256)] # address: start addresses of blocks reading it
+        cpu.engine = self
+
+    def reset(self):
+        self.blocks.clear()
+        for starts in self.covering: starts.clear()
+
+    def invalidate(self, address):
+        # called by the cpu when a word is written
+        for start in self.covering[address]:
+            self.blocks.pop(start, None)
+        self.covering[address].clear()
+
+    def usable(self):
+        # blocks skip block() entirely: only for turbo runs at instruction granularity
+        # with nothing observing micro-ops (history, trace, profiler) or steps (breakpoints)
+        cpu = self.cpu
+        return (cpu.turbo and cpu.granularity and cpu.history is None and cpu.trace is None and cpu.breakpoints is None
+            and 'block' not in cpu.__dict__)
+
+    def step(self, budget):
+        # run at most budget steps, returns how many run_next would have taken
+        cpu = self.cpu
+        if not cpu.GS: return 0
+        if (cpu.C and cpu.SW) or not cpu.S or cpu.R or (cpu.IEN and (cpu.FGI or cpu.FGO)) or not self.usable():
+            cpu.run_next()
+            return 1
+
+        # blocks run back to back until one stops where run_next would switch or interrupt,
+        # nothing else changes the running process so it is accounted once
+        blocks = self.blocks
+        n = 0
+        try:
+            while n < budget:
+                start = cpu.PC
+                block = blocks[start] if start in blocks else self.compile(start)
+                if block is None: break
+                n += block(cpu, budget - n)
+                if (cpu.C and cpu.SW) or cpu.R: break
+        except ValueError as v:
+            # the failing instruction was fetched (PC is past it) and counts as a step
+            n += (cpu.PC - start) & 0xFF
+            cpu.error = v
+            if cpu.on_error is not None: cpu.on_error(v)
+        if n == 0:
+            cpu.run_next()
+            return 1
+
+        cpu.accounting[cpu.running_pid][INSTRUCTIONS] += n
+        cpu.memory_ptr = 'PC'
+        cpu.stepping = False
+        return n
+
+    def decode(self, address):
+        # (mnemonic, operand, indirect) of the word at address, None if it is not compiled
+        text = self.cpu.main_memory[address]
+        try:
+            _, operand, indirect = self.cpu.decode_word(text)
+        except ValueError:
+            return None
+        mnemonic = text.upper().split()[0]
+        if mnemonic not in COMPILED: return None
+        return mnemonic, operand, indirect
+
+    def compile(self, start):
+        instructions = []
+        address = start
+        while len(instructions) < MAX_LENGTH:
+            decoded = self.decode(address)
+            if decoded is None: break
+            instructions.append((address,) + decoded)
+            if decoded[0] in TERMINATORS or address == 0xFF: break
+            address += 1
+
+        block = None
+        if instructions:
+            block = self.generate(start, instructions)
+        self.blocks[start] = block
+        for address in range(start, start + max(len(instructions), 1)):
+            self.covering[address].add(start)
+        return block
+
+    def generate(self, start, instructions):
+        end = instructions[-1][0]
+        memory = self.cpu.main_memory
+        lines = ['def block(c, budget):', '    mem = c.main_memory', '    tm = c.TM']
+
+        def emit(*statements, indent = 1):
+            lines.extend('    ' * indent + s for s in statements)
+
+        def exit(n, pending, indent = 1):
+            # leave the block after n instructions with the deferred registers stored
+            emit(*[f"c.{name} = {value}" for name, value in pending.items()], 'c.TM = tm', 'c.SC = 0', f"return {n}", indent=indent)
+
+        for i, (address, mnemonic, operand, indirect) in enumerate(instructions):
+            n = i + 1
+            emit(f"# {address:02X}: {memory[address]}")
+            # fetch and decode, AR/IR/PC are only stored where they can be seen
+            pending = {'AR': address, 'IR': repr(memory[address]), 'PC': (address + 1) & 0xFF}
+            sc = 2
+            ar = address
+            if operand is not None:
+                ar = operand
+                sc = 3
+                if indirect:
+                    emit('c.I = 1', f"c.AR = {operand}", f"c.IR = {pending['IR']}", f"c.PC = {pending['PC']}", 'c.TM = tm', f"c.SC = {sc}")
+                    emit(f"ar = int(mem[{operand}], 16) & 0xFF", 'c.SC = 0')
+                    ar = 'ar'
+                    sc = 4
+            pending['AR'] = ar
+
+            def fallible(sc):
+                # store what run_next would have set before a word that may not parse is read
+                emit(*[f"c.{name} = {value}" for name, value in pending.items()], 'c.TM = tm', f"c.SC = {sc}")
+
+            decrement = True
+            if mnemonic in REGISTER_OPS:
+                emit(*REGISTER_OPS[mnemonic])
+            elif mnemonic in SKIPS:
+                pending['PC'] = 'pc'
+                emit(f"pc = {(address + 2) & 0xFF} if {SKIPS[mnemonic]} else {(address + 1) & 0xFF}")
+            elif mnemonic == 'CAL':
+                fallible(sc)
+                emit(f"dr = c.DR = int(mem[{ar}], 16) & 0xFFF", 'c.SC = 0', 'a0, a1 = c.A0, c.A1',
+                    'if a0 == 0 and a1 == 0: c.AC = (c.AC + dr) & 0xFFF',
+                    'elif a0 == 1 and a1 == 0: c.AC = (c.AC - dr) & 0xFFF',
+                    'elif a0 == 0 and a1 == 1: c.AC = c.AC & dr',
+                    'else: c.AC = c.AC | dr')
+            elif mnemonic == 'LDA':
+                fallible(sc)
+                emit(f"c.AC = c.DR = int(mem[{ar}], 16) & 0xFFF", 'c.SC = 0')
+            elif mnemonic == 'STA':
+                emit(f"c.write_memory({ar}, f\"{{c.AC:03X}}\")")
+            elif mnemonic == 'ISA':
+                fallible(sc)
+                emit(f"dr = c.DR = (int(mem[{ar}], 16) + 1) & 0xFFF", 'c.SC = 0', f"c.write_memory({ar}, f\"{{dr:03X}}\")",
+                    f"pc = {(address + 2) & 0xFF} if dr == c.AC else {(address + 1) & 0xFF}")
+                pending['PC'] = 'pc'
+            elif mnemonic == 'BR':
+                pending['PC'] = ar
+            elif mnemonic == 'UTM':
+                pending['AR'] = 8
+                fallible(sc + 1)
+                emit('tm = int(mem[8], 16) & 0xFF', 'c.SC = 0')
+                decrement = False
+            elif mnemonic == 'SPA':
+                emit('ar = c.PRC')
+                pending['AR'] = 'ar'
+                fallible(sc + 1)
+                emit(f"pc = {(address + 2) & 0xFF} if int(mem[ar], 16) & 0xFFF == c.AC else {(address + 1) & 0xFF}", 'c.SC = 0')
+                pending['PC'] = 'pc'
+
+            # end of instruction (block(last=True)): TM countdown, then leave the block
+            # wherever run_next would not fetch the next instruction
+            if mnemonic == 'EI':
+                emit('c.R = int(c.FGI or c.FGO)')
+            if decrement: emit('tm = (tm - 1) & 0xFF')
+            emit('if tm == 0:', '    c.C = c.SW', '    if c.SW:')
+            exit(n, pending, indent=3)
+            if mnemonic == 'ESW':
+                emit('if c.C:')
+                exit(n, pending, indent=2)
+            if mnemonic == 'EI':
+                emit('if c.R:')
+                exit(n, pending, indent=2)
+            if mnemonic in ('STA', 'ISA') and indirect:
+                # the block may have overwritten itself
+                emit(f"if {start} <= ar <= {end}:")
+                exit(n, pending, indent=2)
+            overwritten = mnemonic in ('STA', 'ISA') and not indirect and start <= ar <= end
+            if n == len(instructions) or mnemonic in TERMINATORS or overwritten:
+                exit(n, pending)
+                break
+            emit(f"if budget == {n}:")
+            exit(n, pending, indent=2)
+
+        namespace = {}
+        exec(compile('\n'.join(lines), f"<block {start:02X}>", 'exec'), namespace)
+        return namespace['block']
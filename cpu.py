@@ -1,61 +1,46 @@
-from time import sleep
-import inspect
 import threading
-from tkinter import messagebox
 
+from clock import Clock
 
-class Hex(): 
-    def __init__(self, val = '0', bits = 2): 
-        self.bits = bits
-        self.val = self._hex(int(val, 16))
 
-    def _hex(self, val):
-        if val < 0: 
-            val = pow(2, self.bits*4) - abs(val)
-        
-        val = hex(val)[2:]
-        val = val.rjust(self.bits, '0')
-        return val[-self.bits:].upper()
+# Registers and flip-flops shown by the UI and saved with the machine state
+REGISTERS = ("AR", "PC", "DR", "AC", "INPR", "IR", "TR", "TM", "PRC", "TAR", "TP", "NS", "OUTR", "SC", "PSR")
+FLIP_FLOPS = ("I", "E", "R", "C", "SW", "IEN", "FGI", "FGO", "S", "GS", "A0", "A1")
 
+# Columns of the PSR register and of every secondary memory (process table) row
+PSR_FIELDS = ('S', 'A1', 'A0', 'E', 'AC', 'PC0', 'PC')
+# hex digits of the PSR fields that hold register values, the rest are single bits
+PSR_DIGITS = {'AC': 3, 'PC0': 2, 'PC': 2}
+# per process counters kept in CPU.accounting[pid]: instructions executed, times scheduled
+# (context switch or SWT), AWT instructions spent waiting and I/O interrupts taken
+ACCOUNTING = ('instructions', 'scheduled', 'waits', 'interrupts')
+INSTRUCTIONS, SCHEDULED, WAITS, INTERRUPTS = range(len(ACCOUNTING))
 
-    def __add__(self, other): 
-        return self._hex(int(self.val, 16) + int(other.val, 16))
-        
 
-    def __sub__(self, other: 'Hex'): 
-        new_val = self._hex(-int(other.val, 16))
-        return self + Hex(new_val, self.bits)
-    
-    def __eq__(self, other): 
-        return int(self.val, 16) == int(other.val, 16)
-    
-    def __str__(self): 
-        return self.val
-    
-    def __and__(self, other): 
-        return self._hex(int(self.val, 16) & int(other.val, 16))
-    
-    def __or__(self, other): 
-        return self._hex(int(self.val, 16) | int(other.val, 16))
+def psr_values(row):
+    # display text of a PSR/secondary memory row, unset fields (None) are shown empty
+    return ['' if row[c] is None else f"{row[c]:0{PSR_DIGITS[c]}X}" if c in PSR_DIGITS else str(row[c]) for c in PSR_FIELDS]
 
 
 class CPU:
-    def __init__(self, freq = 1):
-        self.AR = Hex(bits=2).val   # Address Register (8 bits)
-        self.PC = Hex(bits=2).val     # Program Counter (8 bits)
-        self.DR = Hex(bits=3).val     # Data Register (12 bits)
-        self.AC = Hex(bits=3).val     # Accumulator (12 bits)
-        self.INPR = Hex(bits=1).val   # Input Register (8 bits)
-        self.IR = Hex(bits=3).val     # instruction Register (12 bits)
-        self.TR = Hex(bits=3).val     # Temporary Register (12 bits)
-        self.TM = Hex(bits=2).val     # Timer Register (8 bits)
-        self.PRC = Hex(bits=1).val    # Priority Register (3 bits)
-        self.TAR = Hex(bits=1).val    # Table Address Register (3 bits)
-        self.TP = Hex(bits=1).val     # Total Processes (3 bits)
-        self.NS = Hex(bits=1).val     # Number of Stops (3 bits)
-        self.OUTR = Hex(bits=1).val    # Output Register (8 bits)
-        self.SC = Hex(bits=1).val
-        self.PSR = {'S': 0, 'A1' : 0, 'A0' : 0, 'E': 0, 'AC': Hex('0',3).val, 'PC0': Hex('0').val, 'PC':Hex('0').val}
+    def __init__(self, freq = 1, turbo = False, frame_rate = 0, granularity = 0):
+        # Registers are plain ints masked to their width in self.bits,
+        # hex text is only produced for the UI/YAML (see format_value)
+        self.AR = 0     # Address Register (8 bits)
+        self.PC = 0     # Program Counter (8 bits)
+        self.DR = 0     # Data Register (12 bits)
+        self.AC = 0     # Accumulator (12 bits)
+        self.INPR = 0   # Input Register (8 bits)
+        self.IR = ''    # instruction Register (text of the fetched word)
+        self.TR = 0     # Temporary Register (12 bits)
+        self.TM = 0     # Timer Register (8 bits)
+        self.PRC = 0    # Priority Register (3 bits)
+        self.TAR = 0    # Table Address Register (3 bits)
+        self.TP = 0     # Total Processes (3 bits)
+        self.NS = 0     # Number of Stops (3 bits)
+        self.OUTR = 0   # Output Register (8 bits)
+        self.SC = 0
+        self.PSR = {'S': 0, 'A1' : 0, 'A0' : 0, 'E': 0, 'AC': 0, 'PC0': 0, 'PC': 0}
 
         # Flip-Flops
         self.I = 0      # Interrupt Flip-Flop
@@ -70,29 +55,71 @@ class CPU:
         self.GS = 0     # General Status Flip-Flop
         self.A0 = 0     # A0 Flip-Flop
         self.A1 = 0     # A1 Flip-Flop
-        self.clk = freq
-
+        # paces throttled runs at freq micro-ops per second (clock.Clock)
+        self.clock = Clock(freq)
+        # called with the ValueError that aborted an instruction, None leaves it in self.error
+        # (the UI reports it from there, see worker.py)
+        self.on_error = None
+        self.error = None
+        # undo log (history.History) fed by block(), None when stepping back is not needed
+        self.history = None
+        # breakpoints and watchpoints (breakpoints.Breakpoints), None while none are set
+        self.breakpoints = None
+        # compiled block engine (compiler.BlockEngine), told about every memory write
+        self.engine = None
+        # execution trace (recorder.Trace) fed by block(), None when not recording
+        self.trace = None
+        self.turbo = turbo # run unthrottled: no clock sleep, no UI handshake
+        # frames per second the UI samples the machine at, 0 renders every micro-op.
+        # With frames the cpu never waits for the UI: it publishes self.frame when the
+        # UI raises frame_requested, with frame_vars holding all changed_vars since then
+        self.frame_rate = frame_rate
+        self.frame_requested = False
+        self.frame = None
+        self.frame_vars = set()
+        # instructions per visible update, 0 commits (and shows) every micro-op. Otherwise
+        # block() only keeps the end of instruction semantics (TM/C, R, memory_ptr) and the
+        # changed variables are worked out against shown once per update (see changes_since_shown)
+        self.granularity = granularity
+        self.coarse = False
+        self.instructions = 0
+        self.shown = {}
 
         self.running = False
         self.execute = False
         self.stepping = False
         self.lock = threading.Lock()
         self.ui = None
+        # update_ui is raised by block() and cleared by the UI through ui_rendered(),
+        # the simulation thread sleeps on ui_cond in between instead of spinning
         self.update_ui = False 
+        self.ui_cond = threading.Condition()
         self.memory_ptr = 'AR'
 
         # Main Memory (256 words, each 12 bits)
 
         self.main_memory = [''] * 256
+        # decoded (handler, operand, indirect) of each word, None until the word is first
+        # executed and reset whenever it is written (see write_memory)
+        self.decoded = [None] * 256
 
         # Secondary Memory (8 rows, 7 columns)
         # Each row represents a tuple: (S, A1, A0, E, AC, PC0, PC)
         self.secondary_memory = [
-            {'S': '', 'A1' : '', 'A0' : '', 'E': '', 'AC': '', 'PC0': '', 'PC': ''} for _ in range(8)
+            {'S': None, 'A1' : None, 'A0' : None, 'E': None, 'AC': None, 'PC0': None, 'PC': None} for _ in range(8)
         ]
 
         self.changed_vars = []
+        # scheduler accounting, one row of ACCOUNTING counters per pid. running_pid is
+        # the process in the order table at PRC, the one instructions are charged to
+        self.accounting = [[0] * len(ACCOUNTING) for _ in range(8)]
+        self.running_pid = 0
+        # main memory addresses and secondary memory rows written since the UI last
+        # redrew them (see take_dirty), everything is dirty after a reset
+        self.dirty_memory = set(range(256))
+        self.dirty_processes = set(range(8))
         ## OTHER GLOBAL VARIABLE
+        # register widths in hex digits
         self.bits = {
             'AR' : 2, # Address Register (8 bits)
             'PC' : 2, # Program Counter (8 bits)
@@ -106,8 +133,10 @@ class CPU:
             'TAR' : 1, # Table Address Register (3 bits)
             'TP' : 1, # Total Processes (3 bits)
             'NS' : 1, # Number of Stops (3 bits)
-            'OUT' : 1 # Output Register (8 bits)
+            'OUTR' : 1, # Output Register (8 bits)
+            'SC' : 1, # Sequence Counter
         }
+        self.mask = {r: (1 << 4*b) - 1 for r, b in self.bits.items()}
 
         self.instruction_map = {
             "AND": self.AND_instruction,
@@ -145,533 +174,732 @@ class CPU:
         }
 
 
+    def format_value(self, name):
+        # hex text of a register (flip-flops as 0/1) for the UI and YAML boundary
+        val = getattr(self, name)
+        if name == 'PSR': return '-'.join(psr_values(val))
+        if name in self.bits and isinstance(val, int): return f"{val:0{self.bits[name]}X}"
+        return str(val)
+
+    def set_value(self, name, text):
+        # inverse of format_value for registers and flip-flops typed in by the user
+        if name in self.bits:
+            setattr(self, name, int(str(text), 16) & self.mask[name])
+        else:
+            setattr(self, name, int(text) % 2)
+        if name == 'PRC': self.running_pid = self.current_pid()
+
+    def load_config(self, config):
+        # initialise the machine from a parsed program (REG/FF/M/M2 sections, see README),
+        # a program of the wrong shape raises ValueError like any other invalid program
+        try:
+            self._load_config(config)
+        except (TypeError, AttributeError, KeyError) as e:
+            raise ValueError(f"Invalid program: {e}")
+
+    def _load_config(self, config):
+        for section in ('REG', 'FF', 'M', 'M2'):
+            if section in config and not isinstance(config[section], dict): raise ValueError(f"Section {section} must be a mapping")
+        self.changed_vars = []
+        if 'REG' in config:
+            for r, v in config['REG'].items():
+                if getattr(self, r, None) is None: raise ValueError(f"No such register as {r}")
+
+                if r == 'PSR':
+                    if not isinstance(v, str): raise ValueError("Invalid PSR register format")
+                    v = v.split('-')
+                    if len(v) != 7: raise ValueError("Invalid PSR register format")
+                    val = {'S': int(v[0])%2, 'A1': int(v[1])%2, 'A0': int(v[2])%2, 'E': int(v[3])%2,
+                        'AC': int(str(v[4]), 16) & 0xFFF, 'PC0': int(str(v[5]), 16) & 0xFF, 'PC': int(str(v[6]), 16) & 0xFF}
+                    self.PSR = val
+                else:
+                    self.set_value(r, v)
+                self.changed_vars.append(r)
+
+        if 'FF' in config:
+            for f, v in config['FF'].items():
+                if getattr(self, f, None) is None: raise ValueError(f"No such flip flop as {f}")
+                setattr(self, f, int(v) % 2)
+                self.changed_vars.append(f)
+
+
+        if 'M' in config:
+            for l, v in config['M'].items():
+                l = int(str(l), 16)
+                if l > 255 or l < 0: raise ValueError(f"Address out of bounds")
+                if isinstance(v, list):
+                    for i, _v in enumerate(v):
+                        _v = str(_v)
+                        if len(_v):
+                            if i+l > 255: raise ValueError(f"Address out of bounds")
+                            if len(_v.split()) <= 3: self.write_memory(i+l, _v.strip())
+                            else: raise ValueError(f"Invalid instruction/operand at location {l+i:02X}: {_v.strip()}")
+                else:
+                    v = str(v)
+                    if len(v):
+                        if len(v.split()) <= 3: self.write_memory(l, v.strip())
+                        else: raise ValueError(f"Invalid instruction/operand at location {l:02X}: {v.strip()}")
+
+        if 'M2' in config:
+            for l, p in config['M2'].items():
+                l = int(l)
+                if l >= 8 or l < 0: raise ValueError(f"Invalid M2 location {l}")
+
+                if not isinstance(p, dict) or any(c not in p for c in PSR_FIELDS): raise ValueError(f"Invalid M2 configuration at location {l}")
+                row = {c: int(p[c]) % 2 for c in ('S', 'A1', 'A0', 'E')}
+                row['AC'] = int(str(p['AC']), 16) & 0xFFF
+                row['PC0'] = int(str(p['PC0']), 16) & 0xFF
+                row['PC'] = int(str(p['PC']), 16) & 0xFF
+                self.write_process(l, row)
+
+
+        if self.main_memory[8] == '': raise ValueError('Time value not specified at location 8')
+        self.TM = int(self.main_memory[8], 16) & 0xFF
+        self.TP = len(config['M2']) & 0xF if 'M2' in config else 1
+        if not ('REG' in config and 'PC' in config['REG']):
+            if self.secondary_memory[0]['PC'] is not None:
+                self.PC = self.secondary_memory[0]['PC']
+                self.changed_vars.append('PC')
+
+        self.changed_vars.append('TM')
+        self.changed_vars.append('TP')
+        self.running_pid = self.current_pid()
+        self.memory_ptr = 'PC'
+
+    def save_state(self):
+        # plain data copy of the machine: registers, flip-flops, both memories and the accounting
+        return {
+            'registers': {r: self.PSR.copy() if r == 'PSR' else getattr(self, r) for r in REGISTERS},
+            'flip_flops': {f: getattr(self, f) for f in FLIP_FLOPS},
+            'memory': list(self.main_memory),
+            'processes': [row.copy() for row in self.secondary_memory],
+            'changed_vars': list(self.changed_vars),
+            'accounting': [list(row) for row in self.accounting],
+            'running_pid': self.running_pid,
+        }
+
+    def restore_state(self, state):
+        for r, v in state['registers'].items():
+            setattr(self, r, dict(v) if r == 'PSR' else v)
+        for f, v in state['flip_flops'].items():
+            setattr(self, f, v)
+        self.main_memory = list(state['memory'])
+        self.decoded = [None] * 256
+        if self.engine is not None: self.engine.reset()
+        self.secondary_memory = [dict(row) for row in state['processes']]
+        with self.lock:
+            self.dirty_memory, self.dirty_processes = set(range(256)), set(range(8))
+        self.changed_vars = list(state['changed_vars'])
+        # a state without accounting starts counting from zero, charging the process at PRC
+        self.accounting = [list(row) for row in state['accounting']] if 'accounting' in state else [[0] * len(ACCOUNTING) for _ in range(8)]
+        self.running_pid = state['running_pid'] if 'running_pid' in state else self.current_pid()
+        self.memory_ptr = 'PC'
+
+    def write_memory(self, address, value):
+        if self.history is not None: self.history.memory_written(address, self.main_memory[address])
+        if self.trace is not None: self.trace.memory_written(address, value)
+        self.main_memory[address] = value
+        self.decoded[address] = None
+        if self.engine is not None: self.engine.invalidate(address)
+        if self.breakpoints is not None: self.breakpoints.memory_written(address, value)
+        self.mark_memory(address)
+
+    def write_process(self, pid, row):
+        if self.history is not None: self.history.process_written(pid, self.secondary_memory[pid])
+        if self.trace is not None: self.trace.process_written(pid, row)
+        self.secondary_memory[pid] = row
+        self.mark_process(pid)
+
+    # the UI thread takes the dirty sets while the simulation thread adds to them (a turbo run
+    # drawing every step does not wait for the UI), so both go through the lock: an address
+    # added to a set already handed over would never be redrawn
+
+    def mark_memory(self, address):
+        with self.lock:
+            self.dirty_memory.add(address)
+
+    def mark_process(self, pid):
+        with self.lock:
+            self.dirty_processes.add(pid)
+
+    def take_dirty(self):
+        # hand the written addresses/rows to the UI and start collecting afresh
+        with self.lock:
+            memory, processes = self.dirty_memory, self.dirty_processes
+            self.dirty_memory, self.dirty_processes = set(), set()
+        return memory, processes
+
+    def word(self, address):
+        # data word at address as a 12 bit int
+        return int(self.main_memory[address], 16) & 0xFFF
+
+    def pid(self, address):
+        # process id stored at address (process order table), must index secondary memory
+        pid = int(self.main_memory[address], 16)
+        if pid >= 8:
+            raise ValueError(f'Invalid PID: {self.main_memory[address]}')
+        return pid
+
+    def current_pid(self):
+        # pid of the process at PRC in the order table, 0 while the table is not valid
+        try:
+            return self.pid(self.PRC)
+        except ValueError:
+            return 0
+
+    def load_psr(self):
+        # copy the process state held in PSR into the working registers
+        if self.PSR["PC"] is None:
+            raise ValueError(f'No process loaded at secondary memory location {self.TAR}')
+        self.PC = self.PSR["PC"]
+        self.AC = self.PSR["AC"]
+        self.E = self.PSR["E"]
+        self.A0 = self.PSR["A0"]
+        self.A1 = self.PSR["A1"]
+
+    def save_psr(self):
+        # snapshot the working registers of the running process into PSR
+        self.PSR["S"] = self.S
+        self.PSR["A1"] = self.A1
+        self.PSR["A0"] = self.A0
+        self.PSR["E"] = self.E
+        self.PSR["PC"] = self.PC
+        self.PSR["AC"] = self.AC
+        self.PSR["PC0"] = self.secondary_memory[self.pid(self.PRC)]['PC0']
+
     def fetch(self):
         self.AR = self.PC
         self.block(['AR']) 
 
-        self.IR = self.main_memory[int(self.AR, 16)]
-        self.PC = Hex(self.PC) + Hex('1') 
+        self.IR = self.main_memory[self.AR]
+        self.PC = (self.PC + 1) & 0xFF
         self.block(['IR', 'PC'])
 
+    def decode_word(self, text):
+        codes = text.upper().split()
+        opcode = ''.join(codes[:1])
+        if opcode not in self.instruction_map:
+            raise ValueError(f'unknown instructions {opcode}')
+        if len(codes) <= 1:
+            return self.instruction_map[opcode], None, False
+        return self.instruction_map[opcode], int(codes[1], 16) & 0xFF, len(codes) > 2
+
     def decode(self):
-        codes = self.IR.split(' ')
-        if len(codes) == 1:
-            return codes[0].strip().upper(), None,False
-        elif len(codes) == 2:
-            self.AR = Hex(codes[1].upper().strip()).val
-            self.block(['AR'])
-            return codes[0],self.AR,False
-        else:
-            self.AR = Hex(codes[1].upper().strip()).val
-            self.I = 1
-            self.block(['AR'])
-            return codes[0].strip().upper(),codes[1].strip().upper,True
-
-    @staticmethod
-    def hex_op(hex1, hex2, bits = 3, func = lambda x, y : x + y): 
-        if bits == 3: 
-            return f"{func(int(hex1, 16), int(hex2, 16)):03x}".upper()
-
-        if bits == 2: 
-            return f"{func(int(hex1, 16), int(hex2, 16)):02x}".upper()
-    
-    @staticmethod
-    def minus(x, y): return x - y
+        # IR was fetched from AR, the word is only parsed the first time it runs
+        entry = self.decoded[self.AR]
+        if entry is None:
+            entry = self.decoded[self.AR] = self.decode_word(self.IR)
+
+        handler, address, indirect = entry
+        if address is not None:
+            self.AR = address
+            if indirect:
+                self.I = 1
+                self.block(['AR', 'I'])
+            else:
+                self.block(['AR'])
+        return entry
 
     def block(self, changed_var = [], last = False): 
-        # print(f"Changed Vars: {changed_var}")
-        # print(f"Fetch {inspect.stack()[1].function}")
+        if self.coarse:
+            if not last:
+                self.SC = (self.SC + 1) & 0xF
+                return
+            if self.TM == 0:
+                self.C = self.SW
+                self.stepping = False
+            self.R = int(self.IEN and (self.FGI or self.FGO))
+            self.memory_ptr = 'PC'
+            if self.history is not None: self.history.record_all()
 
-        if last: 
+            self.instructions += 1
+            if self.running and self.instructions < self.granularity: return
+            self.instructions = 0
+            self.changed_vars = self.changes_since_shown()
+        elif last:
             self.changed_vars = changed_var + ['C']
-            if Hex(self.TM) == Hex('0'): 
+            if self.TM == 0:
                 self.C = self.SW
                 self.stepping = False
             
-            self.R = int(self.IEN and (self.FGI or self.FGO))
+            R = int(self.IEN and (self.FGI or self.FGO))
+            if R != self.R: self.changed_vars.append('R')
+            self.R = R
             self.memory_ptr = 'PC'
         else: 
             self.changed_vars = changed_var + ['SC']
-            self.SC = Hex(self.SC,1) + Hex('1')
+            self.SC = (self.SC + 1) & 0xF
             self.memory_ptr = 'AR'
         
-        self.update_ui = True
+        # the coarse path has already recorded every register for history
+        if self.history is not None and not self.coarse: self.history.record(self.changed_vars)
+        if self.trace is not None: self.trace.record(self.changed_vars)
+        if self.frame_rate:
+            self.frame_vars.update(self.changed_vars)
+            if self.frame_requested: self.publish_frame()
+        else:
+            # only the UI clears the flag, so raising it needs no lock, waiting for it does
+            self.update_ui = True
+
+        if self.turbo or (not self.running and last): return
+        self.clock.tick()
+        if self.frame_rate: return
+        cond = self.ui_cond
+        with cond:
+            while self.update_ui: cond.wait()
+
+    def changes_since_shown(self):
+        # registers and flip-flops that differ from the previous coarse update
+        values = {name: self.PSR.copy() if name == 'PSR' else getattr(self, name) for name in REGISTERS + FLIP_FLOPS}
+        changed = [name for name, value in values.items() if self.shown.get(name) != value]
+        self.shown = values
+        return changed
+
+    def publish_frame(self):
+        # snapshot of everything the UI draws, taken between two micro-ops so it is consistent
+        memory, processes = self.take_dirty()
+        self.frame = {
+            'values': {name: self.format_value(name) for name in REGISTERS + FLIP_FLOPS},
+            'changed': self.frame_vars,
+            'memory': {address: self.main_memory[address] for address in memory},
+            'processes': {pid: psr_values(self.secondary_memory[pid]) for pid in processes},
+            'memory_ptr': getattr(self, self.memory_ptr),
+            'TAR': self.TAR,
+        }
+        self.frame_vars = set()
+        self.frame_requested = False
 
-        if not self.running and last: return
-        sleep(1/self.clk) 
-        while self.update_ui: pass
-        
-        # if last == True: 
-        #     self.stepping = False
-        #     return
-
-        # with self.lock: 
-        #     self.execute = False 
-
-        # if self.stepping and not self.running and not last: 
-        #     while self.execute == False and self.stepping and self.running == False: pass
-        #     if self.running: 
-        #         sleep(1/self.clk) 
-        #         while self.update_ui: pass
-        
-        # print(f"comming out of block with parent function {inspect.stack()[1].function}")
+    def request_frame(self):
+        self.frame_requested = True
+
+    def take_frame(self):
+        # the frame published since the last call, None if there is none
+        frame, self.frame = self.frame, None
+        return frame
+
+    def ui_rendered(self):
+        # called by the UI once the state published by block() is on screen
+        with self.ui_cond:
+            self.update_ui = False
+            self.ui_cond.notify_all()
 
     def ioInterrupt(self): 
-        self.PSR["S"] = self.S
-        self.PSR["A1"] = self.A1
-        self.PSR["A0"] = self.A0
-        self.PSR["E"] = self.E
-        self.PSR["PC"] = self.PC
-        self.PSR["AC"] = self.AC
-        self.AR = Hex(self.PRC).val
-        temp = int(self.main_memory[int(self.AR, 16)], 16)
-        self.PSR["PC0"] = self.secondary_memory[temp]['PC0']
+        self.save_psr()
+        self.AR = self.PRC
         self.block(['AR', 'PSR'])
 
-        self.TAR = self.main_memory[int(self.AR, 16)]
-        if int(self.TAR, 16) >= 8: 
-            raise ValueError(f'Invalid PID: {self.TAR}')
-        self.TAR = Hex(self.TAR, 1).val
+        self.TAR = self.pid(self.AR)
+        self.accounting[self.TAR][INTERRUPTS] += 1
         self.block(['TAR'])
 
-        self.AR = '09'
+        self.AR = 0x09
         self.block(['AR'])
 
-        self.secondary_memory[int(self.TAR, 16)] = self.PSR.copy()
-        self.PC = self.main_memory[int(self.AR, 16)]
-        self.IEN, self.SW, self.R, self.SC = 0,0,0,Hex('0',1).val
+        self.write_process(self.TAR, self.PSR.copy())
+        self.PC = int(self.main_memory[self.AR], 16) & 0xFF
+        self.IEN, self.SW, self.R, self.SC = 0,0,0,0
         self.FGI, self.FGO = 0,0
         self.block(['PC', 'IEN', 'SW', 'R', 'SC', 'FGI', 'FGO'], True)
+        # the process is switched to its interrupt handler
+        if self.trace is not None: self.trace.context_switch(self.TAR, self.TAR)
 
     def contextSwitch(self):
-        self.PSR["S"] = self.S
-        self.PSR["A1"] = self.A1
-        self.PSR["A0"] = self.A0
-        self.PSR["E"] = self.E
-        self.PSR["PC"] = self.PC
-        self.PSR["AC"] = self.AC
+        self.save_psr()
         self.AR = self.PRC
-        temp = int(self.main_memory[int(self.AR, 16)], 16)
-        self.PSR["PC0"] = self.secondary_memory[temp]['PC0']
 
         # breakpoint()
         self.block(['AR', 'PSR'])
 
-        self.TAR = self.main_memory[int(self.AR, 16)]
-        if int(self.TAR, 16) >= 8: 
-            raise ValueError(f'Invalid PID: {self.TAR}')
-        self.TAR = Hex(self.TAR, 1).val 
+        self.TAR = self.pid(self.AR)
+        saved = self.TAR
         self.block(['TAR'])
 
-        self.AR = '08'
-        self.PRC = Hex(self.PRC, 1) + Hex('1')
+        self.AR = 0x08
+        self.PRC = (self.PRC + 1) & 0xF
         self.block(['AR', 'PRC'])
 
-        self.secondary_memory[int(self.TAR, 16)] = self.PSR.copy()
-        self.TM = Hex(self.main_memory[int(self.AR, 16)]).val
-        if (Hex(self.PRC,1) == Hex(self.TP)):
-            self.PRC = Hex('0', 1).val
+        self.write_process(self.TAR, self.PSR.copy())
+        self.TM = int(self.main_memory[self.AR], 16) & 0xFF
+        if self.PRC == self.TP:
+            self.PRC = 0
         self.block(['PRC', 'TM'])        
 
         self.AR = self.PRC
         self.block(['AR'])
 
-        self.TAR = self.main_memory[int(self.AR, 16)]
+        self.TAR = self.pid(self.AR)
         self.block(['TAR'])
 
-        self.PSR = self.secondary_memory[int(self.TAR, 16)].copy()
+        self.PSR = self.secondary_memory[self.TAR].copy()
         self.block(['PSR'])
 
-        self.PC = self.PSR["PC"]
-        self.AC = self.PSR["AC"]
-        self.E = self.PSR["E"]
-        self.A0 = self.PSR["A0"]
-        self.A1 = self.PSR["A1"]
+        self.load_psr()
         self.S = self.PSR["S"]
         self.C = 0
         if (self.S == 0):
             self.C = 1
-        self.SC = Hex('0', 1).val
+        self.SC = 0
+        self.running_pid = self.TAR
+        self.accounting[self.TAR][SCHEDULED] += 1
         self.block(['PC', 'AC', 'E', 'A0', 'A1', 'S', 'C', 'SC'], True)
+        if self.trace is not None: self.trace.context_switch(saved, self.TAR)
 
     def CAL_instruction(self):
-        self.DR = Hex(self.main_memory[int(self.AR, 16)],3).val
+        self.DR = self.word(self.AR)
         self.block(['DR'])
 
         if self.A0 == 0 and self.A1 == 0:
-            self.AC = Hex(self.AC,3) + Hex(self.DR,3)
+            self.AC = (self.AC + self.DR) & 0xFFF
 
         elif self.A0 == 1 and self.A1 == 0:
-            self.AC = Hex(self.AC,3) - Hex(self.DR,3)
+            self.AC = (self.AC - self.DR) & 0xFFF
 
         elif self.A0 == 0 and self.A1 == 1:
-            self.AC = Hex(self.AC,3) & Hex(self.DR,3)
+            self.AC = self.AC & self.DR
         else:
-            self.AC = Hex(self.AC,3) | Hex(self.DR,3)
+            self.AC = self.AC | self.DR
 
-        self.TM = Hex(self.TM) - Hex('1') 
-        self.SC = Hex('0',1).val
+        self.TM = (self.TM - 1) & 0xFF
+        self.SC = 0
         self.block(['AC', 'TM', 'SC'], True)
 
     def LDA_instruction(self):
-        self.DR = Hex(self.main_memory[int(self.AR, 16)], 3).val
+        self.DR = self.word(self.AR)
         self.block(['DR'])
 
         self.AC = self.DR
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['AC', 'SC', 'TM'], True)
 
     def STA_instruction(self):
-        self.main_memory[int(self.AR, 16)] = self.AC
+        self.write_memory(self.AR, f"{self.AC:03X}")
         self.block(['M'])
 
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
-        self.block(['TM'], True)
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
+        self.block(['TM', 'SC'], True)
 
 
     def BR_instruction(self):
-        self.PC = Hex(self.AR).val
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1')  
+        self.PC = self.AR
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
 
         self.block(['PC', 'TM', 'SC'], True)
 
     def ISA_instruction(self):
-        self.DR = Hex(self.main_memory[int(self.AR, 16)],3).val
+        self.DR = self.word(self.AR)
         self.block(['DR'])
 
-        self.DR = Hex(self.DR,3) + Hex('1',3)
+        self.DR = (self.DR + 1) & 0xFFF
         self.block(['DR'])
 
-        self.main_memory[int(self.AR, 16)] = self.DR
+        self.write_memory(self.AR, f"{self.DR:03X}")
         if self.DR == self.AC:
-            self.PC = Hex(self.PC) + Hex('1') 
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+            self.PC = (self.PC + 1) & 0xFF
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['DR', 'PC', 'TM', 'SC'], True)
 
     def SWT_instruction(self):
-        self.PSR["PC"] = self.PC
-        self.PSR["AC"] = self.AC
-        self.PSR["E"] = self.E
-        self.PSR["A0"] = self.A0
-        self.PSR["A1"] = self.A1
-        self.PSR["S"] = self.S
-        temp = int(self.main_memory[int(self.PRC, 16)], 16)
-        self.PSR["PC0"] = self.secondary_memory[temp]['PC0']
-        
-        self.TR = Hex(self.AR,3).val 
+        self.save_psr()
+        self.TR = self.AR
         self.block(['PSR', 'TR'])
 
         self.AR = self.PRC
         self.block(['AR'])
 
-        self.TAR = self.main_memory[int(self.AR, 16)]
-        if int(self.TAR, 16) >= 8: 
-            raise ValueError(f'Invalid PID: {self.TAR}')
-        self.TAR = Hex(self.TAR, 1).val
-
+        self.TAR = self.pid(self.AR)
+        saved = self.TAR
         self.block(['TAR'])
 
-        self.secondary_memory[int(self.TAR, 16)] = self.PSR.copy()
-        self.PRC = Hex(self.TR, 1).val
-        self.AR = Hex(self.TR, 2).val
+        self.write_process(self.TAR, self.PSR.copy())
+        self.PRC = self.TR & 0xF
+        self.AR = self.TR & 0xFF
         self.block(['PRC', 'AR'])
         
 
-        self.TAR = self.main_memory[int(self.AR, 16)]
+        self.TAR = self.pid(self.AR)
         self.block(['TAR'])
 
-        self.PSR = self.secondary_memory[int(self.TAR, 16)].copy()
-        self.AR = '08'
+        self.PSR = self.secondary_memory[self.TAR].copy()
+        self.AR = 0x08
         self.block(['PSR', 'AR'])
 
-        self.PC = self.PSR["PC"]
-        self.AC = self.PSR["AC"]
-        self.E = self.PSR["E"]
-        self.A0 = self.PSR["A0"]
-        self.A1 = self.PSR["A1"]
+        self.load_psr()
         self.S = 1
-        self.TM = self.main_memory[int(self.AR, 16)]
+        self.TM = int(self.main_memory[self.AR], 16)
         if self.PSR["S"] == 0:
-            self.NS = Hex(self.NS) - Hex('1')
-        self.TAR = Hex(self.TAR, 1).val
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+            self.NS = (self.NS - 1) & 0xF
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
+        self.running_pid = self.TAR
+        self.accounting[self.TAR][SCHEDULED] += 1
         self.block(['PC', 'AC', 'E', 'A0', 'A1', 'S', 'TM', 'NS', 'SC', 'TM'], True)
+        if self.trace is not None: self.trace.context_switch(saved, self.TAR)
     
 
     def AWT_instruction(self):
-        self.TAR = self.main_memory[int(self.AR, 16)]
-        if int(self.TAR, 16) >= 8: 
-            raise ValueError(f"Invalid PID: {self.TAR}")
-        self.TAR = Hex(self.TAR,1).val
+        self.TAR = self.pid(self.AR)
         self.block(['TAR'])
 
-        self.PSR = self.secondary_memory[int(self.TAR, 16)].copy()
+        self.PSR = self.secondary_memory[self.TAR].copy()
         self.block(['PSR'])
 
         if self.PSR["S"] == 1:
-            self.PC = Hex(self.PC) - Hex('1')
+            self.PC = (self.PC - 1) & 0xFF
             self.C = 1
+            self.accounting[self.running_pid][WAITS] += 1
         
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['PC', 'C', 'SC', 'TM'], True)
 
     def CLE_instruction(self):
         self.E = 0
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['E', 'SC', 'TM'], True)
 
     def CMA_instruction(self):
-        self.AC = Hex(bits=3)._hex(~int(self.AC,16) & ((1 << 12) - 1))
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+        self.AC = ~self.AC & 0xFFF
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['AC', 'SC', 'TM'], True)
 
     def CME_instruction(self):
         self.E = ~self.E % 2
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['E', 'SC', 'TM'], True)
 
     def CIR_instruction(self):
 
-        Lsb = int(self.AC, 16) & 1 
-        self.AC = Hex(bits=3)._hex(int(self.AC, 16) >> 1 | (self.E << 11))
+        Lsb = self.AC & 1
+        self.AC = (self.AC >> 1 | (self.E << 11)) & 0xFFF
         self.E = Lsb
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['AC', 'E', 'SC', 'TM'], True)
 
     def CIL_instruction(self):
-        Msb = (int(self.AC,16) >> 11) & 1
-        # self.AC = self.hex_op(self.AC, '0', func= lambda x, y: ((self.AC << 1) & ((1 << 12) - 1)) | self.E)
-        self.AC = Hex(bits=3)._hex(((int(self.AC, 16) << 1) & ((1 << 12) - 1)) | self.E)
+        Msb = (self.AC >> 11) & 1
+        self.AC = ((self.AC << 1) & 0xFFF) | self.E
         self.E = Msb
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['AC', 'E', 'SC', 'TM'], True)
 
 
     def SZA_instruction(self):
-        if Hex(self.AC, 3) == Hex('0'):
-            self.PC = Hex(self.PC) + Hex('1') 
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+        if self.AC == 0:
+            self.PC = (self.PC + 1) & 0xFF
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['PC', 'SC', 'TM'], True)
 
     def SZE_instruction(self):
         if self.E == 0:
-            self.PC = Hex(self.PC) + Hex('1')     
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+            self.PC = (self.PC + 1) & 0xFF
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['PC', 'SC', 'TM'], True)
 
     def ICA_instruction(self):
-        self.AC = Hex(self.AC) + Hex('1')
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+        self.AC = (self.AC + 1) & 0xFFF
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['AC', 'SC', 'TM'], True)
 
     def ESW_instruction(self):
         self.SW = 1
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['SW', 'SC', 'TM'], True)
 
     def DSW_instruction(self):
         self.SW = 0
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['SW', 'SC', 'TM'], True)
 
     def ADD_instruction(self):
         self.A0 = 0
         self.A1 = 0
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['A0', 'A1', 'SC', 'TM'], True)
     
     def SUB_instruction(self):
         self.A0 = 1
         self.A1 = 0
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['A0', 'A1', 'TM', 'SC'], True) 
 
     def AND_instruction(self):
         self.A0 = 0
         self.A1 = 1
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['A0', 'A1', 'TM', 'SC'], True)
 
     def OR_instruction(self):
         self.A0 = 1
         self.A1 = 1
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['A0', 'A1', 'TM', 'SC'], True)
 
     def HLT_instruction(self):
         if self.S: 
-            self.NS = Hex(self.NS, 1) + Hex('1')
+            self.NS = (self.NS + 1) & 0xF
         self.S = 0
-        self.PC = Hex(self.PC) - Hex('1')
-        self.block(['S', 'NS'])
+        self.PC = (self.PC - 1) & 0xFF
+        self.block(['S', 'NS', 'PC'])
 
-        if Hex(self.NS) == Hex(self.TP):
+        if self.NS == self.TP:
             self.GS = 0
         self.S = 0
         self.C = 1
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['S', 'GS', 'PC', 'C', 'SC', 'TM'], True)
 
     def FORK_instruction(self):
-        self.PSR["PC"] = self.PC
-        self.PSR["AC"] = self.AC
-        self.PSR["E"] = self.E
-        self.PSR["A0"] = self.A0
-        self.PSR["A1"] = self.A1
-        self.PSR["S"] = self.S
-        temp = int(self.main_memory[int(self.PRC, 16)], 16)
-        self.PSR["PC0"] = self.secondary_memory[temp]['PC0']
-        if Hex(self.TP) == Hex('7'): 
+        self.save_psr()
+        if self.TP == 7:
             raise ValueError('Cannot create more than 8 processes')
-        self.AR = Hex(self.TP).val
-        self.TP = Hex(self.TP,1) + Hex('1')
+        self.AR = self.TP
+        self.TP = (self.TP + 1) & 0xF
         self.block(['PSR', 'AR', 'TP'])
 
 
-        self.TAR = self.main_memory[int(self.AR, 16)]
+        self.TAR = self.pid(self.AR)
         self.block(['TAR'])
 
-        self.secondary_memory[int(self.TAR, 16)] = self.PSR.copy()
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+        self.write_process(self.TAR, self.PSR.copy())
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['SC', 'TM'], True)
 
     def RST_instruction(self):
         self.AR = self.PRC
         self.block(['AR'])
         
-        self.TAR =  self.main_memory[int(self.AR, 16)]
+        self.TAR = self.pid(self.AR)
         self.block(['TAR'])
 
-        self.PSR = self.secondary_memory[int(self.TAR, 16)].copy()
+        # like LDP, only a loaded process can be reset
+        if self.secondary_memory[self.TAR]["PC"] is None:
+            raise ValueError(f'No process loaded at secondary memory location {self.TAR}')
+        self.PSR = self.secondary_memory[self.TAR].copy()
         self.block(['PSR'])
 
         self.PSR["PC"] = self.PSR["PC0"]
-        self.PSR["AC"] = '000'
+        self.PSR["AC"] = 0
         self.PSR["S"] = 0
         self.PSR["A0"] = 0
         self.PSR["A1"] = 0
         self.PSR["E"] = 0
         self.PC = self.PSR['PC0']
-        self.AC = Hex('0', 3).val
+        self.AC = 0
         self.A0, self.A1, self.E = 0,0,0
         self.block(['PSR', 'PC', 'AC', 'A0', 'A1', 'S', 'E'])
 
-        self.secondary_memory[int(self.TAR,16)] = self.PSR.copy()
-        self.SC = Hex('0',1).val
+        self.write_process(self.TAR, self.PSR.copy())
+        self.SC = 0
         self.C = 1
-        if not self.S: self.NS = Hex(self.NS,1) - Hex('0')
         self.S = 0
         self.block(['PSR', 'S', 'SC'], True)
 
 
     def UTM_instruction(self):
-        self.AR = '08'
+        self.AR = 0x08
         self.block(['AR'])
-        self.TM = Hex(self.main_memory[int(self.AR, 16)], 2).val
-        self.SC = Hex('0',1).val
+        self.TM = int(self.main_memory[self.AR], 16) & 0xFF
+        self.SC = 0
         self.block(['TM', 'SC'], True)
 
     def LDP_instruction(self):
         self.AR = self.PRC
         self.block(['AR'])
 
-        self.TAR = self.main_memory[int(self.AR, 16)]
+        self.TAR = self.pid(self.AR)
         self.block(['TAR'])
 
-        self.PSR = self.secondary_memory[int(self.TAR, 16)]
+        self.PSR = self.secondary_memory[self.TAR].copy()
         self.block(['PSR'])
 
-        self.PC = self.PSR["PC"]
-        self.AC = self.PSR["AC"]
-        self.E = self.PSR["E"]
-        self.A0 = self.PSR["A0"]
-        self.A1 = self.PSR["A1"]
+        self.load_psr()
         self.S = self.PSR["S"]
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['PC', 'AC', 'A0', 'A1', 'S', 'E', 'SC', 'TM'], True)
 
     def SPA_instruction(self):
         self.AR = self.PRC
         self.block(['AR'])
 
-        if self.main_memory[int(self.AR, 16)] == self.AC:
-            self.PC = Hex(self.PC) + Hex('1') 
+        if self.word(self.AR) == self.AC:
+            self.PC = (self.PC + 1) & 0xFF
 
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
-        self.block(['SC', 'TM'], True)
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
+        self.block(['PC', 'SC', 'TM'], True)
 
     def INP_instruction(self):
-        self.AC = Hex(self.INPR,3).val
+        self.AC = self.INPR
         self.FGI = 0
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['AC', 'FGI', 'SC', 'TM'], True)
     
     def OUT_instruction(self):
-        self.OUTR = Hex(self.AC,1).val
+        self.OUTR = self.AC & 0xF
         self.FGO = 0
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['OUTR', 'FGO', 'SC', 'TM'],True)
 
     def SKI_instruction(self):
         if self.FGI == 1:
-            self.PC = Hex(self.PC) + Hex('1') 
+            self.PC = (self.PC + 1) & 0xFF
         
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['PC', 'SC', 'TM'], True)
 
     def SKO_instruction(self):
         if self.FGO == 1:
-            self.PC = Hex(self.PC) + Hex('1') 
+            self.PC = (self.PC + 1) & 0xFF
         
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['PC', 'SC', 'TM'], True)
 
     def EI_instruction(self):
         self.IEN = 1
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['IEN', 'SC', 'TM'], True)
 
     def DI_instruction(self):
         self.IEN = 0
-        self.SC = Hex('0',1).val
-        self.TM = Hex(self.TM) - Hex('1') 
+        self.SC = 0
+        self.TM = (self.TM - 1) & 0xFF
         self.block(['IEN', 'SC', 'TM'], True)
 
 
     def run_next(self):
         if not self.GS: return
 
-        print('Thread Created')
         self.stepping = True
+        # a trace needs every micro-op, the history copes with one record per instruction
+        self.coarse = self.granularity > 0 and self.trace is None
+        if self.history is not None: self.history.begin_step()
+        if self.trace is not None: self.trace.begin_step()
         try: 
             if (self.C and self.SW) or not self.S:
                 self.contextSwitch()
@@ -684,29 +912,21 @@ class CPU:
 
 
             else:
+                self.accounting[self.running_pid][INSTRUCTIONS] += 1
                 self.fetch()
-                opcode, address, I_address = self.decode()
+                handler, address, I_address = self.decode()
                 if I_address == True:
-                    self.AR = self.main_memory[int(self.AR, 16)]
+                    self.AR = int(self.main_memory[self.AR], 16) & 0xFF
                     self.block(['AR'])
                 
-                if opcode in self.instruction_map:
-                    self.instruction_map[opcode]()  
-                else:
-                    raise ValueError(f'unknown instructions {opcode}')
+                handler()
 
         except ValueError as v: 
-            messagebox.showerror(message=v)
-        # print(self.secondary_memory)
+            # a coarse instruction that fails never reaches its last block, what it changed still has to be undone
+            if self.coarse and self.history is not None: self.history.record_all()
+            self.error = v
+            if self.on_error is not None: self.on_error(v)
+        if self.breakpoints is not None: self.breakpoints.check()
 
-
-        print('Thread exited')
         self.stepping = False
-    
-    def run_code(self): 
-        while self.running: 
-            self.run_next()
-            if not self.GS: 
-                messagebox.showinfo(message="Execution stopped/not started. Global Start is 0")
-                self.running = False
-        
\ No newline at end of file
+    
\ No newline at end of file
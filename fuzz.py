@@ -0,0 +1,282 @@
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import yaml
+
+import batch
+import compiler
+import loader
+from cpu import CPU
+
+
+# Differential fuzzing of the execution paths against the reference: CPU.run_next at
+# micro-op granularity, the way the UI steps. The paths:
+#   headless: run_next at instruction granularity (batch runs)
+#   compiled: the block engine (compiler.py)
+#   lockstep: the NumPy engine (lockstep.py), every chunk of programs runs as one batch
+# Every program is run to the step limit on the reference and each path and the final
+# states compared. A program that ends differently is stepped again on both to find
+# the first step after which they differ, then shrunk to a smaller program that still
+# differs there. The compiled path is compared after every block, so its step is the
+# end of the block the difference shows in.
+PATHS = ('headless', 'compiled', 'lockstep')
+DEFAULT_STEPS = 500
+CHUNK = 50
+OPCODES = tuple(CPU().instruction_map)
+# opcodes taking an address operand
+MEMORY_OPS = ('CAL', 'LDA', 'STA', 'ISA', 'BR', 'SWT', 'AWT')
+CODE, CODE_SIZE, DATA = 0x10, 0x28, 0xE0
+
+
+def available_paths():
+    # the lockstep path needs numpy
+    try:
+        import numpy
+    except ImportError:
+        return tuple(path for path in PATHS if path != 'lockstep')
+    return PATHS
+
+
+def program(rng):
+    # random valid program: 1-4 processes each running its own code, shared data words,
+    # the order table, quantum (08) and interrupt vector (09)
+    processes = rng.randint(1, 4)
+    order = list(range(processes))
+    rng.shuffle(order)
+    memory = {f"{address:02X}": str(pid) for address, pid in enumerate(order)}
+    quantum = rng.randint(1, 9)
+    memory['08'] = f"{quantum:X}"
+    memory['09'] = f"{CODE + rng.randrange(processes) * CODE_SIZE:02X}"
+    for address in range(DATA, DATA + 8):
+        memory[f"{address:02X}"] = f"{rng.randrange(0x1000):03X}"
+
+    rows = {}
+    for pid in range(processes):
+        start = CODE + pid * CODE_SIZE
+        length = rng.randint(4, 24)
+        for address in range(start, start + length):
+            op = rng.choice(OPCODES + MEMORY_OPS * 2)
+            if op in MEMORY_OPS:
+                if op == 'BR': operand = start + rng.randrange(length)
+                elif op in ('SWT', 'AWT'): operand = rng.randrange(processes)
+                else: operand = rng.choice((DATA + rng.randrange(8), start + rng.randrange(length), 8))
+                op = f"{op} {operand:02X}" + (' I' if rng.random() < 0.1 else '')
+            memory[f"{address:02X}"] = op
+        rows[pid] = {'PC': f"{start:02X}", 'PC0': f"{start:02X}", 'AC': f"{rng.randrange(0x1000):03X}",
+            'E': rng.randint(0, 1), 'A0': rng.randint(0, 1), 'A1': rng.randint(0, 1), 'S': int(rng.random() < 0.9)}
+
+    return {
+        'REG': {'TP': processes, 'TM': quantum, 'PRC': 0, 'INPR': f"{rng.randrange(0x10):X}"},
+        'FF': {'GS': 1, 'S': 1, 'SW': rng.randint(0, 1), 'IEN': int(rng.random() < 0.2), 'FGI': rng.randint(0, 1), 'FGO': rng.randint(0, 1)},
+        'M': memory,
+        'M2': rows,
+    }
+
+
+def snapshot(cpu):
+    # everything a path has to agree on: machine state, error and accounting
+    state = cpu.save_state()
+    del state['changed_vars']
+    state['error'] = None if cpu.error is None else str(cpu.error)
+    return state
+
+
+def lockstep_snapshot(machines, i):
+    state = machines.state(i)
+    del state['changed_vars']
+    state['error'] = machines.error(i)
+    return state
+
+
+def stepper(path, state):
+    # (step, snapshot) of a machine on path: step(n) runs at most n steps and returns how many
+    # it ran, 0 once the machine halted or failed
+    if path == 'lockstep':
+        import lockstep
+        machines = lockstep.Lockstep([state])
+        return (lambda n: machines.step()), lambda: lockstep_snapshot(machines, 0)
+
+    cpu = batch.headless(state)
+    cpu.running = True
+    if path == 'reference': cpu.granularity = 0
+    engine = compiler.BlockEngine(cpu) if path == 'compiled' else None
+    def step(n):
+        if not cpu.GS or cpu.error is not None: return 0
+        if engine is not None: return engine.step(n)
+        cpu.run_next()
+        return 1
+    return step, lambda: snapshot(cpu)
+
+
+def run(path, state, steps):
+    # final snapshot and steps run
+    step, snap = stepper(path, state)
+    done = 0
+    while done < steps:
+        n = step(steps - done)
+        if not n: break
+        done += n
+    return snap(), done
+
+
+def first_divergence(path, state, steps):
+    # first step after which path and the reference differ, None if they agree for steps
+    step, snap = stepper(path, state)
+    ref_step, ref_snap = stepper('reference', state)
+    done = 0
+    while done < steps:
+        n = step(steps - done)
+        ran = sum(ref_step(1) for _ in range(n or 1))
+        if ran != n or snap() != ref_snap(): return done + max(n, 1)
+        if not n: return None
+        done += n
+    return None
+
+
+def differences(reference, other):
+    # what differs between two snapshots, as name: reference != other
+    out = []
+    for group in ('registers', 'flip_flops'):
+        out += [f"{name}: {value} != {other[group][name]}" for name, value in reference[group].items() if other[group][name] != value]
+    for key in ('error', 'accounting'):
+        if reference[key] != other[key]: out.append(f"{key}: {reference[key]} != {other[key]}")
+    out += [f"M[{address:02X}]: {word!r} != {other['memory'][address]!r}" for address, word in enumerate(reference['memory']) if other['memory'][address] != word]
+    out += [f"M2[{pid}]: {row} != {other['processes'][pid]}" for pid, row in enumerate(reference['processes']) if other['processes'][pid] != row]
+    return out
+
+
+def reductions(config):
+    # smaller variants of a program: without a process row, a memory word, an indirect
+    # flag, a flip-flop or register setting
+    for pid in sorted(config['M2'], reverse=True):
+        yield dict(config, M2={k: v for k, v in config['M2'].items() if k != pid})
+    for address in sorted(config['M'], reverse=True):
+        yield dict(config, M={k: v for k, v in config['M'].items() if k != address})
+    for address, word in config['M'].items():
+        if word.endswith(' I'): yield dict(config, M=dict(config['M'], **{address: word[:-2]}))
+    for section in ('FF', 'REG'):
+        for name in config[section]:
+            yield dict(config, **{section: {k: v for k, v in config[section].items() if k != name}})
+
+
+def minimize(config, path, steps, attempts = 500):
+    # greedily drop parts of config while path still differs from the reference,
+    # returns the smallest program found and the step it differs at
+    while attempts > 0:
+        for candidate in reductions(config):
+            attempts -= 1
+            if attempts < 0: break
+            try:
+                state = loader.compile_config(candidate)
+            except (ValueError, TypeError):
+                continue
+            step = first_divergence(path, state, steps)
+            if step is not None:
+                config, steps = candidate, step
+                break
+        else:
+            break
+    return config, steps
+
+
+def divergence(seed, path, config, state, steps):
+    # where the program of seed first differs on path, with what differs there and a shrunk program
+    step = first_divergence(path, state, steps) or steps
+    reference, _ = run('reference', state, step)
+    other, _ = run(path, state, step)
+    small, small_step = minimize(config, path, step)
+    return {
+        'seed': seed,
+        'path': path,
+        'step': step,
+        'differences': differences(reference, other),
+        'program': small,
+        'program_step': small_step,
+    }
+
+
+def fuzz_chunk(seeds, paths = PATHS, steps = DEFAULT_STEPS):
+    # run the programs of seeds on the reference and every path, returns counts and divergences
+    start = time.perf_counter()
+    result = {'programs': 0, 'steps': 0, 'divergences': []}
+    programs = []
+    for seed in seeds:
+        config = program(random.Random(seed))
+        try:
+            state = loader.compile_config(config)
+        except ValueError:
+            continue
+        reference, ran = run('reference', state, steps)
+        programs.append((seed, config, state, reference, ran))
+        result['programs'] += 1
+        result['steps'] += ran
+
+        for path in paths:
+            if path == 'lockstep': continue
+            other, other_ran = run(path, state, steps)
+            if other != reference or other_ran != ran:
+                result['divergences'].append(divergence(seed, path, config, state, steps))
+
+    if 'lockstep' in paths and programs:
+        import lockstep
+        machines = lockstep.Lockstep([state for _, _, state, _, _ in programs])
+        machines.run(steps)
+        for i, (seed, config, state, reference, ran) in enumerate(programs):
+            other = lockstep_snapshot(machines, i)
+            if other != reference or machines.steps[i] != ran:
+                result['divergences'].append(divergence(seed, 'lockstep', config, state, steps))
+
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def fuzz(programs, paths = PATHS, steps = DEFAULT_STEPS, seed = 0, jobs = None):
+    start = time.perf_counter()
+    chunks = [range(first, min(first + CHUNK, seed + programs)) for first in range(seed, seed + programs, CHUNK)]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = list(pool.map(partial(fuzz_chunk, paths=paths, steps=steps), chunks))
+    elapsed = time.perf_counter() - start
+    return {
+        'programs': sum(r['programs'] for r in results),
+        'steps': sum(r['steps'] for r in results),
+        'seconds': elapsed,
+        'programs_per_minute': sum(r['programs'] for r in results) / elapsed * 60,
+        'divergences': [d for r in results for d in r['divergences']],
+    }
+
+
+def write_reproducer(divergence, directory):
+    # the shrunk program as YAML, with how to run it into the difference
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"diverge-{divergence['seed']}-{divergence['path']}.yaml")
+    with open(path, 'w') as file:
+        file.write(f"# {divergence['path']} differs from the reference after step {divergence['program_step']} (seed {divergence['seed']})\n")
+        file.write(f"# python CSM.py fuzz --replay {path} --paths {divergence['path']} --steps {divergence['program_step']}\n")
+        yaml.safe_dump(divergence['program'], file, sort_keys=False)
+    return path
+
+
+def replay(path, paths = PATHS, steps = DEFAULT_STEPS):
+    # first divergence of a program file on every path, None where it agrees with the reference
+    state = loader.load_image(path, cache=False)
+    out = {}
+    for name in paths:
+        step = first_divergence(name, state, steps)
+        out[name] = None
+        if step is not None:
+            reference, _ = run('reference', state, step)
+            other, _ = run(name, state, step)
+            out[name] = {'step': step, 'differences': differences(reference, other)}
+    return out
+
+
+def report(results):
+    lines = [f"{results['programs']} programs, {results['steps']} steps in {results['seconds']:.1f}s ({results['programs_per_minute']:.0f} programs/min)"]
+    for d in results['divergences']:
+        lines.append(f"seed {d['seed']}: {d['path']} differs after step {d['step']}, shrunk program after step {d['program_step']}")
+        lines += [f"    {line}" for line in d['differences'][:8]]
+    if not results['divergences']: lines.append('no divergences')
+    return '\n'.join(lines)
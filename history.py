@@ -0,0 +1,150 @@
+from collections import deque
+from operator import attrgetter
+
+from cpu import REGISTERS, FLIP_FLOPS
+
+NAMES = REGISTERS + FLIP_FLOPS
+read_all = attrgetter(*NAMES)
+
+
+class History:
+    # Undo log for stepping backwards. Every micro-op (block) appends the previous values of
+    # what it changed, tagged with the step (run_next) it belongs to, to a bounded ring buffer.
+    # Every step starts with the scheduler accounting and running_pid as they were before it.
+    # Full checkpoints are taken every checkpoint_interval steps so steps that fell out of the
+    # ring can still be reached by restoring a checkpoint and re-running forward.
+
+    def __init__(self, cpu, max_deltas = 200000, checkpoint_interval = 1000, max_checkpoints = 64):
+        self.cpu = cpu
+        self.deltas = deque(maxlen=max_deltas)
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoints = deque(maxlen=max_checkpoints)
+        self.reset()
+
+    def reset(self):
+        # forget everything and start recording from the current machine state,
+        # needed whenever the state changes outside of run_next (load, user edits)
+        self.cpu.history = self
+        self.deltas.clear()
+        self.checkpoints.clear()
+        self.step = 0       # steps recorded so far, the machine is now "at" this step
+        self.oldest = 0     # first step whose deltas are all still in the ring
+        self.pending = []   # (key, old value) of the micro-op in progress
+        self.values = {name: self._copy(name) for name in NAMES}
+        self.checkpoints.append((0, self.cpu.save_state()))
+
+    def _copy(self, name):
+        val = getattr(self.cpu, name)
+        return val.copy() if name == 'PSR' else val
+
+    # hooks called by the cpu
+
+    def begin_step(self):
+        if self.step % self.checkpoint_interval == 0 and self.checkpoints[-1][0] != self.step:
+            self.checkpoints.append((self.step, self.cpu.save_state()))
+        cpu = self.cpu
+        self._append(self.step, (('accounting', (tuple(map(tuple, cpu.accounting)), cpu.running_pid)),))
+        self.step += 1
+
+    def memory_written(self, address, old):
+        self.pending.append((address, old))
+
+    def process_written(self, pid, old):
+        self.pending.append(((pid,), old))
+
+    def record(self, changed_vars):
+        values, pending = self.values, self.pending
+        for name in changed_vars:
+            if name in values:
+                new = self._copy(name)
+                if new != values[name]:
+                    pending.append((name, values[name]))
+                    values[name] = new
+        if not pending: return
+        self._append(self.step - 1, tuple(pending))
+        self.pending = []
+
+    def record_all(self):
+        # a coarse instruction, its micro-ops name nothing so every register is compared in one read
+        values, pending = self.values, self.pending
+        for name, new in zip(NAMES, read_all(self.cpu)):
+            if new != values[name]:
+                pending.append((name, values[name]))
+                values[name] = new.copy() if name == 'PSR' else new
+        if not pending: return
+        self._append(self.step - 1, tuple(pending))
+        self.pending = []
+
+    def _append(self, step, changes):
+        if len(self.deltas) == self.deltas.maxlen:
+            # the oldest step loses its first micro-op, it can no longer be undone from the ring
+            self.oldest = max(self.oldest, self.deltas[0][0] + 1)
+        self.deltas.append((step, changes))
+
+    # rewinding
+
+    def available(self):
+        # how many steps step_back can undo from the ring alone
+        return self.step - self.oldest
+
+    def step_back(self, n = 1):
+        target = self.step - n
+        if n <= 0: return []
+        if target < 0: raise ValueError('Cannot step back past the start of the recorded history')
+
+        changed = set()
+        if target < self.oldest:
+            self._replay_to(target)
+            changed.update(REGISTERS + FLIP_FLOPS)
+        else:
+            while self.deltas and self.deltas[-1][0] >= target:
+                _, changes = self.deltas.pop()
+                for key, old in reversed(changes):
+                    self._undo(key, old)
+                    if key in self.values: changed.add(key)
+            self.step = target
+        while len(self.checkpoints) > 1 and self.checkpoints[-1][0] > target:
+            self.checkpoints.pop()
+
+        self.cpu.changed_vars = list(changed)
+        self.cpu.memory_ptr = 'PC'
+        return self.cpu.changed_vars
+
+    def _undo(self, key, old):
+        cpu = self.cpu
+        if key == 'accounting':
+            accounting, cpu.running_pid = old
+            cpu.accounting = [list(row) for row in accounting]
+        elif isinstance(key, str):
+            setattr(cpu, key, old.copy() if key == 'PSR' else old)
+            self.values[key] = old
+        elif isinstance(key, int):
+            cpu.main_memory[key] = old
+            cpu.decoded[key] = None
+            if cpu.engine is not None: cpu.engine.invalidate(key)
+            cpu.mark_memory(key)
+        else:
+            cpu.secondary_memory[key[0]] = old
+            cpu.mark_process(key[0])
+
+    def _replay_to(self, target):
+        # restore the newest checkpoint before target and run forward to it
+        checkpoints = [c for c in self.checkpoints if c[0] <= target]
+        if not checkpoints: raise ValueError('Step is older than the recorded history')
+        step, state = checkpoints[-1]
+
+        cpu = self.cpu
+        cpu.restore_state(state)
+        kept = [c for c in self.checkpoints if c[0] <= step]
+        self.reset()
+        self.checkpoints.clear()
+        self.checkpoints.extend(kept)
+        self.step = self.oldest = step
+
+        turbo, running = cpu.turbo, cpu.running
+        cpu.turbo, cpu.running = True, False
+        try:
+            while self.step < target and cpu.GS:
+                cpu.run_next()
+        finally:
+            cpu.turbo, cpu.running = turbo, running
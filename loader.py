@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+
+from cpu import CPU, REGISTERS, FLIP_FLOPS, PSR_FIELDS, ACCOUNTING
+
+
+# bump when CPU.load_config or the CPU.save_state layout changes, old cache files are then ignored
+CACHE_VERSION = 2
+# images already loaded by this process, keyed by the hash of the program text
+_images = {}
+
+
+def cache_dir():
+    return os.environ.get('CSM_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'csm'))
+
+
+def compile_config(config):
+    # validate a parsed program on a scratch cpu and keep the resulting machine state as the image
+    if not isinstance(config, dict): raise ValueError('Program must be a mapping with REG/FF/M/M2 sections')
+    cpu = CPU()
+    cpu.load_config(config)
+    return cpu.save_state()
+
+
+def parse(text):
+    # yaml is only imported on a cache miss, YAML errors are raised as ValueError
+    import yaml
+    try:
+        return yaml.safe_load(text)
+    except yaml.YAMLError as e:
+        raise ValueError(f"Invalid YAML: {e}")
+
+
+def _valid_image(image):
+    # a cache file may be damaged or edited, only an image with the CPU.save_state layout is used
+    def row(values):
+        return isinstance(values, dict) and set(values) == set(PSR_FIELDS) and all(v is None or isinstance(v, int) for v in values.values())
+    def numbers(values, n):
+        return isinstance(values, list) and len(values) == n and all(isinstance(v, int) for v in values)
+    try:
+        registers = image['registers']
+        return (set(registers) == set(REGISTERS) and isinstance(registers['IR'], str) and row(registers['PSR'])
+            and all(isinstance(v, int) for r, v in registers.items() if r not in ('IR', 'PSR'))
+            and numbers([image['flip_flops'][f] for f in FLIP_FLOPS], len(FLIP_FLOPS))
+            and isinstance(image['memory'], list) and len(image['memory']) == 256 and all(isinstance(word, str) for word in image['memory'])
+            and isinstance(image['processes'], list) and len(image['processes']) == 8 and all(row(values) for values in image['processes'])
+            and isinstance(image['changed_vars'], list)
+            and isinstance(image['accounting'], list) and len(image['accounting']) == 8 and all(numbers(values, len(ACCOUNTING)) for values in image['accounting'])
+            and isinstance(image['running_pid'], int) and 0 <= image['running_pid'] < 8)
+    except (TypeError, KeyError):
+        return False
+
+
+def load_image(path, cache = True):
+    # program image of a YAML file, the YAML is only parsed and validated once per distinct content.
+    # cache=False parses it again, bypassing this process's images and the cache files
+    with open(path, 'rb') as file:
+        text = file.read()
+    key = hashlib.sha256(text).hexdigest()
+    if cache and key in _images: return _images[key]
+
+    cache_file = os.path.join(cache_dir(), f"{key}.v{CACHE_VERSION}.json")
+    image = None
+    if cache:
+        try:
+            with open(cache_file, 'r') as file:
+                image = json.load(file)
+        except (OSError, ValueError):
+            image = None
+        if image is not None and not _valid_image(image): image = None
+
+    if image is None:
+        image = compile_config(parse(text))
+        if cache: _write_cache(cache_file, image)
+
+    if cache: _images[key] = image
+    return image
+
+
+def _write_cache(cache_file, image):
+    # the cache is only an optimisation, a read-only or missing home directory is not an error
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        temp = f"{cache_file}.{os.getpid()}.tmp"
+        with open(temp, 'w') as file:
+            json.dump(image, file)
+        os.replace(temp, cache_file)
+    except OSError:
+        pass
+
+
+def load_program(cpu, path, cache = True):
+    cpu.restore_state(load_image(path, cache))
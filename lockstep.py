@@ -0,0 +1,611 @@
+import itertools
+
+import numpy as np
+
+from cpu import CPU, REGISTERS, FLIP_FLOPS, PSR_FIELDS, ACCOUNTING, INSTRUCTIONS, SCHEDULED, WAITS, INTERRUPTS
+
+
+# Lockstep engine: N machines held as arrays (one element per machine), every step()
+# does what CPU.run_next does at instruction granularity on all of them at once.
+# Memory words are text in CPU, here they are ids into a table of every distinct word
+# with their parses done once: as data, as a pid and as an instruction. Words written
+# by STA/ISA are always 3 hex digits, so all 4096 of them are in the table from the start.
+# Unset process table fields (None) are -1. A machine that fails stops with the registers
+# left as run_next leaves them, error(i) gives its message.
+OPCODES = tuple(CPU().instruction_map)
+OP = {name: i for i, name in enumerate(OPCODES)}
+NUMERIC_REGISTERS = tuple(r for r in REGISTERS if r not in ('IR', 'PSR'))
+S_, A1_, A0_, E_, AC_, PC0_, PC_ = range(len(PSR_FIELDS))
+# error kinds, the argument is a word id except for NO_PROCESS (the TAR)
+PARSE, PID, DECODE, NO_PROCESS, FORK_LIMIT = range(1, 6)
+
+
+def _message(call, *args):
+    try:
+        call(*args)
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+# register instructions: an effect on the machines idx, then the common end of the instruction
+
+def _register_op(effect):
+    def op(self, idx):
+        effect(self, idx)
+        self._tick(idx)
+        self._finish(idx)
+    return op
+
+
+def _set(**values):
+    def effect(self, idx):
+        for name, value in values.items(): getattr(self, name)[idx] = value
+    return effect
+
+
+def _skip_if(test):
+    def effect(self, idx):
+        skip = idx[test(self, idx)]
+        self.PC[skip] = (self.PC[skip] + 1) & 0xFF
+    return effect
+
+
+def _cir(self, idx):
+    ac, e = self.AC[idx], self.E[idx]
+    self.AC[idx] = (ac >> 1 | (e << 11)) & 0xFFF
+    self.E[idx] = ac & 1
+
+
+def _cil(self, idx):
+    ac, e = self.AC[idx], self.E[idx]
+    self.AC[idx] = ((ac << 1) & 0xFFF) | e
+    self.E[idx] = (ac >> 11) & 1
+
+
+def _inp(self, idx):
+    self.AC[idx] = self.INPR[idx]
+    self.FGI[idx] = 0
+
+
+def _out(self, idx):
+    self.OUTR[idx] = self.AC[idx] & 0xF
+    self.FGO[idx] = 0
+
+
+_decoder = CPU()
+# parses of every word seen by this process, shared by all tables
+_parsed = {}
+
+
+class Words:
+    # table of distinct memory words, the numpy columns are rebuilt when words are added
+    def __init__(self):
+        self.text = []
+        self.ids = {}
+        self.columns = None
+
+    def id(self, text):
+        wid = self.ids.get(text)
+        if wid is None:
+            wid = self.ids[text] = len(self.text)
+            self.text.append(text)
+            self.columns = None
+        return wid
+
+    @staticmethod
+    def parse(text):
+        # (data, byte, pid, opcode, operand, indirect) as the CPU reads the word, -1 where it fails
+        parsed = _parsed.get(text)
+        if parsed is not None: return parsed
+        try:
+            value = int(text, 16)
+            data, byte, pid = value & 0xFFF, value & 0xFF, value if 0 <= value < 8 else -1
+        except ValueError:
+            data = byte = pid = -1
+        try:
+            handler, operand, indirect = _decoder.decode_word(text)
+            opcode = OP[handler.__name__[:-len('_instruction')]]
+        except ValueError:
+            opcode, operand, indirect = -1, None, False
+        parsed = _parsed[text] = (data, byte, pid, opcode, -1 if operand is None else operand, int(indirect))
+        return parsed
+
+    def build(self):
+        if self.columns is None:
+            parsed = np.array([self.parse(text) for text in self.text], dtype=np.int64).reshape(-1, 6)
+            self.data, self.byte, self.pid, self.opcode, self.operand, self.indirect = parsed.T.copy()
+            self.columns = parsed
+        return self
+
+    def message(self, kind, wid):
+        text = self.text[wid]
+        if kind == PARSE: return _message(int, text, 16)
+        if kind == PID: return _message(int, text, 16) or f'Invalid PID: {text}'
+        return _message(_decoder.decode_word, text)
+
+
+class Lockstep:
+    def __init__(self, states):
+        # one machine per CPU.save_state dict
+        n = self.n = len(states)
+        words = self.words = Words()
+        self.hex = np.array([words.id(f"{v:03X}") for v in range(0x1000)], dtype=np.int64)
+
+        for r in NUMERIC_REGISTERS:
+            setattr(self, r, np.array([s['registers'][r] for s in states], dtype=np.int64))
+        for f in FLIP_FLOPS:
+            setattr(self, f, np.array([s['flip_flops'][f] for s in states], dtype=np.int64))
+        self.IR = np.array([words.id(s['registers']['IR']) for s in states], dtype=np.int64)
+        self.PSR = np.array([[-1 if s['registers']['PSR'][c] is None else s['registers']['PSR'][c] for c in PSR_FIELDS] for s in states], dtype=np.int64)
+        self.memory = np.array([[words.id(word) for word in s['memory']] for s in states], dtype=np.int64)
+        self.processes = np.array([[[-1 if row[c] is None else row[c] for c in PSR_FIELDS] for row in s['processes']] for s in states], dtype=np.int64)
+
+        # as CPU.restore_state: without accounting in the state counting starts from zero
+        self.accounting = np.array([s['accounting'] if 'accounting' in s else [[0] * len(ACCOUNTING)] * 8 for s in states], dtype=np.int64)
+        pids = []
+        for s in states:
+            if 'running_pid' in s:
+                pids.append(s['running_pid'])
+                continue
+            # CPU.current_pid of the state
+            pid = Words.parse(s['memory'][s['registers']['PRC']])[2]
+            pids.append(max(pid, 0))
+        self.running_pid = np.array(pids, dtype=np.int64)
+        self.steps = np.zeros(n, dtype=np.int64)
+        self.error_kind = np.zeros(n, dtype=np.int64)
+        self.error_arg = np.zeros(n, dtype=np.int64)
+
+    @classmethod
+    def copies(cls, state, n):
+        # n machines in the same state, vary them through the register arrays or write()
+        return cls([state] * n)
+
+    def write(self, address, texts):
+        # store a word (one per machine) at address of every machine
+        self.memory[:, address] = [self.words.id(text) for text in texts]
+
+    # reading machines back
+
+    def active(self):
+        return (self.GS == 1) & (self.error_kind == 0)
+
+    def error(self, i):
+        kind = self.error_kind[i]
+        if kind == 0: return None
+        if kind == NO_PROCESS: return f'No process loaded at secondary memory location {self.error_arg[i]}'
+        if kind == FORK_LIMIT: return 'Cannot create more than 8 processes'
+        return self.words.message(kind, self.error_arg[i])
+
+    def state(self, i):
+        # CPU.save_state of machine i
+        text = self.words.text
+        registers = {r: int(getattr(self, r)[i]) for r in NUMERIC_REGISTERS}
+        registers['IR'] = text[self.IR[i]]
+        registers['PSR'] = {c: None if v == -1 else int(v) for c, v in zip(PSR_FIELDS, self.PSR[i])}
+        return {
+            'registers': {r: registers[r] for r in REGISTERS},
+            'flip_flops': {f: int(getattr(self, f)[i]) for f in FLIP_FLOPS},
+            'memory': [text[w] for w in self.memory[i]],
+            'processes': [{c: None if v == -1 else int(v) for c, v in zip(PSR_FIELDS, row)} for row in self.processes[i]],
+            'changed_vars': [],
+            'accounting': self.accounting[i].tolist(),
+            'running_pid': int(self.running_pid[i]),
+        }
+
+    # helpers, every one takes the machines it works on (idx) and returns those still running
+
+    def _fail(self, idx, bad, kind, arg):
+        self.error_kind[idx[bad]] = kind
+        self.error_arg[idx[bad]] = arg[bad]
+        return idx[~bad]
+
+    def _read(self, idx, address, column):
+        # word at address parsed as column (words.data or words.byte), failing on bad hex
+        wid = self.memory[idx, address]
+        value = column[wid]
+        bad = value < 0
+        if bad.any():
+            idx = self._fail(idx, bad, PARSE, wid)
+            value = value[~bad]
+        return idx, value
+
+    def _pid(self, idx, address):
+        wid = self.memory[idx, address]
+        pid = self.words.pid[wid]
+        bad = pid < 0
+        if bad.any():
+            idx = self._fail(idx, bad, PID, wid)
+            pid = pid[~bad]
+        return idx, pid
+
+    def _block(self, idx):
+        self.SC[idx] = (self.SC[idx] + 1) & 0xF
+
+    def _save_psr(self, idx):
+        psr = self.PSR
+        psr[idx, S_], psr[idx, A1_], psr[idx, A0_], psr[idx, E_] = self.S[idx], self.A1[idx], self.A0[idx], self.E[idx]
+        psr[idx, PC_], psr[idx, AC_] = self.PC[idx], self.AC[idx]
+        idx, pid = self._pid(idx, self.PRC[idx])
+        psr[idx, PC0_] = self.processes[idx, pid, PC0_]
+        return idx
+
+    def _load_psr(self, idx):
+        bad = self.PSR[idx, PC_] == -1
+        if bad.any(): idx = self._fail(idx, bad, NO_PROCESS, self.TAR[idx])
+        psr = self.PSR
+        self.PC[idx], self.AC[idx], self.E[idx], self.A0[idx], self.A1[idx] = psr[idx, PC_], psr[idx, AC_], psr[idx, E_], psr[idx, A0_], psr[idx, A1_]
+        return idx
+
+    def _tick(self, idx):
+        self.SC[idx] = 0
+        self.TM[idx] = (self.TM[idx] - 1) & 0xFF
+
+    def _finish(self, idx):
+        # end of the instruction, the coarse last block()
+        zero = idx[self.TM[idx] == 0]
+        self.C[zero] = self.SW[zero]
+        self.R[idx] = self.IEN[idx] & (self.FGI[idx] | self.FGO[idx])
+
+    # run_next
+
+    def step(self):
+        # one run_next on every machine that is running, returns how many ran
+        self.words.build()
+        active = self.active()
+        switch = active & (((self.C & self.SW) == 1) | (self.S == 0))
+        interrupt = active & ~switch & ((self.R == 1) | ((self.IEN & (self.FGI | self.FGO)) == 1))
+        instruction = active & ~switch & ~interrupt
+        self.steps[active] += 1
+
+        idx = np.flatnonzero(switch)
+        if len(idx): self._context_switch(idx)
+        idx = np.flatnonzero(interrupt)
+        if len(idx): self._io_interrupt(idx)
+        idx = np.flatnonzero(instruction)
+        if len(idx): self._instruction(idx)
+        return int(active.sum())
+
+    def run(self, max_steps):
+        # step until every machine halted, failed or ran max_steps, returns the steps taken
+        for step in range(max_steps):
+            if not self.step(): return step
+        return max_steps
+
+    def _context_switch(self, idx):
+        idx = self._save_psr(idx)
+        self.AR[idx] = self.PRC[idx]
+        self._block(idx)
+
+        idx, pid = self._pid(idx, self.AR[idx])
+        self.TAR[idx] = pid
+        self._block(idx)
+
+        self.AR[idx] = 8
+        self.PRC[idx] = (self.PRC[idx] + 1) & 0xF
+        self._block(idx)
+
+        self.processes[idx, self.TAR[idx]] = self.PSR[idx]
+        idx, tm = self._read(idx, 8, self.words.byte)
+        self.TM[idx] = tm
+        self.PRC[idx[self.PRC[idx] == self.TP[idx]]] = 0
+        self._block(idx)
+
+        self.AR[idx] = self.PRC[idx]
+        self._block(idx)
+
+        idx, pid = self._pid(idx, self.AR[idx])
+        self.TAR[idx] = pid
+        self._block(idx)
+
+        self.PSR[idx] = self.processes[idx, pid]
+        self._block(idx)
+
+        idx = self._load_psr(idx)
+        self.S[idx] = self.PSR[idx, S_]
+        self.C[idx] = self.S[idx] == 0
+        self.SC[idx] = 0
+        self.running_pid[idx] = self.TAR[idx]
+        self.accounting[idx, self.TAR[idx], SCHEDULED] += 1
+        self._finish(idx)
+
+    def _io_interrupt(self, idx):
+        raised = idx[self.R[idx] == 0]
+        self.R[raised] = 1
+        self._block(raised)
+
+        idx = self._save_psr(idx)
+        self.AR[idx] = self.PRC[idx]
+        self._block(idx)
+
+        idx, pid = self._pid(idx, self.AR[idx])
+        self.TAR[idx] = pid
+        self.accounting[idx, pid, INTERRUPTS] += 1
+        self._block(idx)
+
+        self.AR[idx] = 9
+        self._block(idx)
+
+        self.processes[idx, self.TAR[idx]] = self.PSR[idx]
+        idx, pc = self._read(idx, 9, self.words.byte)
+        self.PC[idx] = pc
+        for f in ('IEN', 'SW', 'R', 'SC', 'FGI', 'FGO'):
+            getattr(self, f)[idx] = 0
+        self._finish(idx)
+
+    def _instruction(self, idx):
+        words = self.words
+        self.accounting[idx, self.running_pid[idx], INSTRUCTIONS] += 1
+        # fetch
+        self.AR[idx] = self.PC[idx]
+        self._block(idx)
+        wid = self.IR[idx] = self.memory[idx, self.AR[idx]]
+        self.PC[idx] = (self.PC[idx] + 1) & 0xFF
+        self._block(idx)
+
+        # decode
+        opcode = words.opcode[wid]
+        bad = opcode < 0
+        if bad.any():
+            idx = self._fail(idx, bad, DECODE, wid)
+            wid, opcode = wid[~bad], opcode[~bad]
+        operand = words.operand[wid]
+        has = operand >= 0
+        direct = idx[has]
+        self.AR[direct] = operand[has]
+        indirect = idx[words.indirect[wid] == 1]
+        self.I[indirect] = 1
+        self._block(direct)
+
+        if len(indirect):
+            keep = np.isin(idx, indirect)
+            rest, opcode_rest = idx[~keep], opcode[~keep]
+            indirect, address = self._read(indirect, self.AR[indirect], words.byte)
+            self.AR[indirect] = address
+            self._block(indirect)
+            # machines whose indirect word did not parse are out
+            idx = np.concatenate((rest, indirect))
+            opcode = np.concatenate((opcode_rest, words.opcode[self.IR[indirect]]))
+
+        for code in np.unique(opcode):
+            handler = getattr(self, f"_{OPCODES[code]}")
+            handler(idx[opcode == code])
+
+    # instructions, the machines have fetched and decoded them (AR holds the operand)
+
+    def _memory_op(self, idx):
+        # DR = M[AR] of CAL/LDA/ISA
+        idx, value = self._read(idx, self.AR[idx], self.words.data)
+        self.DR[idx] = value
+        self._block(idx)
+        return idx
+
+    def _CAL(self, idx):
+        idx = self._memory_op(idx)
+        a0, a1, ac, dr = self.A0[idx], self.A1[idx], self.AC[idx], self.DR[idx]
+        self.AC[idx] = np.where(a1 == 0, np.where(a0 == 0, ac + dr, ac - dr) & 0xFFF, np.where(a0 == 0, ac & dr, ac | dr))
+        self._tick(idx)
+        self._finish(idx)
+
+    def _LDA(self, idx):
+        idx = self._memory_op(idx)
+        self.AC[idx] = self.DR[idx]
+        self._tick(idx)
+        self._finish(idx)
+
+    def _STA(self, idx):
+        self.memory[idx, self.AR[idx]] = self.hex[self.AC[idx]]
+        self._block(idx)
+        self._tick(idx)
+        self._finish(idx)
+
+    def _BR(self, idx):
+        self.PC[idx] = self.AR[idx]
+        self._tick(idx)
+        self._finish(idx)
+
+    def _ISA(self, idx):
+        idx = self._memory_op(idx)
+        dr = self.DR[idx] = (self.DR[idx] + 1) & 0xFFF
+        self._block(idx)
+        self.memory[idx, self.AR[idx]] = self.hex[dr]
+        skip = idx[dr == self.AC[idx]]
+        self.PC[skip] = (self.PC[skip] + 1) & 0xFF
+        self._tick(idx)
+        self._finish(idx)
+
+    def _SWT(self, idx):
+        idx = self._save_psr(idx)
+        self.TR[idx] = self.AR[idx]
+        self._block(idx)
+
+        self.AR[idx] = self.PRC[idx]
+        self._block(idx)
+
+        idx, pid = self._pid(idx, self.AR[idx])
+        self.TAR[idx] = pid
+        self._block(idx)
+
+        self.processes[idx, pid] = self.PSR[idx]
+        self.PRC[idx] = self.TR[idx] & 0xF
+        self.AR[idx] = self.TR[idx] & 0xFF
+        self._block(idx)
+
+        idx, pid = self._pid(idx, self.AR[idx])
+        self.TAR[idx] = pid
+        self._block(idx)
+
+        self.PSR[idx] = self.processes[idx, pid]
+        self.AR[idx] = 8
+        self._block(idx)
+
+        idx = self._load_psr(idx)
+        self.S[idx] = 1
+        idx, tm = self._read(idx, 8, self.words.byte)
+        stopped = idx[self.PSR[idx, S_] == 0]
+        self.NS[stopped] = (self.NS[stopped] - 1) & 0xF
+        self.TM[idx] = tm
+        self._tick(idx)
+        self.running_pid[idx] = self.TAR[idx]
+        self.accounting[idx, self.TAR[idx], SCHEDULED] += 1
+        self._finish(idx)
+
+    def _AWT(self, idx):
+        idx, pid = self._pid(idx, self.AR[idx])
+        self.TAR[idx] = pid
+        self._block(idx)
+
+        self.PSR[idx] = self.processes[idx, pid]
+        self._block(idx)
+
+        waiting = idx[self.PSR[idx, S_] == 1]
+        self.PC[waiting] = (self.PC[waiting] - 1) & 0xFF
+        self.C[waiting] = 1
+        self.accounting[waiting, self.running_pid[waiting], WAITS] += 1
+        self._tick(idx)
+        self._finish(idx)
+
+    _CLE = _register_op(_set(E=0))
+    _CMA = _register_op(lambda self, idx: self.AC.__setitem__(idx, ~self.AC[idx] & 0xFFF))
+    _CME = _register_op(lambda self, idx: self.E.__setitem__(idx, ~self.E[idx] % 2))
+    _CIR = _register_op(_cir)
+    _CIL = _register_op(_cil)
+    _SZA = _register_op(_skip_if(lambda self, idx: self.AC[idx] == 0))
+    _SZE = _register_op(_skip_if(lambda self, idx: self.E[idx] == 0))
+    _ICA = _register_op(lambda self, idx: self.AC.__setitem__(idx, (self.AC[idx] + 1) & 0xFFF))
+    _ESW = _register_op(_set(SW=1))
+    _DSW = _register_op(_set(SW=0))
+    _ADD = _register_op(_set(A0=0, A1=0))
+    _SUB = _register_op(_set(A0=1, A1=0))
+    _AND = _register_op(_set(A0=0, A1=1))
+    _OR = _register_op(_set(A0=1, A1=1))
+    _INP = _register_op(_inp)
+    _OUT = _register_op(_out)
+    _SKI = _register_op(_skip_if(lambda self, idx: self.FGI[idx] == 1))
+    _SKO = _register_op(_skip_if(lambda self, idx: self.FGO[idx] == 1))
+    _EI = _register_op(_set(IEN=1))
+
+    def _HLT(self, idx):
+        self.NS[idx] = (self.NS[idx] + (self.S[idx] != 0)) & 0xF
+        self.S[idx] = 0
+        self.PC[idx] = (self.PC[idx] - 1) & 0xFF
+        self._block(idx)
+
+        self.GS[idx[self.NS[idx] == self.TP[idx]]] = 0
+        self.C[idx] = 1
+        self._tick(idx)
+        self._finish(idx)
+
+    def _FORK(self, idx):
+        idx = self._save_psr(idx)
+        idx = self._fail(idx, self.TP[idx] == 7, FORK_LIMIT, self.TP[idx])
+        self.AR[idx] = self.TP[idx]
+        self.TP[idx] = (self.TP[idx] + 1) & 0xF
+        self._block(idx)
+
+        idx, pid = self._pid(idx, self.AR[idx])
+        self.TAR[idx] = pid
+        self._block(idx)
+
+        self.processes[idx, pid] = self.PSR[idx]
+        self._tick(idx)
+        self._finish(idx)
+
+    def _RST(self, idx):
+        self.AR[idx] = self.PRC[idx]
+        self._block(idx)
+
+        idx, pid = self._pid(idx, self.AR[idx])
+        self.TAR[idx] = pid
+        self._block(idx)
+
+        bad = self.processes[idx, pid, PC_] == -1
+        if bad.any():
+            idx, pid = self._fail(idx, bad, NO_PROCESS, pid), pid[~bad]
+        self.PSR[idx] = self.processes[idx, pid]
+        self._block(idx)
+
+        psr = self.PSR
+        psr[idx, PC_] = psr[idx, PC0_]
+        psr[idx, AC_] = psr[idx, S_] = psr[idx, A0_] = psr[idx, A1_] = psr[idx, E_] = 0
+        self.PC[idx] = psr[idx, PC0_]
+        self.AC[idx] = self.A0[idx] = self.A1[idx] = self.E[idx] = 0
+        self._block(idx)
+
+        self.processes[idx, pid] = psr[idx]
+        self.SC[idx] = 0
+        self.C[idx] = 1
+        self.S[idx] = 0
+        self._finish(idx)
+
+    def _UTM(self, idx):
+        self.AR[idx] = 8
+        self._block(idx)
+        idx, tm = self._read(idx, 8, self.words.byte)
+        self.TM[idx] = tm
+        self.SC[idx] = 0
+        self._finish(idx)
+
+    def _LDP(self, idx):
+        self.AR[idx] = self.PRC[idx]
+        self._block(idx)
+
+        idx, pid = self._pid(idx, self.AR[idx])
+        self.TAR[idx] = pid
+        self._block(idx)
+
+        self.PSR[idx] = self.processes[idx, pid]
+        self._block(idx)
+
+        idx = self._load_psr(idx)
+        self.S[idx] = self.PSR[idx, S_]
+        self._tick(idx)
+        self._finish(idx)
+
+    def _SPA(self, idx):
+        self.AR[idx] = self.PRC[idx]
+        self._block(idx)
+
+        idx, value = self._read(idx, self.AR[idx], self.words.data)
+        skip = idx[value == self.AC[idx]]
+        self.PC[skip] = (self.PC[skip] + 1) & 0xFF
+        self._tick(idx)
+        self._finish(idx)
+
+
+def variants(image, vary):
+    # one machine per combination of the vary values ({register or flip-flop: [values]})
+    combos = list(itertools.product(*vary.values()))
+    machines = Lockstep.copies(image, len(combos))
+    for name, column in zip(vary, zip(*combos)):
+        getattr(machines, name)[:] = column
+    return machines, [dict(zip(vary, combo)) for combo in combos]
+
+
+def results(machines, combos):
+    return [{
+        'values': combo,
+        'steps': int(machines.steps[i]),
+        'halted': bool(machines.GS[i] == 0),
+        'error': machines.error(i),
+        'AC': int(machines.AC[i]),
+        'OUTR': int(machines.OUTR[i]),
+        'accounting': {pid: dict(zip(ACCOUNTING, row)) for pid, row in enumerate(machines.accounting[i].tolist()) if any(row)},
+    } for i, combo in enumerate(combos)]
+
+
+def table(results):
+    # variants grouped by outcome: status, error and final AC/OUTR, with the first variant of each
+    groups = {}
+    for r in results:
+        status = 'halted' if r['halted'] else 'error' if r['error'] else 'limit'
+        group = groups.setdefault((status, r['error'] or '', r['AC'], r['OUTR']), [0, r['steps'], r['steps'], r['values']])
+        group[0] += 1
+        group[1], group[2] = min(group[1], r['steps']), max(group[2], r['steps'])
+    header = ('count', 'status', 'steps', 'AC', 'OUTR', 'first', 'error')
+    rows = [header]
+    for (status, error, ac, outr), (count, low, high, values) in sorted(groups.items(), key=lambda g: -g[1][0]):
+        rows.append((str(count), status, str(low) if low == high else f"{low}-{high}", f"{ac:03X}", f"{outr:X}",
+            ' '.join(f"{name}={value:X}" for name, value in values.items()), error))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows)
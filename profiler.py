@@ -0,0 +1,81 @@
+from time import perf_counter
+
+
+# paths of run_next that are not an instruction_map handler
+PATHS = ('fetch', 'decode', 'contextSwitch', 'ioInterrupt')
+
+
+class Profile:
+    # Per-opcode counts, wall time and micro-op (block) counts. While attached the handlers in
+    # cpu.instruction_map and the PATHS methods are replaced on the cpu instance by timed
+    # wrappers, so a cpu without a profile runs the plain methods at no cost
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.stats = {}     # name: [calls, seconds, micro-ops]
+        self.micro_ops = 0
+        self.originals = None
+        self.attach()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.detach()
+
+    def _wrap(self, name, func):
+        stats = self.stats.setdefault(name, [0, 0.0, 0])
+        def timed(*args):
+            ops = self.micro_ops
+            start = perf_counter()
+            try:
+                return func(*args)
+            finally:
+                stats[0] += 1
+                stats[1] += perf_counter() - start
+                stats[2] += self.micro_ops - ops
+        return timed
+
+    def attach(self):
+        cpu = self.cpu
+        if self.originals is not None: return
+        self.originals = {'instruction_map': cpu.instruction_map}
+        cpu.instruction_map = {opcode: self._wrap(opcode, handler) for opcode, handler in cpu.instruction_map.items()}
+        for name in PATHS:
+            self.originals[name] = cpu.__dict__.get(name)
+            setattr(cpu, name, self._wrap(name, getattr(cpu, name)))
+
+        block = cpu.block
+        self.originals['block'] = cpu.__dict__.get('block')
+        def counting(changed_var = [], last = False):
+            self.micro_ops += 1
+            return block(changed_var, last)
+        cpu.block = counting
+        # the decode cache holds handlers, drop it so the wrapped ones are used
+        cpu.decoded = [None] * 256
+
+    def detach(self):
+        cpu = self.cpu
+        if self.originals is None: return
+        cpu.instruction_map = self.originals.pop('instruction_map')
+        for name, original in self.originals.items():
+            if original is None: delattr(cpu, name)
+            else: setattr(cpu, name, original)
+        self.originals = None
+        cpu.decoded = [None] * 256
+
+    def reset(self):
+        for stats in self.stats.values(): stats[:] = [0, 0.0, 0]
+
+    def results(self, sort = 'seconds'):
+        # one dict per opcode/path that ran, sorted by sort (name, calls, seconds or micro_ops)
+        total = sum(s[1] for s in self.stats.values()) or 1
+        rows = [{'name': name, 'calls': calls, 'seconds': seconds, 'micro_ops': ops, 'share': seconds / total}
+            for name, (calls, seconds, ops) in self.stats.items() if calls]
+        return sorted(rows, key=lambda r: r[sort], reverse=sort != 'name')
+
+
+def table(results):
+    lines = [f"{'name':14} {'calls':>10} {'seconds':>10} {'share':>7} {'us/call':>9} {'micro-ops':>10} {'ops/call':>8}"]
+    for r in results:
+        lines.append(f"{r['name']:14} {r['calls']:10} {r['seconds']:10.4f} {r['share']:7.1%} {r['seconds'] / r['calls'] * 1e6:9.2f} {r['micro_ops']:10} {r['micro_ops'] / r['calls']:8.2f}")
+    return '\n'.join(lines)
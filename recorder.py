@@ -0,0 +1,219 @@
+import struct
+import sys
+from array import array
+from collections import deque
+from operator import attrgetter, itemgetter
+
+from cpu import REGISTERS, FLIP_FLOPS, PSR_FIELDS
+
+
+# Trace file: a header followed by chunks, each chunk holds the new strings it refers to
+# and one block of every column below (u32 item count then the raw array bytes).
+# Micro-ops (block calls) are numbered from 0 over the whole trace.
+#   step_first: first micro-op of every step (run_next)
+#   op_changes: number of changes of every micro-op, its changes follow the previous ones
+#   change_*:   variable id (see VARIABLES) and value, an IR value is a string id and an
+#               unset PSR field is -1
+#   memory_*:   micro-op, address and string id of the written word
+#   process_*:  micro-op, pid and the 7 PSR_FIELDS of the written row (-1 when unset)
+#   switch_*:   step, saved and loaded pid of every context switch, SWT and I/O interrupt
+MAGIC = b'CSMT'
+VERSION = 1
+HEADER = struct.Struct('<4sHc')
+COUNT = struct.Struct('<I')
+STRING = struct.Struct('<H')
+COLUMNS = (
+    ('step_first', 'I'), ('op_changes', 'B'), ('change_var', 'B'), ('change_value', 'i'),
+    ('memory_op', 'I'), ('memory_address', 'B'), ('memory_value', 'I'),
+    ('process_op', 'I'), ('process_pid', 'B'), ('process_fields', 'i'),
+    ('switch_step', 'I'), ('switch_from', 'b'), ('switch_to', 'b'),
+)
+VARIABLES = tuple(r for r in REGISTERS if r != 'PSR') + FLIP_FLOPS + tuple(f"PSR.{c}" for c in PSR_FIELDS)
+PSR_IDS = tuple(VARIABLES.index(f"PSR.{c}") for c in PSR_FIELDS)
+DEFAULT_CHUNK = 65536
+BYTE_ORDER = b'<' if sys.byteorder == 'little' else b'>'
+_psr_fields = itemgetter(*PSR_FIELDS)
+
+
+def _psr(cpu):
+    row = _psr_fields(cpu.PSR)
+    return [-1 if v is None else v for v in row] if None in row else row
+
+
+class Trace:
+    # Records everything block() marks as changed while it is attached to a cpu (cpu.trace),
+    # buffered in typed arrays and written to path every chunk_size micro-ops
+    def __init__(self, cpu, path, chunk_size = DEFAULT_CHUNK):
+        self.cpu = cpu
+        self.chunk_size = chunk_size
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, BYTE_ORDER))
+        self.columns = {name: array(code) for name, code in COLUMNS}
+        for name, column in self.columns.items(): setattr(self, name, column)
+        self.ids = {name: i for i, name in enumerate(VARIABLES)}
+        # (ids as bytes, value getter, count) of every distinct changed_vars list seen so far
+        self.plans = {}
+        self.strings = {}
+        self.new_strings = []
+        self.steps = 0
+        self.micro_ops = 0
+        self.flush_at = chunk_size
+        cpu.trace = self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _string(self, text):
+        sid = self.strings.get(text)
+        if sid is None:
+            sid = self.strings[text] = len(self.strings)
+            self.new_strings.append(text)
+        return sid
+
+    def _plan(self, changed_vars):
+        # 'M' (a memory write) is already in the memory columns, the PSR fields go last
+        names = [name for name in changed_vars if name in self.ids]
+        psr = 'PSR' in changed_vars
+        ids = bytes(self.ids[name] for name in names) + (bytes(PSR_IDS) if psr else b'')
+
+        # one attrgetter call reads every plain value, only IR and PSR need more work
+        if len(names) > 1: get = attrgetter(*names)
+        elif names:
+            one = attrgetter(names[0])
+            get = lambda cpu: (one(cpu),)
+        else: get = lambda cpu: ()
+        if 'IR' in names:
+            ir, string = names.index('IR'), self._string
+            def plain(cpu):
+                out = list(get(cpu))
+                out[ir] = string(out[ir])
+                return out
+        else: plain = get
+        if psr:
+            values = lambda cpu: [*plain(cpu), *_psr(cpu)]
+        else: values = plain
+        return ids, values, len(ids)
+
+    # hooks called by the cpu
+
+    def begin_step(self):
+        self.step_first.append(self.micro_ops)
+        self.steps += 1
+
+    def memory_written(self, address, value):
+        self.memory_op.append(self.micro_ops)
+        self.memory_address.append(address)
+        self.memory_value.append(self._string(value))
+
+    def process_written(self, pid, row):
+        self.process_op.append(self.micro_ops)
+        self.process_pid.append(pid)
+        self.process_fields.extend(-1 if row[c] is None else row[c] for c in PSR_FIELDS)
+
+    def context_switch(self, saved, loaded):
+        self.switch_step.append(self.steps - 1)
+        self.switch_from.append(saved)
+        self.switch_to.append(loaded)
+
+    def record(self, changed_vars):
+        key = tuple(changed_vars)
+        plan = self.plans.get(key)
+        if plan is None: plan = self.plans[key] = self._plan(key)
+        ids, values, count = plan
+        self.change_var.frombytes(ids)
+        self.change_value.extend(values(self.cpu))
+        self.op_changes.append(count)
+        self.micro_ops += 1
+        if self.micro_ops >= self.flush_at: self.flush()
+
+    # output
+
+    def flush(self):
+        # append the buffered chunk to the file and empty the columns
+        file = self.file
+        file.write(COUNT.pack(len(self.new_strings)))
+        for text in self.new_strings:
+            data = text.encode('ascii')
+            file.write(STRING.pack(len(data)))
+            file.write(data)
+        self.new_strings = []
+        for name, _ in COLUMNS:
+            column = self.columns[name]
+            file.write(COUNT.pack(len(column)))
+            column.tofile(file)
+            del column[:]
+        self.flush_at = self.micro_ops + self.chunk_size
+
+    def close(self):
+        if self.file.closed: return
+        if any(self.columns.values()) or self.new_strings: self.flush()
+        self.file.close()
+        if self.cpu.trace is self: self.cpu.trace = None
+
+
+def read_chunks(path):
+    # yield the columns of every chunk (dict of arrays) and the string table read so far
+    strings = []
+    with open(path, 'rb') as file:
+        magic, version, order = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION: raise ValueError('Not a CSM trace (bad header or version)')
+
+        while True:
+            data = file.read(COUNT.size)
+            if not data: return
+            for _ in range(COUNT.unpack(data)[0]):
+                length, = STRING.unpack(file.read(STRING.size))
+                strings.append(file.read(length).decode('ascii'))
+
+            columns = {}
+            for name, code in COLUMNS:
+                length, = COUNT.unpack(file.read(COUNT.size))
+                column = array(code)
+                column.fromfile(file, length)
+                if order != BYTE_ORDER: column.byteswap()
+                columns[name] = column
+            yield columns, strings
+
+
+def load(path):
+    # whole trace as one set of columns, for traces that fit in memory
+    columns = {name: array(code) for name, code in COLUMNS}
+    strings = []
+    for chunk, strings in read_chunks(path):
+        for name, column in chunk.items():
+            columns[name].extend(column)
+    return columns, strings
+
+
+def micro_ops(path):
+    # decoded micro-ops: (step, [(variable, value)], [(address, word)], [(pid, row)])
+    op, step, starts = 0, -1, []
+    for columns, strings in read_chunks(path):
+        starts.extend(columns['step_first'])
+        memory = deque(zip(columns['memory_op'], columns['memory_address'], columns['memory_value']))
+        fields = columns['process_fields']
+        processes = deque((o, pid, fields[7*i:7*i + 7]) for i, (o, pid) in enumerate(zip(columns['process_op'], columns['process_pid'])))
+        change = 0
+        for changes in columns['op_changes']:
+            while step + 1 < len(starts) and starts[step + 1] <= op: step += 1
+            values = []
+            for i in range(change, change + changes):
+                name, value = VARIABLES[columns['change_var'][i]], columns['change_value'][i]
+                if name == 'IR': value = strings[value]
+                elif name.startswith('PSR.') and value == -1: value = None
+                values.append((name, value))
+            change += changes
+
+            words = []
+            while memory and memory[0][0] == op:
+                _, address, sid = memory.popleft()
+                words.append((address, strings[sid]))
+            rows = []
+            while processes and processes[0][0] == op:
+                _, pid, row = processes.popleft()
+                rows.append((pid, {c: None if v == -1 else v for c, v in zip(PSR_FIELDS, row)}))
+            yield step, values, words, rows
+            op += 1
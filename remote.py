@@ -0,0 +1,288 @@
+import multiprocessing
+import struct
+import types
+from multiprocessing import shared_memory
+
+import clock
+import snapshot
+import worker
+from cpu import CPU, REGISTERS, FLIP_FLOPS, ACCOUNTING, psr_values
+
+
+# The cpu in a child process, so a fast run and Tk's mainloop no longer share a GIL.
+# The child runs the same Worker as the UI thread would, the UI talks to it over a pipe:
+#   ('command', name, arguments)    queued like Worker.submit, reported back as (command, error, value)
+#   ('stop',), ('configure', settings), ('frame',) act at once, ('close',) ends the child
+# and reads the machine from a shared memory block the child publishes into whenever the
+# UI asked for a frame and after every command. The block (little endian):
+#   sequence number (odd while the child writes), then STATE: numeric registers, IR text,
+#   flip-flops, PSR and the 8 process table rows (as in snapshot.py), accounting, memory_ptr,
+#   changed variables since the previous publish (bit per REGISTERS + FLIP_FLOPS), requested
+#   and achieved clock rate (0 while not measured yet), then a version number per memory
+#   word and the 256 words of WORD_SIZE bytes. Only words whose version moved are read
+NAMES = REGISTERS + FLIP_FLOPS
+SEQUENCE = struct.Struct('<Q')
+STATE = struct.Struct('<' + 'H' * len(snapshot.NUMERIC_REGISTERS) + f'{snapshot.WORD_SIZE}s' + 'B' * len(FLIP_FLOPS)
+    + snapshot.ROW * 9 + 'Q' * (8 * len(ACCOUNTING)) + 'BQdd')
+VERSIONS = struct.Struct('<256I')
+WORD = struct.Struct(f'<{snapshot.WORD_SIZE}s')
+STATE_AT = SEQUENCE.size
+VERSIONS_AT = STATE_AT + STATE.size
+MEMORY_AT = VERSIONS_AT + VERSIONS.size
+SIZE = MEMORY_AT + 256 * WORD.size
+# memory_ptr as stored
+POINTERS = ('AR', 'PC')
+
+
+def _text(word):
+    # words longer than a slot are cut short in the view only, the child keeps them whole
+    return word.encode('ascii', 'replace')[:snapshot.WORD_SIZE]
+
+
+class Publisher:
+    # child side: writes the machine into the shared block
+    def __init__(self, cpu, buffer):
+        self.cpu = cpu
+        self.buffer = buffer
+        self.sequence = 0
+        self.versions = [0] * 256
+
+    def publish(self):
+        cpu, buffer = self.cpu, self.buffer
+        memory, _ = cpu.take_dirty()
+        self.sequence += 1
+        SEQUENCE.pack_into(buffer, 0, self.sequence)
+
+        rows = [snapshot.pack_row(cpu.PSR)] + [snapshot.pack_row(row) for row in cpu.secondary_memory]
+        changed = sum(1 << i for i, name in enumerate(NAMES) if name in cpu.frame_vars)
+        STATE.pack_into(buffer, STATE_AT,
+            *[getattr(cpu, r) for r in snapshot.NUMERIC_REGISTERS],
+            _text(cpu.IR),
+            *[getattr(cpu, f) for f in FLIP_FLOPS],
+            *[v for row in rows for v in row],
+            *[n for row in cpu.accounting for n in row],
+            POINTERS.index(cpu.memory_ptr), changed, cpu.clock.rate, cpu.clock.achieved or 0)
+        for address in memory:
+            WORD.pack_into(buffer, MEMORY_AT + address * WORD.size, _text(cpu.main_memory[address]))
+            self.versions[address] += 1
+        VERSIONS.pack_into(buffer, VERSIONS_AT, *self.versions)
+
+        self.sequence += 1
+        SEQUENCE.pack_into(buffer, 0, self.sequence)
+        cpu.frame_vars = set()
+        cpu.frame_requested = False
+
+
+class Host(worker.Worker):
+    # child side: the worker, publishing before it reports every command to the UI
+    def __init__(self, cpu, connection, buffer):
+        self.connection = connection
+        self.publisher = Publisher(cpu, buffer)
+        # frames are published straight into the shared block
+        cpu.publish_frame = self.publisher.publish
+        super().__init__(cpu)
+
+    def report(self, command, error, value):
+        self.publisher.publish()
+        self.connection.send((command, error, value))
+
+    # a load or restore replaces the whole machine, its frame redraws every register and flip-flop
+
+    def _load(self, state):
+        try: super()._load(state)
+        finally: self.cpu.frame_vars = set(NAMES)
+
+    def _restore(self, path):
+        try: super()._restore(path)
+        finally: self.cpu.frame_vars = set(NAMES)
+
+
+def host(connection, name, rate, turbo, granularity):
+    # child process: serve the UI until it closes the pipe
+    memory = shared_memory.SharedMemory(name=name)
+    # frame_rate only has to be non-zero: the child never waits for the UI
+    cpu = CPU(rate, turbo, 1, granularity)
+    worker = Host(cpu, connection, memory.buf)
+    worker.publisher.publish()
+    try:
+        while True:
+            message = connection.recv()
+            if message[0] == 'command': worker.submit(message[1], *message[2])
+            elif message[0] == 'stop': worker.stop()
+            elif message[0] == 'configure': worker.configure(**message[1])
+            elif message[0] == 'frame': cpu.request_frame()
+            elif message[0] == 'close': break
+    except EOFError:
+        pass
+    worker.stop()
+    memory.close()
+
+
+class View:
+    # UI side stand-in for the cpu: what the UI reads, from the shared block
+    every_name = set(NAMES)
+    bits = CPU().bits
+    format_value = CPU.format_value
+
+    def __init__(self, buffer, send, rate, turbo, granularity):
+        self.buffer = buffer
+        self.send = send
+        self.turbo = turbo
+        self.granularity = granularity
+        self.frame_rate = 30
+        self.update_ui = False
+        self.clock = types.SimpleNamespace(rate=rate, achieved=None)
+        self.sequence = None        # of the state read last
+        self.asked = None           # sequence a frame was last requested at
+        self.framed = None          # sequence the last frame was taken at
+        self.values = {}
+        self.changed_vars = []
+        self.main_memory = [''] * 256
+        self.versions = [0] * 256
+        self.secondary_memory = [snapshot.unpack_row([snapshot.NO_FLAG] * 4 + [snapshot.NO_VALUE] * 3) for _ in range(8)]
+        self.accounting = [[0] * len(ACCOUNTING) for _ in range(8)]
+        self.memory_ptr = 'PC'
+        self.dirty_memory, self.dirty_processes = set(range(256)), set(range(8))
+        self.frame_memory, self.frame_processes, self.frame_changed = set(), set(), set()
+        self.refresh()
+
+    def __getattr__(self, name):
+        if name in View.every_name:
+            self.refresh()
+            return self.values[name]
+        raise AttributeError(name)
+
+    def refresh(self):
+        # read the block if the child published since the last read
+        buffer = self.buffer
+        while True:
+            sequence, = SEQUENCE.unpack_from(buffer, 0)
+            if sequence == self.sequence: return
+            if sequence % 2: continue
+            state = STATE.unpack_from(buffer, STATE_AT)
+            versions = VERSIONS.unpack_from(buffer, VERSIONS_AT)
+            moved = [address for address in range(256) if versions[address] != self.versions[address]]
+            words = [WORD.unpack_from(buffer, MEMORY_AT + address * WORD.size)[0] for address in moved]
+            if SEQUENCE.unpack_from(buffer, 0)[0] == sequence: break
+        self.sequence = sequence
+
+        i = len(snapshot.NUMERIC_REGISTERS)
+        values = dict(zip(snapshot.NUMERIC_REGISTERS, state[:i]))
+        values['IR'] = state[i].rstrip(b'\0').decode('ascii')
+        i += 1
+        values.update(zip(FLIP_FLOPS, state[i:i + len(FLIP_FLOPS)]))
+        i += len(FLIP_FLOPS)
+        rows = [snapshot.unpack_row(state[i + 7*n:i + 7*n + 7]) for n in range(9)]
+        i += 7 * 9
+        values['PSR'] = rows[0]
+        for pid, row in enumerate(rows[1:]):
+            if row != self.secondary_memory[pid]:
+                self.secondary_memory[pid] = row
+                self.dirty_processes.add(pid)
+                self.frame_processes.add(pid)
+        count = 8 * len(ACCOUNTING)
+        self.accounting = [list(state[i + n:i + n + len(ACCOUNTING)]) for n in range(0, count, len(ACCOUNTING))]
+        i += count
+        pointer, changed, self.clock.rate, achieved = state[i:]
+        self.memory_ptr = POINTERS[pointer]
+        self.clock.achieved = achieved or None
+        self.values = values
+        self.changed_vars = [name for n, name in enumerate(NAMES) if changed >> n & 1]
+        self.frame_changed.update(self.changed_vars)
+
+        for address, word in zip(moved, words):
+            self.main_memory[address] = word.rstrip(b'\0').decode('ascii')
+            self.versions[address] = versions[address]
+        self.dirty_memory.update(moved)
+        self.frame_memory.update(moved)
+
+    def take_dirty(self):
+        self.refresh()
+        memory, processes = self.dirty_memory, self.dirty_processes
+        self.dirty_memory, self.dirty_processes = set(), set()
+        return memory, processes
+
+    def request_frame(self):
+        # one request at a time: ask again once the child published
+        if self.asked == self.sequence:
+            self.refresh()
+            if self.asked == self.sequence: return
+        self.asked = self.sequence
+        self.send(('frame',))
+
+    def take_frame(self):
+        # the state published since the last frame, in the layout of CPU.publish_frame
+        self.refresh()
+        if self.framed == self.sequence: return None
+        self.framed = self.sequence
+        frame = {
+            'values': {name: self.format_value(name) for name in NAMES},
+            'changed': self.frame_changed,
+            'memory': {address: self.main_memory[address] for address in self.frame_memory},
+            'processes': {pid: psr_values(self.secondary_memory[pid]) for pid in self.frame_processes},
+            'memory_ptr': self.values[self.memory_ptr],
+            'TAR': self.values['TAR'],
+        }
+        self.frame_memory, self.frame_processes, self.frame_changed = set(), set(), set()
+        return frame
+
+    def ui_rendered(self):
+        pass
+
+
+class RemoteWorker:
+    # UI side of the child process, used like Worker; self.cpu is the View to draw from
+    every_step = False
+
+    def __init__(self, rate = 1, turbo = False, granularity = 0):
+        context = multiprocessing.get_context('spawn')
+        self.memory = shared_memory.SharedMemory(create=True, size=SIZE)
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=host, args=(child, self.memory.name, rate, turbo, granularity), daemon=True)
+        self.process.start()
+        child.close()
+        # the block is all zeros (sequence 0, empty machine) until the child first publishes
+        self.cpu = View(self.memory.buf, self.connection.send, rate, turbo, granularity)
+        self.pending = 0
+
+    def submit(self, command, *arguments):
+        self.pending += 1
+        self.connection.send(('command', command, arguments))
+
+    def step(self):
+        self.submit('step')
+
+    def run(self, n = None):
+        self.submit('run', n)
+
+    def load(self, state):
+        self.submit('load', state)
+
+    def stop(self):
+        self.connection.send(('stop',))
+
+    def configure(self, turbo = None, granularity = None, frame_rate = None, rate = None):
+        # frame_rate is the UI's own polling rate here, the child never waits for the UI
+        if rate is not None: clock.check_rate(rate)
+        settings = {'turbo': turbo, 'granularity': granularity, 'rate': rate}
+        for name in ('turbo', 'granularity'):
+            if settings[name] is not None: setattr(self.cpu, name, settings[name])
+        if rate is not None: self.cpu.clock.rate = rate
+        self.connection.send(('configure', settings))
+
+    def finished(self):
+        out = []
+        while self.connection.poll():
+            out.append(self.connection.recv())
+        self.pending -= len(out)
+        return out
+
+    def close(self):
+        try:
+            self.connection.send(('close',))
+        except OSError:
+            pass
+        self.process.join(1)
+        self.cpu.buffer = None
+        self.memory.close()
+        self.memory.unlink()
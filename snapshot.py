@@ -0,0 +1,97 @@
+import mmap
+import struct
+
+from cpu import REGISTERS, FLIP_FLOPS, PSR_FIELDS, ACCOUNTING
+
+
+# Fixed little endian layout of a machine snapshot (see CPU.save_state):
+#   magic, version
+#   numeric registers in REGISTERS order (u16 each), IR text (16 bytes)
+#   flip-flops in FLIP_FLOPS order (u8 each)
+#   PSR then the 8 secondary memory rows as S, A1, A0, E (u8) and AC, PC0, PC (u16)
+#   the ACCOUNTING counters of the 8 pids (u64 each), running_pid (u8)
+#   256 main memory words, each as 16 bytes of NUL padded text
+MAGIC = b'CSMS'
+VERSION = 2
+WORD_SIZE = 16
+NUMERIC_REGISTERS = tuple(r for r in REGISTERS if r not in ('IR', 'PSR'))
+# unset process table fields (None)
+NO_FLAG, NO_VALUE = 0xFF, 0xFFFF
+
+ROW = '4B3H'
+LAYOUT = struct.Struct('<4sH' + 'H' * len(NUMERIC_REGISTERS) + f'{WORD_SIZE}s' + 'B' * len(FLIP_FLOPS)
+    + ROW * 9 + 'Q' * (8 * len(ACCOUNTING)) + 'B' + f'{256 * WORD_SIZE}s')
+SIZE = LAYOUT.size
+
+
+def _text(word):
+    data = word.encode('ascii')
+    if len(data) > WORD_SIZE: raise ValueError(f"Word too long for a snapshot: {word}")
+    return data
+
+
+def pack_row(row):
+    return [NO_FLAG if row[c] is None else row[c] for c in PSR_FIELDS[:4]] + [NO_VALUE if row[c] is None else row[c] for c in PSR_FIELDS[4:]]
+
+
+def unpack_row(values):
+    return {c: None if v == (NO_FLAG if i < 4 else NO_VALUE) else v for i, (c, v) in enumerate(zip(PSR_FIELDS, values))}
+
+
+def dumps(cpu):
+    state = cpu.save_state()
+    registers = state['registers']
+    rows = [pack_row(registers['PSR'])] + [pack_row(row) for row in state['processes']]
+    return LAYOUT.pack(
+        MAGIC, VERSION,
+        *[registers[r] for r in NUMERIC_REGISTERS],
+        _text(registers['IR']),
+        *[state['flip_flops'][f] for f in FLIP_FLOPS],
+        *[v for row in rows for v in row],
+        *[n for row in state['accounting'] for n in row],
+        state['running_pid'],
+        b''.join(_text(word).ljust(WORD_SIZE, b'\0') for word in state['memory']),
+    )
+
+
+def loads(cpu, data):
+    # restore a snapshot from any buffer (bytes, mmap) of SIZE bytes
+    if len(data) != SIZE: raise ValueError('Not a CSM snapshot (wrong size)')
+    values = LAYOUT.unpack_from(data)
+    if values[0] != MAGIC or values[1] != VERSION: raise ValueError('Not a CSM snapshot (bad header or version)')
+
+    i = 2
+    registers = dict(zip(NUMERIC_REGISTERS, values[i:i + len(NUMERIC_REGISTERS)]))
+    i += len(NUMERIC_REGISTERS)
+    registers['IR'] = values[i].rstrip(b'\0').decode('ascii')
+    i += 1
+    flip_flops = dict(zip(FLIP_FLOPS, values[i:i + len(FLIP_FLOPS)]))
+    i += len(FLIP_FLOPS)
+    rows = [unpack_row(values[i + 7*n:i + 7*n + 7]) for n in range(9)]
+    i += 7 * 9
+    registers['PSR'] = rows[0]
+    count = 8 * len(ACCOUNTING)
+    accounting = [list(values[i + n:i + n + len(ACCOUNTING)]) for n in range(0, count, len(ACCOUNTING))]
+    i += count
+    running_pid = values[i]
+    memory = values[i + 1].decode('ascii')
+    cpu.restore_state({
+        'registers': registers,
+        'flip_flops': flip_flops,
+        'memory': [memory[a:a + WORD_SIZE].rstrip('\0') for a in range(0, 256 * WORD_SIZE, WORD_SIZE)],
+        'processes': rows[1:],
+        'changed_vars': [],
+        'accounting': accounting,
+        'running_pid': running_pid,
+    })
+
+
+def save(cpu, path):
+    with open(path, 'wb') as file:
+        file.write(dumps(cpu))
+
+
+def load(cpu, path):
+    with open(path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            loads(cpu, data)
@@ -0,0 +1,110 @@
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import batch
+import loader
+from cpu import SCHEDULED, INTERRUPTS
+
+
+def base_order(image):
+    # process order (words 00-07) of a program image, TP entries long
+    tp = image['registers']['TP'] or 1
+    return [int(word, 16) for word in image['memory'][:tp]]
+
+
+def apply(image, quantum = None, order = None, SW = None, IEN = None):
+    # copy of a program image with the scheduling parameters replaced, None keeps the program's value
+    state = {key: value for key, value in image.items()}
+    registers, flip_flops, memory = dict(image['registers']), dict(image['flip_flops']), list(image['memory'])
+    state.update(registers=registers, flip_flops=flip_flops, memory=memory)
+
+    if quantum is not None:
+        if not 0 < quantum <= 0xFF: raise ValueError(f"Quantum out of range (1-255): {quantum}")
+        memory[8] = f"{quantum:X}"
+        registers['TM'] = quantum
+    if order is not None:
+        if len(order) > 8 or any(not 0 <= pid < 8 for pid in order): raise ValueError(f"Invalid process order: {order}")
+        for address, pid in enumerate(order):
+            memory[address] = str(pid)
+        registers['TP'] = len(order)
+        # instructions are charged to the process at PRC in the new order (see CPU.restore_state)
+        state.pop('running_pid', None)
+        # the head of the new order (at address 0) is the process that starts running
+        row = image['processes'][order[0]]
+        if row['PC'] is None: raise ValueError(f'No process loaded at secondary memory location {order[0]}')
+        registers['PSR'] = dict(row)
+        registers['TAR'] = order[0]
+        registers['PRC'] = 0
+        flip_flops['S'] = row['S']
+        for name in ('PC', 'AC'):
+            registers[name] = row[name]
+        for name in ('E', 'A0', 'A1'):
+            flip_flops[name] = row[name]
+    if SW is not None: flip_flops['SW'] = SW
+    if IEN is not None: flip_flops['IEN'] = IEN
+    return state
+
+
+def cases(quanta = None, orders = None, SW = None, IEN = None):
+    # every combination of the given parameter values, an empty/None range keeps the program's value
+    names = ('quantum', 'order', 'SW', 'IEN')
+    ranges = [values or [None] for values in (quanta, orders, SW, IEN)]
+    return [dict(zip(names, values)) for values in itertools.product(*ranges)]
+
+
+def run_case(image, case, max_steps = batch.DEFAULT_MAX_STEPS):
+    # run one combination and collect the scheduling metrics
+    start = time.perf_counter()
+    result = dict(case, steps=0, switches=0, completed={}, halted=False, error=None)
+    try:
+        cpu = batch.headless(apply(image, **case))
+    except ValueError as e:
+        result['error'] = str(e)
+        return result
+
+    # switches are taken from the accounting: context switches and SWT schedule a process,
+    # an I/O interrupt switches to the handler
+    def switches():
+        return sum(row[SCHEDULED] + row[INTERRUPTS] for row in cpu.accounting)
+    before = switches()
+    cpu.running = True
+    while cpu.GS and cpu.error is None and result['steps'] < max_steps:
+        pid, stops = cpu.running_pid, cpu.NS
+        cpu.run_next()
+        result['steps'] += 1
+        # HLT counts a stop, SWT of a stopped process takes one back
+        if cpu.NS > stops: result['completed'][pid] = result['steps']
+    cpu.running = False
+    result['switches'] = switches() - before
+
+    result['halted'] = cpu.GS == 0
+    result['accounting'] = batch.accounting(cpu)
+    result['error'] = None if cpu.error is None else str(cpu.error)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def sweep(path, quanta = None, orders = None, SW = None, IEN = None, max_steps = batch.DEFAULT_MAX_STEPS, jobs = None):
+    image = loader.load_image(path)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(partial(run_case, image, max_steps=max_steps), cases(quanta, orders, SW, IEN)))
+
+
+def table(results):
+    # one text row per combination, completion steps as pid@step
+    header = ('quantum', 'order', 'SW', 'IEN', 'steps', 'switches', 'status', 'completed')
+    rows = [header]
+    for r in results:
+        status = 'halted' if r['halted'] else 'error' if r['error'] else 'limit'
+        rows.append((
+            '-' if r['quantum'] is None else str(r['quantum']),
+            '-' if r['order'] is None else ','.join(map(str, r['order'])),
+            '-' if r['SW'] is None else str(r['SW']),
+            '-' if r['IEN'] is None else str(r['IEN']),
+            str(r['steps']), str(r['switches']), status,
+            ' '.join(f"{pid}@{step}" for pid, step in sorted(r['completed'].items())) or (r['error'] or ''),
+        ))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows)
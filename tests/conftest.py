@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+
+# the simulator modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import support
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    # every test gets its own program image cache
+    path = tmp_path / 'cache'
+    monkeypatch.setenv('CSM_CACHE_DIR', str(path))
+    return path
+
+
+@pytest.fixture
+def count_program(tmp_path):
+    path = tmp_path / 'count.yaml'
+    path.write_text(support.COUNT)
+    return str(path)
+
+
+@pytest.fixture
+def switch_program(tmp_path):
+    path = tmp_path / 'switch.yaml'
+    path.write_text(support.SWITCH)
+    return str(path)
@@ -0,0 +1,52 @@
+import os
+
+import loader
+from cpu import CPU
+
+
+# helpers and programs shared by the tests
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# two processes switched every 2 instructions, pid 0 waits for pid 1 which waits for input
+EXAMPLE = os.path.join(ROOT, 'example_program.yaml')
+# counts AC up from 5 forever, storing it in 21
+COUNT = """
+FF: {GS: 1, S: 1}
+M:
+  0: [0]
+  8: 10
+  10: [LDA 20, ICA, STA 21, BR 11]
+  20: 5
+M2:
+  0: {S: 1, A1: 0, A0: 0, E: 0, AC: 0, PC0: 10, PC: 10}
+"""
+# pid 0 hands over to pid 1 with SWT, pid 1 halts, the context switch returns to pid 0 which
+# restarts the halted pid 1 with another SWT (taking its stop back) and then loops forever
+SWITCH = """
+FF: {GS: 1, S: 1, SW: 0}
+M:
+  0: [0, 1]
+  8: 10
+  10: [SWT 1, SWT 1, BR 12]
+  20: [HLT]
+M2:
+  0: {S: 1, A1: 0, A0: 0, E: 0, AC: 0, PC0: 10, PC: 10}
+  1: {S: 1, A1: 0, A0: 0, E: 0, AC: 0, PC0: 20, PC: 20}
+"""
+
+
+def machine(path = EXAMPLE):
+    # turbo cpu with the program at path loaded
+    cpu = CPU(turbo=True)
+    cpu.restore_state(loader.load_image(path))
+    return cpu
+
+
+def state(cpu):
+    # the machine state to compare, without what the UI would highlight
+    state = cpu.save_state()
+    del state['changed_vars']
+    return state
+
+
+def run(cpu, steps):
+    for _ in range(steps): cpu.run_next()
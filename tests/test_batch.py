@@ -0,0 +1,57 @@
+import shutil
+
+import pytest
+
+import batch
+import compiler
+from cpu import CPU
+from support import EXAMPLE, machine
+
+
+@pytest.mark.parametrize('config', [
+    {'REG': {'PSR': 5}},
+    {'REG': 5},
+    {'M': ['LDA 0A']},
+    {'M2': {0: 3}},
+    {'FF': {'GS': None}},
+])
+def test_wrong_shape_is_value_error(config):
+    with pytest.raises(ValueError):
+        CPU().load_config(config)
+
+
+def test_bad_program_does_not_abort_batch(tmp_path):
+    shutil.copy(EXAMPLE, tmp_path / 'a.yaml')
+    (tmp_path / 'b.yaml').write_text('REG: {PSR: 5}\nM: {8: 5}\n')
+    (tmp_path / 'c.yaml').write_text('REG: [\n')
+    report = batch.run_many(batch.find_programs([str(tmp_path)]), max_steps=100, jobs=2)
+    assert report['programs'] == 3
+    assert report['errors'] == 2
+    good, bad, unparsable = report['results']
+    assert good['error'] is None and good['steps'] == 100
+    assert bad['error'] == 'Invalid PSR register format'
+    assert unparsable['error'].startswith('Invalid YAML')
+
+
+def test_deadline_ends_the_run_at_once():
+    # a run past its deadline returns at the first time check, nothing runs after the engine
+    cpu = machine()
+    engine = compiler.BlockEngine(cpu)
+    ran = []
+    step = engine.step
+    engine.step = lambda budget: ran.append(step(budget)) or ran[-1]
+    steps, timed_out = batch.run(cpu, 10**6, deadline=0, engine=engine)
+    assert timed_out and steps == sum(ran) and steps < 10**6
+
+
+@pytest.mark.parametrize('breaks', [(), ('99',)])
+def test_timed_out(count_program, breaks):
+    result = batch.run_program(count_program, max_steps=10**6, max_seconds=0, breaks=breaks)
+    assert result['timed_out'] and result['error'] is None
+    assert result.get('breakpoint') is None
+    assert not batch.run_program(count_program, max_steps=100, max_seconds=60, breaks=breaks)['timed_out']
+
+
+def test_run_error_is_reported(tmp_path):
+    result = batch.run_program(EXAMPLE, max_steps=10, trace=str(tmp_path / 'missing' / 'trace'))
+    assert result['error'] and not result['timed_out']
@@ -0,0 +1,59 @@
+import pytest
+
+import batch
+from breakpoints import Breakpoints
+from cpu import CPU
+
+
+@pytest.fixture
+def run(count_program):
+    return lambda *breaks: batch.run_program(count_program, max_steps=1000, breaks=breaks)
+
+
+def test_pc_breakpoint(run):
+    result = run('13')
+    assert result['breakpoint'] == 'Breakpoint at 13'
+    assert result['steps'] == 3 and result['state']['REG']['PC'] == '13'
+    assert not result['halted'] and not result['timed_out']
+
+
+def test_watchpoint(run):
+    result = run('M 21')
+    assert result['breakpoint'] == 'M[21] written: 006'
+    assert result['steps'] == 3
+
+
+def test_condition_at_address(run):
+    result = run('11: AC == 8')
+    assert result['breakpoint'] == '11: AC == 8'
+    assert result['state']['REG']['PC'] == '11' and result['state']['REG']['AC'] == '008'
+
+
+def test_condition_anywhere(run):
+    result = run('AC >= A')
+    assert result['breakpoint'] == 'AC >= A'
+    assert result['state']['REG']['AC'] == '00A'
+
+
+def test_no_breakpoints_runs_on(run):
+    result = run()
+    assert 'breakpoint' not in result and result['steps'] == 1000
+
+
+@pytest.mark.parametrize('text', ['100', 'M ZZ', 'AC ~ 1', 'XX == 1', '20: PSR == 1'])
+def test_invalid(text):
+    stops = Breakpoints(CPU())
+    with pytest.raises(ValueError):
+        stops.add(text)
+    assert stops.describe() == [] and stops.cpu.breakpoints is None
+
+
+def test_describe_and_clear():
+    cpu = CPU()
+    stops = Breakpoints(cpu)
+    for text in ('20', 'm b', 'tar == 3', '1f: ac != 0'):
+        stops.add(text)
+    assert stops.describe() == ['20', 'M 0B', 'TAR == 3', '1F: AC != 0']
+    assert cpu.breakpoints is stops
+    stops.clear()
+    assert stops.describe() == [] and cpu.breakpoints is None
@@ -0,0 +1,31 @@
+import threading
+import time
+
+import pytest
+
+import clock
+
+
+@pytest.mark.parametrize('rate', [0, 0.05, 50001])
+def test_rate_out_of_range(rate):
+    with pytest.raises(ValueError):
+        clock.Clock(rate)
+
+
+def test_paces_ticks():
+    pacer = clock.Clock(200)
+    start = time.perf_counter()
+    for _ in range(50): pacer.tick()
+    elapsed = time.perf_counter() - start
+    assert 0.24 <= elapsed < 0.5
+
+
+def test_stop_releases_a_waiting_tick():
+    # a tick at 0.1 Hz would wait 10 s
+    pacer = clock.Clock(0.1)
+    thread = threading.Thread(target=pacer.tick)
+    thread.start()
+    time.sleep(0.05)
+    pacer.stop()
+    thread.join(1)
+    assert not thread.is_alive()
@@ -0,0 +1,13 @@
+import pytest
+
+import batch
+from support import EXAMPLE
+
+
+@pytest.mark.parametrize('steps', [1, 7, 500])
+def test_blocks_match_instructions(count_program, steps):
+    for program in (count_program, EXAMPLE):
+        reference = batch.run_program(program, max_steps=steps)
+        compiled = batch.run_program(program, max_steps=steps, compiled=True)
+        for key in ('steps', 'halted', 'error', 'state', 'accounting'):
+            assert compiled[key] == reference[key]
@@ -0,0 +1,34 @@
+import pytest
+
+import loader
+from support import machine, state
+
+
+RESET_EMPTY = """
+FF: {GS: 1, S: 1}
+REG: {PRC: 1}
+M:
+  0: [0, 1]
+  8: 10
+  10: [RST]
+M2:
+  0: {S: 1, A1: 0, A0: 0, E: 0, AC: 0, PC0: 10, PC: 10}
+"""
+
+
+def test_reset_of_an_empty_row(tmp_path):
+    # RST fails on a row without a process before copying it into PSR
+    program = tmp_path / 'reset.yaml'
+    program.write_text(RESET_EMPTY)
+    cpu = machine(str(program))
+    psr = cpu.PSR.copy()
+    cpu.run_next()
+    assert str(cpu.error) == 'No process loaded at secondary memory location 1'
+    assert cpu.PSR == psr and cpu.secondary_memory[1]['PC'] is None
+
+    # numpy is optional, so is the lockstep check
+    lockstep = pytest.importorskip('lockstep')
+    machines = lockstep.Lockstep([loader.load_image(str(program))])
+    machines.step()
+    assert machines.error(0) == str(cpu.error)
+    assert machines.state(0) == dict(state(cpu), changed_vars=[])
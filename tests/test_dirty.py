@@ -0,0 +1,33 @@
+import sys
+import threading
+
+from cpu import CPU
+
+
+def test_take_dirty_while_writing():
+    # the UI thread takes and walks the dirty rows while the simulation thread writes,
+    # switching threads as often as possible: no error and no write is lost
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        cpu = CPU()
+        cpu.take_dirty()
+        done = threading.Event()
+        def writer():
+            for n in range(20000):
+                cpu.write_memory(n % 256, 'NOP')
+                cpu.write_process(n % 8, dict(cpu.secondary_memory[n % 8]))
+            done.set()
+        thread = threading.Thread(target=writer)
+        thread.start()
+        memory, processes = set(), set()
+        while True:
+            finished = done.is_set()
+            taken_memory, taken_processes = cpu.take_dirty()
+            for address in taken_memory: memory.add(address)
+            for pid in taken_processes: processes.add(pid)
+            if finished: break
+        thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert memory == set(range(256)) and processes == set(range(8))
@@ -0,0 +1,59 @@
+import pytest
+
+import loader
+from cpu import CPU
+from history import History
+from support import machine, state, run
+
+
+@pytest.mark.parametrize('max_deltas', [200000, 50])
+def test_step_back_restores_state_and_accounting(max_deltas):
+    # a small ring makes step_back replay from a checkpoint
+    cpu = machine()
+    history = History(cpu, max_deltas=max_deltas, checkpoint_interval=10)
+    run(cpu, 30)
+    before = state(cpu)
+    run(cpu, 20)
+    after = state(cpu)
+
+    history.step_back(20)
+    assert state(cpu) == before
+    run(cpu, 20)
+    assert state(cpu) == after
+    assert any(row[0] for row in after['accounting'][1:])
+
+
+def test_step_back_past_start():
+    cpu = machine()
+    history = History(cpu)
+    run(cpu, 3)
+    with pytest.raises(ValueError):
+        history.step_back(4)
+    history.step_back(3)
+    assert state(cpu) == state(machine())
+
+
+@pytest.mark.parametrize('granularity', [0, 1 << 30])
+@pytest.mark.parametrize('seed', range(40))
+def test_step_back_random_programs(seed, granularity):
+    # every opcode, context switches and interrupts: each step back returns the state before the step
+    import random
+    import fuzz
+    try:
+        image = loader.compile_config(fuzz.program(random.Random(seed)))
+    except ValueError:
+        pytest.skip('invalid program')
+    cpu = CPU(turbo=True)
+    cpu.restore_state(image)
+    # a coarse cpu records whole instructions
+    cpu.granularity = granularity
+    cpu.running = True
+    history = History(cpu)
+    states = [state(cpu)]
+    while len(states) <= 60 and cpu.GS and cpu.error is None:
+        cpu.run_next()
+        states.append(state(cpu))
+    states.pop()
+    while states:
+        history.step_back()
+        assert state(cpu) == states.pop()
@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+import batch
+import loader
+from support import EXAMPLE
+
+
+@pytest.fixture(autouse=True)
+def fresh_images():
+    loader._images.clear()
+    yield
+    loader._images.clear()
+
+
+def cache_file(cache_dir):
+    files = list(cache_dir.glob(f"*.v{loader.CACHE_VERSION}.json"))
+    assert len(files) == 1
+    return files[0]
+
+
+def test_cache_round_trip(cache_dir):
+    image = loader.load_image(EXAMPLE)
+    assert loader.load_image(EXAMPLE) is image
+    loader._images.clear()
+    assert json.loads(cache_file(cache_dir).read_text()) == image
+    assert loader.load_image(EXAMPLE) == image
+
+
+@pytest.mark.parametrize('damage', [
+    lambda image: [1],
+    lambda image: {},
+    lambda image: dict(image, memory=image['memory'][:10]),
+    lambda image: dict(image, registers=dict(image['registers'], PC='0F')),
+    lambda image: dict(image, processes=[None] * 8),
+    lambda image: dict(image, accounting=[[0]] * 8),
+])
+def test_damaged_cache_is_parsed_again(cache_dir, damage):
+    image = loader.load_image(EXAMPLE, cache=False)
+    loader.load_image(EXAMPLE)
+    loader._images.clear()
+    path = cache_file(cache_dir)
+    path.write_text(json.dumps(damage(image)))
+    assert loader.load_image(EXAMPLE) == image
+    loader._images.clear()
+    assert json.loads(path.read_text()) == image
+    assert batch.run_program(EXAMPLE, max_steps=10)['error'] is None
+
+
+def test_no_cache(cache_dir):
+    image = loader.load_image(EXAMPLE, cache=False)
+    assert not cache_dir.exists()
+    assert loader.load_image(EXAMPLE, cache=False) is not image
+    cached = loader.load_image(EXAMPLE)
+    assert loader.load_image(EXAMPLE, cache=False) is not cached
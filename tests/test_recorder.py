@@ -0,0 +1,33 @@
+import batch
+import recorder
+
+
+def test_swt_is_a_recorded_switch(tmp_path, switch_program):
+    trace = tmp_path / 'switch.csmt'
+    result = batch.run_program(switch_program, max_steps=20, trace=str(trace))
+    assert result['error'] is None
+    columns, _ = recorder.load(trace)
+    # SWT, context switch after the HLT, SWT, context switch
+    assert list(zip(columns['switch_from'], columns['switch_to'])) == [(0, 1), (1, 0), (0, 1), (1, 0)]
+    steps = list(columns['switch_step'])
+    assert steps == sorted(steps) and len(columns['step_first']) == 20
+
+
+def test_io_interrupt_is_a_recorded_switch(tmp_path):
+    program = tmp_path / 'interrupt.yaml'
+    program.write_text("""
+FF: {GS: 1, S: 1, IEN: 1, FGI: 1}
+M:
+  0: [0]
+  8: 10
+  9: 30
+  10: [BR 10]
+  30: [BR 30]
+M2:
+  0: {S: 1, A1: 0, A0: 0, E: 0, AC: 0, PC0: 10, PC: 10}
+""")
+    trace = tmp_path / 'interrupt.csmt'
+    result = batch.run_program(str(program), max_steps=5, trace=str(trace))
+    assert result['error'] is None and result['state']['REG']['PC'] == '30'
+    columns, _ = recorder.load(trace)
+    assert list(zip(columns['switch_step'], columns['switch_from'], columns['switch_to'])) == [(0, 0, 0)]
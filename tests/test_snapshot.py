@@ -0,0 +1,25 @@
+import pytest
+
+import snapshot
+from support import machine, state, run
+
+
+def test_round_trip(tmp_path):
+    cpu = machine()
+    run(cpu, 40)
+    path = tmp_path / 'machine.csms'
+    snapshot.save(cpu, path)
+    restored = machine()
+    run(restored, 7)
+    snapshot.load(restored, path)
+    assert state(restored) == state(cpu)
+    run(cpu, 10)
+    run(restored, 10)
+    assert state(restored) == state(cpu)
+
+
+def test_rejects_other_data():
+    with pytest.raises(ValueError):
+        snapshot.loads(machine(), b'\0' * snapshot.SIZE)
+    with pytest.raises(ValueError):
+        snapshot.loads(machine(), b'CSMS')
@@ -0,0 +1,23 @@
+import loader
+import sweep
+from cpu import CPU
+
+
+def test_swt_switches_and_completions(switch_program):
+    result = sweep.run_case(loader.load_image(switch_program), sweep.cases()[0], max_steps=20)
+    assert result['error'] is None and not result['halted']
+    # two SWT and two context switches, only pid 1 ever halted
+    assert result['switches'] == 4
+    assert list(result['completed']) == [1]
+
+
+def test_reorder_starts_the_head(switch_program):
+    # the machine stopped in pid 0 with PRC at 1: after the reorder pid 1 runs from PRC 0
+    image = loader.load_image(switch_program)
+    image = dict(image, registers=dict(image['registers'], PRC=1), flip_flops=dict(image['flip_flops'], S=0))
+    state = sweep.apply(image, order=[1, 0])
+    assert state['registers']['PRC'] == 0 and state['registers']['TAR'] == 1
+    assert state['flip_flops']['S'] == 1 and state['registers']['PC'] == 0x20
+    cpu = CPU(turbo=True)
+    cpu.restore_state(state)
+    assert cpu.current_pid() == 1
@@ -0,0 +1,129 @@
+import time
+
+import pytest
+
+import loader
+import remote
+from cpu import CPU
+from support import state
+from worker import Worker
+
+
+@pytest.fixture
+def image(count_program):
+    return loader.load_image(count_program)
+
+
+def wait(worker, n = 1, timeout = 10):
+    # the next n finished commands
+    out = []
+    deadline = time.monotonic() + timeout
+    while len(out) < n:
+        assert time.monotonic() < deadline, f"only {out} finished"
+        out += worker.finished()
+        time.sleep(0.001)
+    return out
+
+
+def test_commands(image):
+    cpu = CPU(turbo=True)
+    worker = Worker(cpu)
+    worker.load(image)
+    worker.run(9)
+    assert wait(worker, 2) == [('load', None, None), ('run', None, None)]
+    nine = state(cpu)
+    worker.step()
+    worker.submit('step_back')
+    assert wait(worker, 2) == [('step', None, None), ('step_back', None, None)]
+    assert state(cpu) == nine
+
+    worker.submit('edit', 'register', 'AC', '123')
+    worker.submit('edit', 'memory', 0x20, '7')
+    worker.submit('add_breakpoint', '13')
+    assert [value for _, _, value in wait(worker, 3)] == [None, None, ['13']]
+    assert cpu.AC == 0x123 and cpu.main_memory[0x20] == '7'
+    worker.run()
+    assert wait(worker) == [('run', None, 'Breakpoint at 13')]
+    assert cpu.main_memory[0x21] == '124'
+    worker.close()
+
+
+def test_stop(image):
+    cpu = CPU(turbo=True)
+    worker = Worker(cpu)
+    worker.load(image)
+    worker.submit('clear_breakpoints')
+    worker.run()
+    wait(worker, 2)
+    time.sleep(0.05)
+    worker.stop()
+    assert wait(worker) == [('run', None, None)]
+    assert not cpu.running and cpu.GS == 1
+    # a step back past the recorded history is reported, not raised
+    worker.load(image)
+    worker.submit('step_back')
+    (_, (command, error, _)) = wait(worker, 2)
+    assert command == 'step_back' and isinstance(error, ValueError)
+    worker.close()
+
+
+def test_remote(image):
+    worker = remote.RemoteWorker(turbo=True)
+    try:
+        worker.load(image)
+        worker.run(10)
+        assert wait(worker, 2) == [('load', None, None), ('run', None, None)]
+        view = worker.cpu
+        assert view.AC == 8 and view.PC == 0x11
+        assert view.main_memory[0x21] == '008'
+        assert view.accounting[0][0] == 10
+        worker.submit('edit', 'register', 'AC', 'FFF')
+        wait(worker)
+        assert view.AC == 0xFFF
+    finally:
+        worker.close()
+
+
+def test_remote_load_changes_everything(image, tmp_path):
+    worker = remote.RemoteWorker(turbo=True)
+    try:
+        view = worker.cpu
+        worker.load(image)
+        wait(worker)
+        assert view.take_frame()['changed'] == set(remote.NAMES)
+        worker.submit('save', str(tmp_path / 'saved.csms'))
+        worker.step()
+        wait(worker, 2)
+        assert view.take_frame()['changed'] != set(remote.NAMES)
+        worker.submit('restore', str(tmp_path / 'saved.csms'))
+        wait(worker)
+        frame = view.take_frame()
+        assert frame['changed'] == set(remote.NAMES) and view.PC == 0x10
+    finally:
+        worker.close()
+
+
+def test_process_edit_writes_a_whole_row(image):
+    cpu = CPU(turbo=True)
+    worker = Worker(cpu)
+    worker.load(image)
+    worker.submit('edit', 'process', (3, 'PC'), 0x40)
+    wait(worker, 2)
+    assert cpu.secondary_memory[3] == {'S': 0, 'A1': 0, 'A0': 0, 'E': 0, 'AC': 0, 'PC0': 0, 'PC': 0x40}
+    assert 3 in cpu.take_dirty()[1]
+    worker.close()
+
+
+def test_any_error_is_reported(image):
+    cpu = CPU(turbo=True)
+    worker = Worker(cpu)
+    worker.load(image)
+    worker.submit('edit', 'process', (3, 'XX'), 1)
+    worker.submit('edit', 'process', (9, 'PC'), 1)
+    worker.submit('add_breakpoint', None)
+    errors = [error for _, error, _ in wait(worker, 4)[1:]]
+    assert [type(e) for e in errors] == [ValueError, IndexError, AttributeError]
+    # the worker still serves
+    worker.run(3)
+    assert wait(worker) == [('run', None, None)]
+    worker.close()
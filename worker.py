@@ -0,0 +1,168 @@
+import queue
+import threading
+
+import breakpoints
+import history
+import snapshot
+from cpu import PSR_FIELDS
+
+
+# commands a step or run submitted before a stop() are cancelled
+RUNS = ('step', 'run')
+
+
+class Worker:
+    # The one simulation thread of the UI. It owns the cpu with its undo history and
+    # breakpoints, every change to them is a command: commands queue up and run in order,
+    # each is reported on self.done as (command, error, value) for the submitting (UI)
+    # thread to take with finished(), so only that thread looks at pending. Commands are
+    # plain data (see remote.py, which runs the same worker in a child process).
+    # stop() and configure() do not queue: stop() ends a run in progress at once and cancels
+    # the steps and runs submitted before it
+    every_step = True               # the UI can render every micro-op (update_ui handshake)
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.history = history.History(cpu)
+        self.breakpoints = breakpoints.Breakpoints(cpu)
+        self.commands = queue.Queue()
+        self.done = queue.Queue()
+        self.pending = 0            # submitted and not yet taken with finished()
+        self.generation = 0         # stop() count, commands of an older generation are cancelled
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def submit(self, command, *arguments):
+        self.pending += 1
+        self.commands.put((command, arguments, self.generation))
+
+    def step(self):
+        self.submit('step')
+
+    def run(self, n = None):
+        # run until stopped, GS drops, an instruction fails or a breakpoint is hit, at most n instructions
+        self.submit('run', n)
+
+    def load(self, state):
+        # reinitialise the cpu with the program image state, None leaves it empty
+        self.submit('load', state)
+
+    def stop(self):
+        self.generation += 1
+        self.cpu.running = False
+        self.cpu.clock.stop()
+
+    def configure(self, turbo = None, granularity = None, frame_rate = None, rate = None):
+        # speed and rendering settings, they apply to a run in progress
+        cpu = self.cpu
+        if rate is not None: cpu.clock.set_rate(rate)
+        if turbo is not None: cpu.turbo = turbo
+        if granularity is not None: cpu.granularity = granularity
+        if frame_rate is not None:
+            cpu.frame_rate = frame_rate
+            cpu.ui_rendered()
+
+    def close(self):
+        self.stop()
+
+    def finished(self):
+        # the (command, error, value) of every command finished since the last call
+        out = []
+        while True:
+            try:
+                out.append(self.done.get_nowait())
+            except queue.Empty:
+                break
+        self.pending -= len(out)
+        return out
+
+    def serve(self):
+        cpu = self.cpu
+        while True:
+            command, arguments, generation = self.commands.get()
+            cpu.error = None
+            value = None
+            try:
+                if command in RUNS and generation != self.generation: pass
+                elif command == 'run': value = self._run(generation, *arguments)
+                else: value = getattr(self, '_' + command)(*arguments)
+            except Exception as v:
+                # whatever a command raises is its reported error, the thread serves on
+                cpu.error = v
+            self.report(command, cpu.error, value)
+
+    def report(self, command, error, value):
+        self.done.put((command, error, value))
+
+    # commands, run on the worker. step and run return the breakpoint they stopped at
+
+    def _step(self):
+        self.cpu.clock.start()
+        self.cpu.run_next()
+        return self._hit()
+
+    def _run(self, generation, n):
+        cpu = self.cpu
+        cpu.clock.start()
+        # a stop() between taking the command and here still cancels it
+        cpu.running = generation == self.generation
+        count = 0
+        while cpu.running and cpu.GS and cpu.error is None and (n is None or count < n):
+            cpu.run_next()
+            count += 1
+        cpu.running = False
+        return self._hit()
+
+    def _hit(self):
+        hit, self.breakpoints.hit = self.breakpoints.hit, None
+        return hit
+
+    def _load(self, state):
+        cpu = self.cpu
+        cpu.__init__(cpu.clock.rate, cpu.turbo, cpu.frame_rate, cpu.granularity)
+        cpu.changed_vars = []
+        try:
+            if state is not None: cpu.restore_state(state)
+        except ValueError:
+            cpu.__init__(cpu.clock.rate, cpu.turbo, cpu.frame_rate, cpu.granularity)
+            raise
+        finally:
+            # hook the history and breakpoints into the reinitialised cpu
+            self.history.reset()
+            self.breakpoints.attach()
+            cpu.memory_ptr = 'PC'
+
+    def _edit(self, kind, key, value):
+        # user edit: register/flip-flop name, memory address or (pid, field) of the process table
+        cpu = self.cpu
+        if kind == 'register':
+            cpu.set_value(key, value)
+            cpu.changed_vars = [key]
+        elif kind == 'memory':
+            cpu.write_memory(key, value)
+        elif kind == 'process':
+            pid, field = key
+            if field not in PSR_FIELDS: raise ValueError(f"No such process table field as {field}")
+            # a whole row, the fields of a row that was never loaded start at 0
+            row = {c: 0 if v is None else v for c, v in cpu.secondary_memory[pid].items()}
+            row[field] = value
+            cpu.write_process(pid, row)
+        self.history.reset()
+
+    def _step_back(self):
+        self.history.step_back()
+
+    def _save(self, path):
+        snapshot.save(self.cpu, path)
+
+    def _restore(self, path):
+        snapshot.load(self.cpu, path)
+        self.history.reset()
+
+    def _add_breakpoint(self, text):
+        # returns the breakpoints now set, as text
+        self.breakpoints.add(text)
+        return self.breakpoints.describe()
+
+    def _clear_breakpoints(self):
+        self.breakpoints.clear()
+        return []